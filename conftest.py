@@ -5,13 +5,16 @@ import os
 from unittest.mock import patch
 from uuid import UUID
 
+import arrow
 from pyramid.paster import get_appsettings, setup_logging
-from pyramid.testing import DummyRequest
+from pyramid.testing import DummyRequest, testConfig
 import pytest
 from webtest import TestApp
 
+from wanmap import ROUTE_MODULES
 from wanmap.network import Router
 from wanmap.scanners import Scanner
+from wanmap.scans import PING_SWEEP, SplittingScan
 import wanmap.schema
 
 FAKE_DNS_MAP = {
@@ -42,6 +45,17 @@ def view_request(dbsession):
     return DummyRequest(dbsession=dbsession)
 
 
+@pytest.fixture
+def rendering_request(view_request):
+    """A request with every route, for rendering pages with navigation."""
+    with testConfig(request=view_request) as config:
+        view_request.registry = config.registry
+        config.include('pyramid_jinja2')
+        for module in ROUTE_MODULES:
+            config.include(module)
+        yield view_request
+
+
 # Is this redundant w/o making app session-scope?
 @pytest.fixture
 def fresh_app(app):
@@ -118,3 +132,61 @@ def fake_wan_routers(dbsession):
     routers = tuple(starmap(Router.create, routers))
     dbsession.add_all(routers)
     return routers
+
+
+def build_result_xml(*hosts):
+    """
+    Builds nmap XML results from hosts of (address, status, {port: state}),
+    optionally followed by (srtt, rttvar) round trip times in microseconds.
+    """
+    elements = []
+    for address, status, ports, *times in hosts:
+        ports = ''.join(
+            f'<port protocol="tcp" portid="{number}">'
+            f'<state state="{state}"/></port>'
+            for number, state in ports.items())
+        times = ''.join(
+            f'<times srtt="{srtt}" rttvar="{rttvar}" to="100000"/>'
+            for srtt, rttvar in times)
+        elements.append(
+            f'<host><status state="{status}"/>'
+            f'<address addr="{address}" addrtype="ipv4"/>'
+            f'<ports>{ports}</ports>{times}</host>')
+    return f'<nmaprun>{"".join(elements)}</nmaprun>'
+
+
+@pytest.fixture
+def result_xml():
+    return build_result_xml
+
+
+@pytest.fixture
+def create_scan(dbsession, fake_wan_scanners, fake_wan_routers):
+    """Creates splitting scans of a subnet of the E2E fake WAN."""
+    def create_scan(parameters=PING_SWEEP, targets=('10.1.0.0/24',)):
+        scan = SplittingScan.create(
+            dbsession, parameters=parameters, targets=targets)
+        dbsession.add(scan)
+        dbsession.flush()
+        return scan
+    return create_scan
+
+
+@pytest.fixture
+def complete_scan(dbsession):
+    """Completes every subscan of a scan with the same results."""
+    def complete_scan(scan, xml_results, finished_at=None):
+        finished_at = finished_at or arrow.now().datetime
+        for subscan in scan.subscans:
+            subscan.complete(xml_results, (finished_at, finished_at))
+        dbsession.flush()
+        return scan
+    return complete_scan
+
+
+@pytest.fixture
+def scan_results(create_scan, complete_scan):
+    """Creates splitting scans completed with results."""
+    def scan_results(xml_results, parameters=PING_SWEEP, finished_at=None):
+        return complete_scan(create_scan(parameters), xml_results, finished_at)
+    return scan_results
@@ -71,9 +71,9 @@ def test_splitting_scan_live(base_url, selenium):
 
     time.sleep(5)
     scan_results = selenium.find_element_by_id('scanner1-results').text
-    assert '<address addr="10.1.0.1" addrtype="ipv4"/>' in scan_results
+    assert '10.1.0.1' in scan_results
     scan_results = selenium.find_element_by_id('scanner2-results').text
-    assert '<address addr="10.2.0.1" addrtype="ipv4"/>' in scan_results
+    assert '10.2.0.1' in scan_results
 
 
 @pytest.mark.selenium
@@ -100,9 +100,9 @@ def test_delta_scan_live(base_url, selenium):
 
     time.sleep(5)
     scan_results = selenium.find_element_by_id('external-results').text
-    assert '<address addr="203.0.113.1" addrtype="ipv4"/>' not in scan_results
+    assert '203.0.113.1' not in scan_results
     scan_results = selenium.find_element_by_id('dmzscanner-results').text
-    assert '<address addr="203.0.113.1" addrtype="ipv4"/>' in scan_results
+    assert '203.0.113.1' in scan_results
 
 
 @pytest.mark.parametrize('trial', range(5))     # Retry test of nondeterminism
@@ -43,5 +43,7 @@ setup(name='wanmap',
       main = wanmap:main
       [console_scripts]
       initialize_wanmap_db = wanmap.scripts.initializedb:main
+      ingest_wanmap_configs = wanmap.scripts.ingestconfigs:main
+      export_wanmap_results = wanmap.scripts.exportresults:main
       """,
       )
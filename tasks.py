@@ -191,9 +191,11 @@ def configure_guest(ctx):
         'cp /wanmap/config/wanmap-vwan.service /etc/systemd/system')
     guest.run(
         'cp /wanmap/config/wanmap-task-queue.service /etc/systemd/system')
+    guest.run(
+        'cp /wanmap/config/wanmap-scheduler.service /etc/systemd/system')
     guest.run('systemctl daemon-reload')
 
-    guest.run('systemctl start wanmap-console wanmap-vwan')
+    guest.run('systemctl start wanmap-console wanmap-scheduler wanmap-vwan')
 
 
 @task
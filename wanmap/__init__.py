@@ -7,7 +7,8 @@ from sqlalchemy.orm import configure_mappers
 from .schema import Persistable
 # Import persistable subclasses without cycles.
 from . import (     # noqa
-    network, scans,
+    changes, deltas, executions, history, network, scans, schedules,
+    timing,
 )
 
 # run configure_mappers after defining all of the models to ensure
@@ -26,6 +27,14 @@ def setup_shell(env):
     })
 
 
+# Modules whose routes make up the application, including the navigation
+ROUTE_MODULES = (
+    'wanmap.api', 'wanmap.changes', 'wanmap.console', 'wanmap.deltas',
+    'wanmap.history', 'wanmap.network', 'wanmap.scans', 'wanmap.scanners',
+    'wanmap.schedules',
+)
+
+
 def main(global_config, **settings):
     """Standard web server entry point."""
     return make_wsgi_app(settings)
@@ -38,9 +47,7 @@ def make_wsgi_app(settings):
     session_factory = SignedCookieSessionFactory('secret')
     config.set_session_factory(session_factory)
     config.include('.schema')
-    config.include('.console')
-    config.include('.network')
-    config.include('.scans')
-    config.include('.scanners')
+    for module in ROUTE_MODULES:
+        config.include(module)
     config.scan()
     return config.make_wsgi_app()
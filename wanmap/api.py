@@ -0,0 +1,362 @@
+"""Versioned JSON API for automation, with NDJSON streaming of results."""
+
+from itertools import groupby
+import json
+import logging
+from uuid import UUID
+
+import arrow
+import colander
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound
+from pyramid.response import Response
+from pyramid.view import view_config
+from sqlalchemy import func, tuple_
+from sqlalchemy.orm import selectinload, with_expression
+
+from .export import export_chunks, EXPORT_FORMATS
+from .history import find_host_history, HOST_HISTORY_FILTERS
+from .scans import (
+    BulkScanSchema, decode_scan_cursor, encode_scan_cursor, filter_scans,
+    get_scannable_subnets, get_scanner_names, schedule_scans, Scan, Subscan,
+    SubscanHost, SubscanPort, SCAN_DETAIL_LOADER_OPTIONS,
+    SCAN_LISTING_FILTERS, SCAN_LISTING_PAGE_LENGTH,
+)
+
+API_PREFIX = '/api/v1'
+API_MAX_PAGE_LENGTH = 1000
+# Rows fetched per round trip of a server-side cursor.
+STREAM_BATCH_SIZE = 1000
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+logger = logging.getLogger(__name__)
+
+
+def includeme(config):
+    config.add_route('api_scans', f'{API_PREFIX}/scans')
+    config.add_route('api_scan', f'{API_PREFIX}/scans/{{id}}')
+    config.add_route(
+        'api_subscan', f'{API_PREFIX}/scans/{{id}}/subscans/{{scanner_name}}')
+    config.add_route('api_scan_hosts', f'{API_PREFIX}/scans/{{id}}/hosts')
+    config.add_route('api_export', f'{API_PREFIX}/export')
+    config.add_route('api_host_history', f'{API_PREFIX}/hosts')
+
+
+@view_config(route_name='api_scans', request_method='GET', renderer='json')
+def api_scans(request):
+    """Lists scans newest first, paged like the console's scan listing."""
+    filters = {
+        key: request.params[key] for key in SCAN_LISTING_FILTERS
+        if request.params.get(key)
+    }
+    try:
+        limit = int(request.params.get('limit', SCAN_LISTING_PAGE_LENGTH))
+        if not 0 < limit <= API_MAX_PAGE_LENGTH:
+            raise ValueError(f'Limit must be 1 to {API_MAX_PAGE_LENGTH}.')
+        query = filter_scans(request.dbsession.query(Scan), **filters)
+        before = request.params.get('before')
+        if before:
+            query = query.filter(
+                tuple_(Scan.created_at, Scan.id) < decode_scan_cursor(before))
+    except ValueError as e:
+        raise HTTPBadRequest(str(e))
+    scans = (
+        query.
+        order_by(Scan.created_at.desc(), Scan.id.desc()).
+        limit(limit + 1).
+        all())
+    next_page = None
+    if len(scans) > limit:
+        scans = scans[:limit]
+        next_page = request.route_url('api_scans', _query=dict(
+            filters, limit=limit, before=encode_scan_cursor(scans[-1])))
+    return {
+        'scans': [scan_json(request, scan) for scan in scans],
+        'next': next_page,
+    }
+
+
+@view_config(route_name='api_scans', request_method='POST', renderer='json')
+def api_submit_scans(request):
+    """
+    Schedules a batch of scans, given as ``{"scans": [...]}``.
+
+    Each scan has the fields of the new scan form. The batch is validated
+    as a whole and either every scan is scheduled or none are.
+    """
+    try:
+        specs = request.json_body['scans']
+        cstruct = [dict({'scanners': {}}, **spec) for spec in specs]
+    except (KeyError, TypeError, ValueError):
+        raise _bad_request('Must submit a JSON object with a list of scans.')
+    schema = BulkScanSchema().bind(
+        scanner_names=get_scanner_names(request.dbsession),
+        subnets=get_scannable_subnets(request.dbsession))
+    try:
+        appstructs = schema.deserialize(cstruct)
+        scan_ids = schedule_scans(request.dbsession, appstructs)
+    except colander.Invalid as e:
+        raise _bad_request(e.asdict())
+    except ValueError as e:
+        raise _bad_request(str(e))
+    request.response.status = 201
+    return {
+        'scans': [
+            {'id': str(id_), 'url': request.route_url('api_scan', id=id_)}
+            for id_ in scan_ids
+        ],
+    }
+
+
+@view_config(route_name='api_scan', renderer='json')
+def api_scan(request):
+    scan = (
+        request.dbsession.query(Scan).
+        options(selectinload(Scan.targets), *SCAN_DETAIL_LOADER_OPTIONS).
+        filter(Scan.id == _get_scan_id(request)).
+        one_or_none())
+    if not scan:
+        raise HTTPNotFound()
+    return dict(
+        scan_json(request, scan),
+        targets=[str(target.net_block) for target in scan.targets],
+        subscans=[subscan_json(request, subscan) for subscan in scan.subscans],
+    )
+
+
+@view_config(route_name='api_subscan', renderer='json')
+def api_subscan(request):
+    subscan = (
+        request.dbsession.query(Subscan).
+        options(with_expression(
+            Subscan.results_length, func.length(Subscan.xml_results))).
+        filter(
+            Subscan.scan_id == _get_scan_id(request),
+            Subscan.scanner_name == request.matchdict['scanner_name']).
+        one_or_none())
+    if not subscan:
+        raise HTTPNotFound()
+    return subscan_json(request, subscan)
+
+
+@view_config(route_name='api_scan_hosts')
+def api_scan_hosts(request):
+    """
+    Streams the hosts and ports found by a scan's subscans.
+
+    Hosts are written as a JSON array, or as one JSON object per line with
+    ``format=ndjson``. Rows are read through a server-side cursor as the
+    response is written, so memory use does not grow with the results.
+    """
+    scan_id = _get_scan_id(request)
+    format_ = request.params.get('format', 'json')
+    if format_ not in ('json', 'ndjson'):
+        raise HTTPBadRequest(f'Unknown format {format_!r}.')
+    if not request.dbsession.query(Scan.id).filter(Scan.id == scan_id).count():
+        raise HTTPNotFound()
+    # The request's session is closed before the body is written.
+    session_factory = request.registry['dbsession_factory']
+    hosts = stream_scan_hosts(session_factory, scan_id)
+    if format_ == 'ndjson':
+        return Response(
+            content_type=NDJSON_CONTENT_TYPE, charset='utf-8',
+            app_iter=_ndjson_lines(hosts))
+    return Response(
+        content_type='application/json', charset='utf-8',
+        app_iter=_json_array(hosts))
+
+
+@view_config(route_name='api_export')
+def api_export(request):
+    """
+    Streams host and port results across scans as CSV or JSON Lines.
+
+    Scans are selected by creation time with ``since`` and ``until``, or by
+    a comma-separated list of ``scans``. With ``gzip``, the export is
+    compressed as it is written.
+    """
+    format_ = request.params.get('format', 'csv')
+    if format_ not in EXPORT_FORMATS:
+        raise HTTPBadRequest(f'Unknown format {format_!r}.')
+    try:
+        criteria = {
+            key: arrow.get(request.params[key]).datetime
+            for key in ('since', 'until') if request.params.get(key)
+        }
+        scan_ids = request.params.get('scans')
+        if scan_ids:
+            criteria['scan_ids'] = [UUID(id_) for id_ in scan_ids.split(',')]
+    except (arrow.parser.ParserError, ValueError):
+        raise HTTPBadRequest('Invalid export criteria.')
+    compress = request.params.get('gzip', '') not in ('', '0', 'false')
+    content_type, extension = EXPORT_FORMATS[format_]
+    filename = f'wanmap-results.{extension}'
+    if compress:
+        content_type, filename = 'application/gzip', f'{filename}.gz'
+    # Without a length, the body is sent with chunked transfer encoding.
+    return Response(
+        content_type=content_type,
+        content_disposition=f'attachment; filename="{filename}"',
+        app_iter=export_chunks(
+            request.registry['dbsession_factory'], format_, compress,
+            **criteria))
+
+
+@view_config(route_name='api_host_history', renderer='json')
+def api_host_history(request):
+    """
+    Looks up the history of the hosts within an ``address`` or CIDR, latest
+    first, optionally of one ``port`` or in one ``state``.
+    """
+    address = request.params.get('address')
+    if not address:
+        raise HTTPBadRequest('Must specify an address or CIDR.')
+    filters = {
+        key: request.params[key] for key in HOST_HISTORY_FILTERS
+        if request.params.get(key)
+    }
+    try:
+        limit = int(request.params.get('limit', API_MAX_PAGE_LENGTH))
+        if not 0 < limit <= API_MAX_PAGE_LENGTH:
+            raise ValueError(f'Limit must be 1 to {API_MAX_PAGE_LENGTH}.')
+        offset = int(request.params.get('offset', 0))
+        if offset < 0:
+            raise ValueError('Offset must not be negative.')
+        history = find_host_history(request.dbsession, address, **filters)
+    except ValueError as e:
+        raise HTTPBadRequest(str(e))
+    rows = history.offset(offset).limit(limit + 1).all()
+    next_page = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_page = request.route_url('api_host_history', _query=dict(
+            filters, address=address, limit=limit, offset=offset + limit))
+    return {
+        'history': [host_history_json(request, row) for row in rows],
+        'next': next_page,
+    }
+
+
+def stream_scan_hosts(session_factory, scan_id):
+    """Yields a scan's hosts, by scanner and address, using its own session."""
+    dbsession = session_factory()
+    try:
+        rows = (
+            dbsession.query(
+                SubscanHost.scanner_name, SubscanHost.address,
+                SubscanHost.status, SubscanHost.hostname,
+                SubscanPort.protocol, SubscanPort.number, SubscanPort.state,
+                SubscanPort.service).
+            outerjoin(SubscanHost.ports).
+            filter(SubscanHost.scan_id == scan_id).
+            order_by(
+                SubscanHost.scanner_name, SubscanHost.address,
+                SubscanPort.protocol, SubscanPort.number).
+            execution_options(stream_results=True).
+            yield_per(STREAM_BATCH_SIZE))
+        for (scanner_name, address), host_rows in groupby(
+                rows, key=lambda row: row[:2]):
+            host_rows = list(host_rows)
+            _, _, status, hostname = host_rows[0][:4]
+            yield {
+                'scanner': scanner_name,
+                'address': str(address.ip),
+                'status': status,
+                'hostname': hostname,
+                'ports': [
+                    {
+                        'protocol': protocol,
+                        'number': number,
+                        'state': state,
+                        'service': service,
+                    }
+                    for *_, protocol, number, state, service in host_rows
+                    if number is not None
+                ],
+            }
+    finally:
+        dbsession.close()
+
+
+def scan_json(request, scan):
+    return {
+        'id': str(scan.id),
+        'url': request.route_url('api_scan', id=scan.id),
+        'type': scan._type,
+        'status': scan.status.name.lower(),
+        'created_at': _isoformat(scan.created_at),
+        'completed_at': _isoformat(scan.completed_at),
+        'parameters': scan.parameters,
+        'known_hosts_only': scan.known_hosts_only,
+        'discover_first': scan.discover_first,
+        'port_shards': scan.port_shards,
+        'auto_timing': scan.auto_timing,
+        'subscan_count': scan.subscan_count,
+        'completed_subscan_count': scan.completed_subscan_count,
+        'hosts_url': request.route_url('api_scan_hosts', id=scan.id),
+    }
+
+
+def subscan_json(request, subscan):
+    """
+    Describes a subscan loaded with its results length. Subscans served
+    from cache or scanned in batches have no raw results.
+    """
+    fields = {
+        'scanner': subscan.scanner_name,
+        'url': request.route_url(
+            'api_subscan', id=subscan.scan_id,
+            scanner_name=subscan.scanner_name),
+        'started_at': _isoformat(subscan.started_at),
+        'finished_at': _isoformat(subscan.finished_at),
+        'targets': [str(target.target) for target in subscan.targets],
+        'timing_options': subscan.timing_options,
+    }
+    if subscan.results_length:
+        fields['results_url'] = request.route_url(
+            'show_subscan_results', id=subscan.scan_id,
+            scanner_name=subscan.scanner_name)
+    return fields
+
+
+def host_history_json(request, row):
+    return {
+        'address': str(row.ip),
+        'protocol': row.protocol or None,
+        'port': row.number if row.protocol else None,
+        'scanner': row.scanner_name,
+        'state': row.state,
+        'first_seen_at': _isoformat(row.first_seen_at),
+        'last_seen_at': _isoformat(row.last_seen_at),
+        'first_scan_url': request.route_url('api_scan', id=row.first_scan_id),
+        'last_scan_url': request.route_url('api_scan', id=row.last_scan_id),
+        'current': row.current,
+    }
+
+
+def _get_scan_id(request):
+    try:
+        return UUID(request.matchdict['id'])
+    except ValueError:
+        raise HTTPNotFound()
+
+
+def _bad_request(errors):
+    # Raised, rather than returned, so the transaction is aborted.
+    return HTTPBadRequest(json_body={'errors': errors})
+
+
+def _isoformat(datetime):
+    return datetime.isoformat() if datetime else None
+
+
+def _ndjson_lines(objects):
+    for object_ in objects:
+        yield json.dumps(object_).encode() + b'\n'
+
+
+def _json_array(objects):
+    separator = b'['
+    for object_ in objects:
+        yield separator + json.dumps(object_).encode()
+        separator = b','
+    yield b'[]' if separator == b'[' else b']'
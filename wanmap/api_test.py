@@ -0,0 +1,301 @@
+import gzip
+import json
+from unittest.mock import patch
+import uuid
+
+from pyramid import testing
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound
+import pytest
+from sqlalchemy import event
+
+from .api import (
+    api_export, api_host_history, api_scan, api_scan_hosts, api_scans,
+    api_submit_scans, api_subscan,
+)
+from .history import record_host_history
+from .scans import DeltaScan, Scan, SplittingScan, PING_SWEEP
+
+FAKE_HOST_RESULT_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<nmaprun>'
+    '<host><status state="up"/><address addr="10.1.0.1" addrtype="ipv4"/>'
+    '<hostnames><hostname name="router"/></hostnames>'
+    '<ports>'
+    '<port protocol="tcp" portid="22"><state state="open"/>'
+    '<service name="ssh"/></port>'
+    '<port protocol="tcp" portid="80"><state state="closed"/></port>'
+    '</ports></host>'
+    '<host><status state="up"/><address addr="10.1.0.2" addrtype="ipv4"/>'
+    '</host>'
+    '</nmaprun>'
+)
+
+
+@pytest.fixture
+def api_request(view_request, dbsession, monkeypatch):
+    with testing.testConfig(request=view_request) as config:
+        config.include('wanmap.scans')
+        config.include('wanmap.api')
+        view_request.registry = config.registry
+        config.registry['dbsession_factory'] = lambda: dbsession
+        yield view_request
+
+
+@pytest.fixture
+def completed_scan(scan_results):
+    return scan_results(FAKE_HOST_RESULT_XML)
+
+
+def test_api_scans_lists_scans(api_request, completed_scan):
+    result = api_scans(api_request)
+    scan, = result['scans']
+    assert scan['id'] == str(completed_scan.id)
+    assert scan['status'] == 'completed'
+    assert result['next'] is None
+    json.dumps(result)
+
+
+def test_api_scans_pages(api_request, completed_scan):
+    api_request.params['limit'] = '1'
+    api_request.params['status'] = 'scheduled'
+    assert api_scans(api_request) == {'scans': [], 'next': None}
+
+
+@pytest.mark.parametrize('limit', ('0', '1001', 'all'))
+def test_api_scans_invalid_limit_fails(api_request, limit):
+    api_request.params['limit'] = limit
+    with pytest.raises(HTTPBadRequest):
+        api_scans(api_request)
+
+
+def test_api_scan_includes_subscans(api_request, completed_scan):
+    api_request.matchdict['id'] = str(completed_scan.id)
+    result = api_scan(api_request)
+    assert result['targets'] == ['10.1.0.0/24']
+    assert [subscan['scanner'] for subscan in result['subscans']] == [
+        subscan.scanner_name for subscan in completed_scan.subscans]
+    json.dumps(result)
+
+
+def test_api_scan_nonexistent_fails(api_request):
+    api_request.matchdict['id'] = str(uuid.uuid4())
+    with pytest.raises(HTTPNotFound):
+        api_scan(api_request)
+
+
+def test_api_subscan(api_request, completed_scan):
+    subscan = completed_scan.subscans[0]
+    api_request.matchdict.update(
+        id=str(completed_scan.id), scanner_name=subscan.scanner_name)
+    result = api_subscan(api_request)
+    assert result['finished_at']
+    assert result['results_url'].endswith(
+        f'/scans/{completed_scan.id}/{subscan.scanner_name}/results.xml')
+
+
+def test_api_subscan_without_raw_results_has_no_results_url(
+    dbsession, api_request, completed_scan):
+
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP, targets=('10.1.0.0/24',),
+        freshness_minutes=10)
+    dbsession.add(scan)
+    dbsession.flush()
+    api_request.matchdict.update(
+        id=str(scan.id), scanner_name=scan.subscans[0].scanner_name)
+    result = api_subscan(api_request)
+    assert result['finished_at']
+    assert 'results_url' not in result
+
+
+def test_api_scan_hosts_streams_ndjson(api_request, completed_scan):
+    api_request.matchdict['id'] = str(completed_scan.id)
+    api_request.params['format'] = 'ndjson'
+    response = api_scan_hosts(api_request)
+    assert response.content_type == 'application/x-ndjson'
+    lines = list(response.app_iter)
+    hosts = [json.loads(line) for line in lines]
+    assert len(hosts) == 2 * len(completed_scan.subscans)
+    assert hosts[0] == {
+        'scanner': completed_scan.subscans[0].scanner_name,
+        'address': '10.1.0.1',
+        'status': 'up',
+        'hostname': 'router',
+        'ports': [
+            {'protocol': 'tcp', 'number': 22, 'state': 'open',
+             'service': 'ssh'},
+            {'protocol': 'tcp', 'number': 80, 'state': 'closed',
+             'service': None},
+        ],
+    }
+    assert hosts[1]['ports'] == []
+
+
+def test_api_scan_hosts_streams_json_array(api_request, completed_scan):
+    api_request.matchdict['id'] = str(completed_scan.id)
+    response = api_scan_hosts(api_request)
+    hosts = json.loads(b''.join(response.app_iter))
+    assert [host['address'] for host in hosts[:2]] == ['10.1.0.1', '10.1.0.2']
+
+
+def test_api_scan_hosts_without_results_is_empty_array(
+    dbsession, api_request, fake_wan_scanners, fake_wan_routers):
+
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP, targets=('10.1.0.0/24',))
+    dbsession.add(scan)
+    dbsession.flush()
+    api_request.matchdict['id'] = str(scan.id)
+    response = api_scan_hosts(api_request)
+    assert json.loads(b''.join(response.app_iter)) == []
+
+
+def test_api_scan_hosts_unknown_format_fails(api_request, completed_scan):
+    api_request.matchdict['id'] = str(completed_scan.id)
+    api_request.params['format'] = 'xml'
+    with pytest.raises(HTTPBadRequest):
+        api_scan_hosts(api_request)
+
+
+@pytest.fixture
+def scan_workflows():
+    with patch('wanmap.tasks.scan_workflows') as scan_workflows:
+        yield scan_workflows
+
+
+def test_api_submit_scans_schedules_batch(
+    dbsession, api_request, fake_wan_scanners, fake_wan_routers,
+    scan_workflows):
+
+    api_request.json_body = {'scans': [
+        {'nmap_options': PING_SWEEP, 'scan_targets': ['10.1.0.0/24']},
+        {'nmap_options': PING_SWEEP, 'scan_targets': ['10.2.0.0/24'],
+         'scanners': {'scanner_a': 'scanner1', 'scanner_b': 'scanner2'}},
+    ]}
+    result = api_submit_scans(api_request)
+    assert api_request.response.status_code == 201
+    scan_ids = [uuid.UUID(scan['id']) for scan in result['scans']]
+    scan_workflows.delay.assert_called_once_with(scan_ids)
+    splitting, delta = (dbsession.query(Scan).get(id_) for id_ in scan_ids)
+    assert isinstance(splitting, SplittingScan)
+    assert isinstance(delta, DeltaScan)
+    assert len(delta.subscans) == 2
+
+
+def test_api_submit_scans_plans_batch_together(
+    dbsession, api_request, fake_wan_scanners, fake_wan_routers,
+    scan_workflows):
+
+    statements = []
+
+    def count(conn, cursor, statement, *args):
+        if 'FROM scanners' in statement:
+            statements.append(statement)
+
+    specs = [
+        {'nmap_options': PING_SWEEP, 'scan_targets': [f'10.1.0.{i}']}
+        for i in range(10)
+    ]
+    api_request.json_body = {'scans': specs}
+    engine = dbsession.get_bind()
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        api_submit_scans(api_request)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    # Planning queries are shared by the batch.
+    assert len(statements) < len(specs)
+
+
+@pytest.mark.parametrize('json_body', [
+    None, [], {'scans': 'all'}, {'scans': [1]}, {'scans': []},
+    {'scans': [{'nmap_options': PING_SWEEP, 'scan_targets': []}]},
+    {'scans': [{'nmap_options': PING_SWEEP,
+                'scan_targets': ['198.18.0.0/24']}]},
+])
+def test_api_submit_scans_invalid_fails(
+    dbsession, api_request, fake_wan_scanners, fake_wan_routers,
+    scan_workflows, json_body):
+
+    api_request.json_body = json_body
+    with pytest.raises(HTTPBadRequest) as exc_info:
+        api_submit_scans(api_request)
+    assert 'errors' in exc_info.value.json_body
+    assert not scan_workflows.delay.called
+
+
+def test_api_submit_scans_does_not_hide_errors(
+    monkeypatch, api_request, fake_wan_scanners, fake_wan_routers,
+    scan_workflows):
+
+    def from_appstruct(cls, dbsession, appstruct, planner):
+        raise RuntimeError('database unavailable')
+
+    monkeypatch.setattr(
+        SplittingScan, 'from_appstruct', classmethod(from_appstruct))
+    api_request.json_body = {'scans': [
+        {'nmap_options': PING_SWEEP, 'scan_targets': ['10.1.0.0/24']},
+    ]}
+    with pytest.raises(RuntimeError):
+        api_submit_scans(api_request)
+
+
+def test_api_export_streams_csv(api_request, completed_scan):
+    api_request.params['scans'] = str(completed_scan.id)
+    response = api_export(api_request)
+    assert response.content_type == 'text/csv'
+    assert 'wanmap-results.csv' in response.content_disposition
+    lines = b''.join(response.app_iter).splitlines()
+    # A header, then two ports and a host without ports per subscan
+    assert len(lines) == 1 + 3 * len(completed_scan.subscans)
+
+
+def test_api_export_gzips(api_request, completed_scan):
+    api_request.params.update(
+        scans=str(completed_scan.id), format='jsonl', gzip='1')
+    response = api_export(api_request)
+    assert response.content_type == 'application/gzip'
+    lines = gzip.decompress(b''.join(response.app_iter)).splitlines()
+    assert json.loads(lines[0])['scan_id'] == str(completed_scan.id)
+
+
+@pytest.mark.parametrize('params', [
+    {'format': 'xlsx'}, {'since': 'yesterday'}, {'scans': '🐢'},
+])
+def test_api_export_invalid_params_fail(api_request, params):
+    api_request.params.update(params)
+    with pytest.raises(HTTPBadRequest):
+        api_export(api_request)
+
+
+@pytest.fixture
+def recorded_scan(dbsession, completed_scan):
+    for subscan in completed_scan.subscans:
+        record_host_history(dbsession, subscan)
+    return completed_scan
+
+
+def test_api_host_history_finds_ports(api_request, recorded_scan):
+    api_request.params.update(address='10.1.0.0/24', port='22/tcp')
+    result = api_host_history(api_request)
+    row, = result['history']
+    assert (row['address'], row['port'], row['state']) == (
+        '10.1.0.1', 22, 'open')
+    assert str(recorded_scan.id) in row['last_scan_url']
+    json.dumps(result)
+
+
+def test_api_host_history_pages(api_request, recorded_scan):
+    api_request.params.update(address='10.1.0.1', limit='2')
+    result = api_host_history(api_request)
+    assert len(result['history']) == 2
+    assert 'offset=2' in result['next']
+
+
+@pytest.mark.parametrize('params', [
+    {}, {'address': 'router'}, {'address': '10.1.0.1', 'offset': '-1'},
+])
+def test_api_host_history_invalid_params_fail(api_request, params):
+    api_request.params.update(params)
+    with pytest.raises(HTTPBadRequest):
+        api_host_history(api_request)
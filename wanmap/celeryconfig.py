@@ -12,11 +12,29 @@ task_default_queue = 'console'
 task_default_routing_key = 'console'
 task_ignore_results = True
 
+# Started by celery beat, which runs once beside the console worker.
+beat_schedule = {
+    'run-scheduled-scans': {
+        'task': 'wanmap.tasks.run_scheduled_scans',
+        'schedule': 60.0,
+    },
+    'send-queued-executions': {
+        'task': 'wanmap.tasks.send_queued_executions',
+        'schedule': 60.0,
+    },
+}
+
+
+# Run by the scanner of the subscan keyed by their first argument.
+SCANNER_TASKS = (
+    'wanmap.tasks.exec_nmap_scan', 'wanmap.tasks.exec_discovery_scan',
+)
+
 
 class ScanRouter:
 
     def route_for_task(self, task, args=None, kwargs=None):
-        if task == 'wanmap.tasks.exec_nmap_scan':
+        if task in SCANNER_TASKS:
             scan_id, scanner_name = args[0]
             return {
                 'exchange': 'C.dq2',
@@ -0,0 +1,222 @@
+"""Changes in hosts and ports between successive scans of the same targets."""
+
+import hashlib
+from ipaddress import ip_interface, ip_network
+from uuid import UUID
+
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound
+from pyramid.view import view_config
+from sqlalchemy import (
+    Column, DateTime, ForeignKey, func, Integer, literal, select, String,
+)
+from sqlalchemy.dialects import postgresql
+
+from .scans import Scan, SubscanHost, SubscanPort
+from .schema import Persistable
+
+SCAN_CHANGES_PAGE_LENGTH = 100
+
+
+def includeme(config):
+    config.add_route('show_scan_changes', '/scans/{id}/changes')
+
+
+class HostState(Persistable):
+    """
+    The latest results for a host from a series of scans.
+
+    A series is the scans of the same targets with the same parameters, and
+    is compared per scanner, since scanners see different firewall policy.
+    """
+
+    __tablename__ = 'host_states'
+    series = Column(String(32), primary_key=True)
+    scanner_name = Column(String(64), primary_key=True)
+    address = Column(postgresql.INET, primary_key=True)
+    scan_id = Column(postgresql.UUID(as_uuid=True), ForeignKey('scans.id'))
+    # The creation time of the scan, so late results cannot replace newer.
+    scanned_at = Column(DateTime(timezone=True), nullable=False)
+    status = Column(String(16))
+    open_ports = Column(postgresql.ARRAY(String(16)), nullable=False)
+
+
+class ScanChange(Persistable):
+    """A host or port that changed since the previous scan of a series."""
+
+    __tablename__ = 'scan_changes'
+    scan_id = Column(
+        postgresql.UUID(as_uuid=True), ForeignKey('scans.id'),
+        primary_key=True)
+    scanner_name = Column(String(64), primary_key=True)
+    address = Column(postgresql.INET, primary_key=True)
+    # Empty for a change of the host itself
+    protocol = Column(String(8), primary_key=True, default='')
+    number = Column(Integer, primary_key=True, default=0)
+    previous_scan_id = Column(postgresql.UUID(as_uuid=True))
+    # The host status, or whether a port is open, before and after; null
+    # when the host was not reported.
+    previous_state = Column(String(16))
+    state = Column(String(16))
+
+    @property
+    def ip(self):
+        return ip_interface(self.address).ip
+
+    @property
+    def port(self):
+        return f'{self.number}/{self.protocol}' if self.protocol else None
+
+
+def scan_series(scan):
+    """Identifies the scans of the same targets with the same parameters."""
+    targets = sorted(str(target.net_block) for target in scan.targets)
+    series = repr((str(scan.parameters), scan.known_hosts_only, targets))
+    return hashlib.md5(series.encode()).hexdigest()
+
+
+def record_host_changes(dbsession, subscan):
+    """
+    Records how a completed subscan's hosts changed since the series' latest
+    results, then makes the subscan's hosts the latest.
+
+    Only the series' latest state is read, so earlier results are never
+    reparsed. The first scan of a series has nothing to change from.
+    Returns the number of changes.
+    """
+    scan = subscan.scan
+    series = scan_series(scan)
+    # Addresses are compared as interfaces, as INET values are loaded.
+    states = {
+        ip_interface(state.address): state
+        for state in dbsession.query(HostState).filter_by(
+            series=series, scanner_name=subscan.scanner_name)
+    }
+    if any(state.scanned_at > scan.created_at for state in states.values()):
+        # A later scan of the series has already landed.
+        return 0
+    dbsession.query(ScanChange).filter_by(
+        scan_id=scan.id, scanner_name=subscan.scanner_name).delete(
+        synchronize_session=False)
+    changes = []
+    if states:
+        changes.extend(_host_changes(subscan, states))
+    targets = [ip_network(target.target) for target in subscan.targets]
+    reported = {ip_interface(host.address) for host in subscan.hosts}
+    missing = [
+        address for address in states
+        if address not in reported and
+        any(address.ip in target for target in targets)
+    ]
+    changes.extend(
+        _change(subscan, states[address], address, state=None)
+        for address in missing)
+    dbsession.add_all(changes)
+    if missing:
+        dbsession.query(HostState).filter(
+            HostState.series == series,
+            HostState.scanner_name == subscan.scanner_name,
+            HostState.address.in_(missing)).delete(synchronize_session=False)
+    _upsert_host_states(dbsession, subscan, series)
+    return len(changes)
+
+
+def _host_changes(subscan, states):
+    for host in subscan.hosts:
+        previous = states.get(ip_interface(host.address))
+        if previous is None or previous.status != host.status:
+            yield _change(
+                subscan, previous, host.address, state=host.status)
+        previous_ports = set(previous.open_ports if previous else ())
+        open_ports = set(host.open_ports)
+        port_states = {
+            f'{port.number}/{port.protocol}': port.state
+            for port in host.ports
+        }
+        for port in sorted(open_ports - previous_ports):
+            yield _change(
+                subscan, previous, host.address, port, state='open')
+        for port in sorted(previous_ports - open_ports):
+            yield _change(
+                subscan, previous, host.address, port,
+                previous_state='open', state=port_states.get(port))
+
+
+def _change(
+        subscan, previous, address, port=None, previous_state=None,
+        state=None):
+    number, protocol = port.split('/') if port else (0, '')
+    if not port and previous:
+        previous_state = previous.status
+    return ScanChange(
+        scan_id=subscan.scan_id, scanner_name=subscan.scanner_name,
+        address=address, protocol=protocol, number=int(number),
+        previous_scan_id=previous.scan_id if previous else None,
+        previous_state=previous_state, state=state)
+
+
+def _upsert_host_states(dbsession, subscan, series):
+    """Copies the subscan's hosts into the series state in one statement."""
+    hosts, ports = SubscanHost.__table__, SubscanPort.__table__
+    open_ports = (
+        select([func.array_agg(
+            func.concat(ports.c.number, '/', ports.c.protocol))]).
+        where(
+            (ports.c.scan_id == hosts.c.scan_id) &
+            (ports.c.scanner_name == hosts.c.scanner_name) &
+            (ports.c.address == hosts.c.address) &
+            (ports.c.state == 'open')).
+        as_scalar())
+    latest = select([
+        literal(series), hosts.c.scanner_name, hosts.c.address,
+        hosts.c.scan_id, literal(subscan.scan.created_at), hosts.c.status,
+        func.coalesce(open_ports, literal([], postgresql.ARRAY(String))),
+    ]).where(
+        (hosts.c.scan_id == subscan.scan_id) &
+        (hosts.c.scanner_name == subscan.scanner_name))
+    upsert = postgresql.insert(HostState.__table__).from_select(
+        ['series', 'scanner_name', 'address', 'scan_id', 'scanned_at',
+         'status', 'open_ports'],
+        latest)
+    upsert = upsert.on_conflict_do_update(
+        index_elements=['series', 'scanner_name', 'address'],
+        set_={
+            key: upsert.excluded[key]
+            for key in ('scan_id', 'scanned_at', 'status', 'open_ports')
+        })
+    dbsession.execute(upsert)
+
+
+@view_config(
+    route_name='show_scan_changes', renderer='templates/scan_changes.jinja2')
+def show_scan_changes(request):
+    """Pages through the changes since the previous scans of the series."""
+    try:
+        id_ = UUID(request.matchdict['id'])
+    except ValueError:
+        raise HTTPNotFound()
+    scan = request.dbsession.query(Scan).get(id_)
+    if not scan:
+        raise HTTPNotFound()
+    try:
+        page = max(1, int(request.params.get('page', 1)))
+    except ValueError:
+        raise HTTPBadRequest('Invalid page number.')
+    changes = request.dbsession.query(ScanChange).filter(
+        ScanChange.scan_id == id_)
+    change_count = changes.count()
+    changes = (
+        changes.
+        order_by(
+            ScanChange.scanner_name, ScanChange.address, ScanChange.protocol,
+            ScanChange.number).
+        offset((page - 1) * SCAN_CHANGES_PAGE_LENGTH).
+        limit(SCAN_CHANGES_PAGE_LENGTH).
+        all())
+    return {
+        'scan': scan,
+        'changes': changes,
+        'change_count': change_count,
+        'first_change': (page - 1) * SCAN_CHANGES_PAGE_LENGTH + 1,
+        'page': page,
+        'page_count': -(-change_count // SCAN_CHANGES_PAGE_LENGTH),
+    }
@@ -0,0 +1,163 @@
+import uuid
+
+from bs4 import BeautifulSoup
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.renderers import render
+import pytest
+
+from .changes import (
+    HostState, record_host_changes, ScanChange, scan_series,
+    show_scan_changes,
+)
+
+LAST_WEEK_XML = (
+    '<nmaprun>'
+    '<host><status state="up"/><address addr="10.1.0.1" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="22"><state state="open"/></port>'
+    '</ports></host>'
+    '<host><status state="up"/><address addr="10.1.0.2" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="80"><state state="open"/></port>'
+    '</ports></host>'
+    '<host><status state="up"/><address addr="10.1.0.3" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="25"><state state="open"/></port>'
+    '</ports></host>'
+    '</nmaprun>'
+)
+
+THIS_WEEK_XML = (
+    '<nmaprun>'
+    '<host><status state="up"/><address addr="10.1.0.1" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="22"><state state="open"/></port>'
+    '<port protocol="tcp" portid="443"><state state="open"/></port>'
+    '</ports></host>'
+    '<host><status state="up"/><address addr="10.1.0.3" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="25"><state state="filtered"/></port>'
+    '</ports></host>'
+    '<host><status state="up"/><address addr="10.1.0.5" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="22"><state state="open"/></port>'
+    '</ports></host>'
+    '</nmaprun>'
+)
+
+
+@pytest.fixture
+def complete(dbsession, complete_scan):
+    """Completes a scan, returning the number of changes recorded."""
+    def complete(scan, xml_results):
+        complete_scan(scan, xml_results)
+        change_count = sum(
+            record_host_changes(dbsession, subscan)
+            for subscan in scan.subscans)
+        dbsession.flush()
+        return change_count
+    return complete
+
+
+def changes(dbsession, scan):
+    return {
+        (str(change.ip), change.port, change.previous_state, change.state)
+        for change in dbsession.query(ScanChange).filter_by(scan_id=scan.id)
+    }
+
+
+def test_first_scan_of_series_has_no_changes(dbsession, create_scan, complete):
+    scan = create_scan()
+    assert complete(scan, LAST_WEEK_XML) == 0
+    assert dbsession.query(HostState).count() == 3
+
+
+def test_scan_changes_since_previous_scan(dbsession, create_scan, complete):
+    complete(create_scan(), LAST_WEEK_XML)
+    scan = create_scan()
+    complete(scan, THIS_WEEK_XML)
+    assert changes(dbsession, scan) == {
+        ('10.1.0.1', '443/tcp', None, 'open'),
+        ('10.1.0.2', None, 'up', None),
+        ('10.1.0.3', '25/tcp', 'open', 'filtered'),
+        ('10.1.0.5', None, None, 'up'),
+        ('10.1.0.5', '22/tcp', None, 'open'),
+    }
+
+
+def test_scan_changes_refer_to_previous_scan(dbsession, create_scan, complete):
+    previous_scan = create_scan()
+    complete(previous_scan, LAST_WEEK_XML)
+    scan = create_scan()
+    complete(scan, THIS_WEEK_XML)
+    previous_scan_ids = {
+        change.previous_scan_id
+        for change in dbsession.query(ScanChange).filter_by(scan_id=scan.id)
+        if change.previous_state
+    }
+    assert previous_scan_ids == {previous_scan.id}
+
+
+def test_unchanged_rescan_has_no_changes(dbsession, create_scan, complete):
+    complete(create_scan(), LAST_WEEK_XML)
+    assert complete(create_scan(), LAST_WEEK_XML) == 0
+
+
+def test_host_state_follows_latest_scan(dbsession, create_scan, complete):
+    complete(create_scan(), LAST_WEEK_XML)
+    scan = create_scan()
+    complete(scan, THIS_WEEK_XML)
+    states = {
+        str(state.address.ip): (state.scan_id, sorted(state.open_ports))
+        for state in dbsession.query(HostState)
+    }
+    assert states == {
+        '10.1.0.1': (scan.id, ['22/tcp', '443/tcp']),
+        '10.1.0.3': (scan.id, []),
+        '10.1.0.5': (scan.id, ['22/tcp']),
+    }
+
+
+def test_late_results_of_older_scan_are_not_compared(
+    dbsession, create_scan, complete):
+
+    older_scan, newer_scan = create_scan(), create_scan()
+    complete(newer_scan, THIS_WEEK_XML)
+    assert complete(older_scan, LAST_WEEK_XML) == 0
+    scan_ids = {scan_id for scan_id, in dbsession.query(HostState.scan_id)}
+    assert scan_ids == {newer_scan.id}
+
+
+def test_scans_with_other_parameters_are_other_series(
+    dbsession, create_scan, complete):
+
+    scan = create_scan()
+    other_scan = create_scan(parameters='-sS')
+    assert scan_series(scan) != scan_series(other_scan)
+    complete(scan, LAST_WEEK_XML)
+    assert complete(other_scan, THIS_WEEK_XML) == 0
+
+
+@pytest.fixture
+def changes_request(rendering_request, create_scan, complete):
+    complete(create_scan(), LAST_WEEK_XML)
+    scan = create_scan()
+    complete(scan, THIS_WEEK_XML)
+    rendering_request.matchdict['id'] = str(scan.id)
+    return rendering_request
+
+
+def test_show_scan_changes_renders_table(changes_request):
+    html = render(
+        'wanmap:templates/scan_changes.jinja2',
+        show_scan_changes(changes_request), request=changes_request)
+    table = BeautifulSoup(html, 'html.parser').find(id='scan-changes')
+    assert len(table.tbody.find_all('tr')) == 5
+
+
+def test_show_scan_changes_pages(monkeypatch, changes_request):
+    monkeypatch.setattr('wanmap.changes.SCAN_CHANGES_PAGE_LENGTH', 2)
+    changes_request.GET['page'] = '3'
+    response = show_scan_changes(changes_request)
+    assert response['page_count'] == 3
+    assert len(response['changes']) == 1
+
+
+def test_show_scan_changes_nonexistent_scan_fails(view_request):
+    view_request.matchdict['id'] = str(uuid.uuid4())
+    with pytest.raises(HTTPNotFound):
+        show_scan_changes(view_request)
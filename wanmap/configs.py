@@ -0,0 +1,118 @@
+"""Offline network discovery from saved router configurations."""
+
+from concurrent.futures import ProcessPoolExecutor
+from ipaddress import ip_interface
+import logging
+import os
+from pathlib import Path
+
+from ciscoconfparse import CiscoConfParse
+import vyattaconfparser
+
+from .network import Router, routable_interfaces
+
+# Parse several files per worker round trip to amortize pickling overhead.
+FILES_PER_WORKER_CHUNK = 16
+
+logger = logging.getLogger(__name__)
+
+
+def ingest_configs(directory, max_workers=None):
+    """
+    Builds routers from a directory of saved configurations.
+
+    Files are parsed in parallel worker processes. Files that cannot be
+    parsed, or that have no routable interfaces, are skipped.
+    """
+    paths = sorted(
+        str(path) for path in Path(directory).iterdir() if path.is_file())
+    if not paths:
+        return []
+    max_workers = max_workers or os.cpu_count()
+    chunksize = max(1, min(
+        FILES_PER_WORKER_CHUNK, len(paths) // (max_workers * 4)))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        parsed = executor.map(parse_config_file, paths, chunksize=chunksize)
+        routers = [
+            Router.create(hostname=hostname, interfaces=interfaces)
+            for hostname, interfaces in filter(None, parsed)
+            if interfaces
+        ]
+    logger.info(
+        'Ingested %d routers from %d configurations in %s',
+        len(routers), len(paths), directory)
+    return routers
+
+
+def parse_config_file(path):
+    """Returns the hostname and routable interfaces of a saved config."""
+    path = Path(path)
+    try:
+        text = path.read_text(errors='replace')
+        hostname, interfaces = parse_config(text)
+    except Exception:
+        logger.warning(
+            'Unable to parse configuration %s', path, exc_info=True)
+        return None
+    return hostname or path.stem, interfaces
+
+
+def parse_config(text):
+    """Detects the configuration syntax and extracts interface addresses."""
+    if _is_vyatta_config(text):
+        hostname, interfaces = _parse_vyatta_config(text)
+    else:
+        hostname, interfaces = _parse_ios_config(text)
+    return hostname, routable_interfaces(interfaces)
+
+
+def _is_vyatta_config(text):
+    return any(
+        line.startswith('interfaces {') for line in text.splitlines())
+
+
+def _parse_vyatta_config(text):
+    config = vyattaconfparser.parse_conf(text)
+    hostname = config.get('system', {}).get('host-name')
+    interfaces = list(_find_vyatta_addresses(config.get('interfaces', {})))
+    return hostname, interfaces
+
+
+def _find_vyatta_addresses(node):
+    for key, value in node.items():
+        if key == 'address':
+            # A single address is a string; several are a dict of addresses.
+            addresses = value if isinstance(value, dict) else (value,)
+            for address in addresses:
+                interface = _to_interface(address)
+                if interface:
+                    yield interface
+        elif isinstance(value, dict):
+            yield from _find_vyatta_addresses(value)
+
+
+def _parse_ios_config(text):
+    config = CiscoConfParse(text.splitlines())
+    hostnames = config.find_objects(r'^hostname\s')
+    hostname = hostnames[0].text.split()[1] if hostnames else None
+    interfaces = []
+    for interface in config.find_objects(r'^interface\s'):
+        for line in interface.children:
+            words = line.text.split()
+            if words[:2] == ['ip', 'address'] and len(words) >= 3:
+                # IOS uses address and netmask; NX-OS and EOS use CIDR.
+                address = (
+                    words[2] if '/' in words[2] or len(words) == 3
+                    else f'{words[2]}/{words[3]}')
+                interfaces.append(_to_interface(address))
+            elif words[:2] == ['ipv6', 'address'] and len(words) >= 3:
+                interfaces.append(_to_interface(words[2]))
+    return hostname, list(filter(None, interfaces))
+
+
+def _to_interface(address):
+    """Converts address/prefix or address/netmask, ignoring keywords."""
+    try:
+        return ip_interface(address)
+    except ValueError:
+        return None
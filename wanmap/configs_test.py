@@ -0,0 +1,84 @@
+from ipaddress import ip_interface
+
+import pytest
+
+from .configs import ingest_configs, parse_config, parse_config_file
+
+VYOS_CONFIG = '''\
+interfaces {
+    ethernet eth0 {
+        address 10.2.0.1/24
+        address fd12:3456:789a:2::1/64
+    }
+    ethernet eth1 {
+        address dhcp
+        vif 10 {
+            address 192.168.0.2/30
+        }
+    }
+    loopback lo {
+    }
+}
+system {
+    host-name branch
+}
+'''
+
+IOS_CONFIG = '''\
+hostname dmz
+!
+interface GigabitEthernet0/0
+ ip address 203.0.113.1 255.255.255.0
+ ip address 203.0.114.1 255.255.255.0 secondary
+ ipv6 address fd12:3456:789a:3::1/64
+ ipv6 address FE80::1 link-local
+!
+interface GigabitEthernet0/1
+ no ip address
+ shutdown
+!
+'''
+
+
+def test_parse_vyos_config():
+    hostname, interfaces = parse_config(VYOS_CONFIG)
+    assert hostname == 'branch'
+    assert set(interfaces) == {
+        ip_interface('10.2.0.1/24'),
+        ip_interface('fd12:3456:789a:2::1/64'),
+        ip_interface('192.168.0.2/30'),
+    }
+
+
+def test_parse_ios_config():
+    hostname, interfaces = parse_config(IOS_CONFIG)
+    assert hostname == 'dmz'
+    assert set(interfaces) == {
+        ip_interface('203.0.113.1/24'),
+        ip_interface('203.0.114.1/24'),
+        ip_interface('fd12:3456:789a:3::1/64'),
+    }
+
+
+def test_parse_config_file_defaults_hostname_to_file_name(tmp_path):
+    path = tmp_path / 'r9.cfg'
+    path.write_text('interface Ethernet1\n ip address 10.9.0.1/24\n')
+    hostname, interfaces = parse_config_file(path)
+    assert hostname == 'r9'
+    assert interfaces == {ip_interface('10.9.0.1/24')}
+
+
+@pytest.fixture
+def config_dir(tmp_path):
+    (tmp_path / 'branch.conf').write_text(VYOS_CONFIG)
+    (tmp_path / 'dmz.cfg').write_text(IOS_CONFIG)
+    (tmp_path / 'empty.cfg').write_text('')
+    return tmp_path
+
+
+def test_ingest_configs_builds_routers(config_dir):
+    routers = ingest_configs(config_dir, max_workers=2)
+    assert {router.hostname for router in routers} == {'branch', 'dmz'}
+    dmz, = (router for router in routers if router.hostname == 'dmz')
+    assert ip_interface('203.0.113.1/24') in dmz.interfaces
+    assert dmz.last_collected_at
@@ -0,0 +1,158 @@
+"""Differences between the results of a delta scan's two scanners."""
+
+from ipaddress import ip_interface
+from uuid import UUID
+
+from pyramid.httpexceptions import HTTPBadRequest, HTTPNotFound
+from pyramid.view import view_config
+from sqlalchemy import (
+    Column, ForeignKey, func, insert, Integer, literal, select, String,
+    union_all,
+)
+from sqlalchemy.dialects import postgresql
+
+from .scans import DeltaScan, SubscanHost, SubscanPort
+from .schema import Persistable
+
+SCAN_DIFFERENCES_PAGE_LENGTH = 100
+
+
+def includeme(config):
+    config.add_route('show_scan_differences', '/scans/{id}/differences')
+
+
+class ScanDifference(Persistable):
+    """A host or port reported differently by a delta scan's scanners."""
+
+    __tablename__ = 'scan_differences'
+    scan_id = Column(
+        postgresql.UUID(as_uuid=True), ForeignKey('delta_scans.id'),
+        primary_key=True)
+    address = Column(postgresql.INET, primary_key=True)
+    # Empty for a difference of the host itself
+    protocol = Column(String(8), primary_key=True, default='')
+    number = Column(Integer, primary_key=True, default=0)
+    # The host status or port state from each scanner, in scanner name
+    # order, or null when the scanner did not report it.
+    state_a = Column(String(16))
+    state_b = Column(String(16))
+
+    @property
+    def ip(self):
+        return ip_interface(self.address).ip
+
+    @property
+    def port(self):
+        return f'{self.number}/{self.protocol}' if self.protocol else None
+
+
+def get_delta_scanner_names(scan):
+    """Returns the scanners of a delta scan's differences, A then B."""
+    return tuple(sorted(subscan.scanner_name for subscan in scan.subscans))
+
+
+def diff_delta_scan(dbsession, scan):
+    """
+    Replaces the scan's differences with those between its subscans.
+
+    Hosts with matching fingerprints are skipped, and the rest are compared
+    in the database by full joins of both scanners' hosts and of their ports
+    on address, protocol and port, so the results never leave the database.
+    Returns the number of differences.
+    """
+    scanner_a, scanner_b = get_delta_scanner_names(scan)
+    dbsession.query(ScanDifference).filter_by(scan_id=scan.id).delete(
+        synchronize_session=False)
+    hosts_a = _subscan_rows(SubscanHost, scan.id, scanner_a, 'hosts_a')
+    hosts_b = _subscan_rows(SubscanHost, scan.id, scanner_b, 'hosts_b')
+    changed_hosts = (
+        select([
+            func.coalesce(hosts_a.c.address, hosts_b.c.address).
+            label('address'),
+            hosts_a.c.status.label('state_a'),
+            hosts_b.c.status.label('state_b'),
+        ]).
+        select_from(hosts_a.join(
+            hosts_b, hosts_a.c.address == hosts_b.c.address, full=True)).
+        where(hosts_a.c.fingerprint.is_distinct_from(hosts_b.c.fingerprint)).
+        cte('changed_hosts'))
+    changed_addresses = select([changed_hosts.c.address])
+    ports_a = _subscan_rows(
+        SubscanPort, scan.id, scanner_a, 'ports_a', changed_addresses)
+    ports_b = _subscan_rows(
+        SubscanPort, scan.id, scanner_b, 'ports_b', changed_addresses)
+    scan_id = literal(scan.id, postgresql.UUID(as_uuid=True))
+    host_differences = (
+        select([
+            scan_id, changed_hosts.c.address, literal(''), literal(0),
+            changed_hosts.c.state_a, changed_hosts.c.state_b,
+        ]).
+        where(changed_hosts.c.state_a.is_distinct_from(
+            changed_hosts.c.state_b)))
+    port_differences = (
+        select([
+            scan_id,
+            func.coalesce(ports_a.c.address, ports_b.c.address),
+            func.coalesce(ports_a.c.protocol, ports_b.c.protocol),
+            func.coalesce(ports_a.c.number, ports_b.c.number),
+            ports_a.c.state, ports_b.c.state,
+        ]).
+        select_from(ports_a.join(
+            ports_b,
+            (ports_a.c.address == ports_b.c.address) &
+            (ports_a.c.protocol == ports_b.c.protocol) &
+            (ports_a.c.number == ports_b.c.number),
+            full=True)).
+        where(ports_a.c.state.is_distinct_from(ports_b.c.state)))
+    differences = ScanDifference.__table__
+    result = dbsession.execute(insert(differences).from_select(
+        ('scan_id', 'address', 'protocol', 'number', 'state_a', 'state_b'),
+        union_all(host_differences, port_differences)))
+    return result.rowcount
+
+
+def _subscan_rows(class_, scan_id, scanner_name, name, addresses=None):
+    table = class_.__table__
+    rows = select([table]).where(
+        (table.c.scan_id == scan_id) & (table.c.scanner_name == scanner_name))
+    if addresses is not None:
+        rows = rows.where(table.c.address.in_(addresses))
+    return rows.alias(name)
+
+
+@view_config(
+    route_name='show_scan_differences',
+    renderer='templates/scan_differences.jinja2')
+def show_scan_differences(request):
+    """Pages through the differences found by a delta scan."""
+    try:
+        id_ = UUID(request.matchdict['id'])
+    except ValueError:
+        raise HTTPNotFound()
+    scan = request.dbsession.query(DeltaScan).get(id_)
+    if not scan:
+        raise HTTPNotFound()
+    try:
+        page = max(1, int(request.params.get('page', 1)))
+    except ValueError:
+        raise HTTPBadRequest('Invalid page number.')
+    differences = request.dbsession.query(ScanDifference).filter(
+        ScanDifference.scan_id == id_)
+    difference_count = differences.count()
+    differences = (
+        differences.
+        order_by(
+            ScanDifference.address, ScanDifference.protocol,
+            ScanDifference.number).
+        offset((page - 1) * SCAN_DIFFERENCES_PAGE_LENGTH).
+        limit(SCAN_DIFFERENCES_PAGE_LENGTH).
+        all())
+    return {
+        'scan': scan,
+        'scanner_names': get_delta_scanner_names(scan),
+        'differences': differences,
+        'difference_count': difference_count,
+        'first_difference': (page - 1) * SCAN_DIFFERENCES_PAGE_LENGTH + 1,
+        'page': page,
+        'page_count': -(-difference_count // SCAN_DIFFERENCES_PAGE_LENGTH),
+    }
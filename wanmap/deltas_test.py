@@ -0,0 +1,167 @@
+from ipaddress import ip_address
+import uuid
+
+import arrow
+from bs4 import BeautifulSoup
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.renderers import render
+import pytest
+
+from .deltas import (
+    diff_delta_scan, ScanDifference, show_scan_differences,
+)
+from .scans import DeltaScan, PING_SWEEP
+
+SCANNER_A_XML = (
+    '<nmaprun>'
+    '<host><status state="up"/><address addr="10.1.0.1" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="22"><state state="open"/></port>'
+    '<port protocol="tcp" portid="80"><state state="closed"/></port>'
+    '</ports></host>'
+    '<host><status state="up"/><address addr="10.1.0.2" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="443"><state state="open"/></port>'
+    '</ports></host>'
+    '<host><status state="up"/><address addr="10.1.0.3" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="22"><state state="open"/></port>'
+    '</ports></host>'
+    '</nmaprun>'
+)
+
+SCANNER_B_XML = (
+    '<nmaprun>'
+    '<host><status state="up"/><address addr="10.1.0.1" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="22"><state state="open"/></port>'
+    '<port protocol="tcp" portid="80"><state state="filtered"/></port>'
+    '</ports></host>'
+    '<host><status state="down"/><address addr="10.1.0.2" addrtype="ipv4"/>'
+    '</host>'
+    '<host><status state="up"/><address addr="10.1.0.3" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="22"><state state="open"/></port>'
+    '</ports></host>'
+    '<host><status state="up"/><address addr="10.1.0.4" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="8080"><state state="open"/></port>'
+    '</ports></host>'
+    '</nmaprun>'
+)
+
+
+@pytest.fixture
+def delta_scan(dbsession, fake_wan_scanners, fake_wan_routers):
+    scan = DeltaScan.create(
+        session=dbsession, parameters=PING_SWEEP,
+        scanner_names=('scanner2', 'scanner1'), targets=('10.1.0.0/24',))
+    dbsession.add(scan)
+    dbsession.flush()
+    return scan
+
+
+@pytest.fixture
+def completed_delta_scan(dbsession, delta_scan):
+    results = {'scanner1': SCANNER_A_XML, 'scanner2': SCANNER_B_XML}
+    started_at = arrow.now().datetime
+    for subscan in delta_scan.subscans:
+        subscan.complete(
+            results[subscan.scanner_name], (started_at, started_at))
+    dbsession.flush()
+    return delta_scan
+
+
+def differences(dbsession, scan):
+    return {
+        (str(difference.ip), difference.port,
+         difference.state_a, difference.state_b)
+        for difference in dbsession.query(ScanDifference).filter_by(
+            scan_id=scan.id)
+    }
+
+
+def test_diff_delta_scan_finds_host_and_port_differences(
+    dbsession, completed_delta_scan):
+
+    diff_delta_scan(dbsession, completed_delta_scan)
+    assert differences(dbsession, completed_delta_scan) == {
+        ('10.1.0.1', '80/tcp', 'closed', 'filtered'),
+        ('10.1.0.2', None, 'up', 'down'),
+        ('10.1.0.2', '443/tcp', 'open', None),
+        ('10.1.0.4', None, None, 'up'),
+        ('10.1.0.4', '8080/tcp', None, 'open'),
+    }
+
+
+def test_diff_delta_scan_skips_matching_hosts(
+    dbsession, completed_delta_scan):
+
+    diff_delta_scan(dbsession, completed_delta_scan)
+    addresses = {
+        address for address, *_ in
+        differences(dbsession, completed_delta_scan)
+    }
+    assert '10.1.0.3' not in addresses
+
+
+def test_diff_delta_scan_replaces_differences(
+    dbsession, completed_delta_scan):
+
+    first_count = diff_delta_scan(dbsession, completed_delta_scan)
+    assert diff_delta_scan(dbsession, completed_delta_scan) == first_count
+    assert len(differences(dbsession, completed_delta_scan)) == first_count
+
+
+def test_diff_delta_scan_identical_results_have_no_differences(
+    dbsession, delta_scan):
+
+    started_at = arrow.now().datetime
+    for subscan in delta_scan.subscans:
+        subscan.complete(SCANNER_A_XML, (started_at, started_at))
+    dbsession.flush()
+    assert diff_delta_scan(dbsession, delta_scan) == 0
+
+
+@pytest.fixture
+def differences_request(dbsession, rendering_request, completed_delta_scan):
+    diff_delta_scan(dbsession, completed_delta_scan)
+    rendering_request.matchdict['id'] = str(completed_delta_scan.id)
+    return rendering_request
+
+
+def test_show_scan_differences_orders_by_address_and_port(
+    differences_request):
+
+    response = show_scan_differences(differences_request)
+    assert response['scanner_names'] == ('scanner1', 'scanner2')
+    assert response['difference_count'] == 5
+    assert [
+        (difference.ip, difference.port)
+        for difference in response['differences']
+    ] == [
+        (ip_address('10.1.0.1'), '80/tcp'),
+        (ip_address('10.1.0.2'), None),
+        (ip_address('10.1.0.2'), '443/tcp'),
+        (ip_address('10.1.0.4'), None),
+        (ip_address('10.1.0.4'), '8080/tcp'),
+    ]
+
+
+def test_show_scan_differences_renders_table(differences_request):
+    html = render(
+        'wanmap:templates/scan_differences.jinja2',
+        show_scan_differences(differences_request),
+        request=differences_request)
+    table = BeautifulSoup(html, 'html.parser').find(id='scan-differences')
+    assert len(table.tbody.find_all('tr')) == 5
+    assert 'not reported' in table.tbody.text
+
+
+def test_show_scan_differences_pages(monkeypatch, differences_request):
+    monkeypatch.setattr('wanmap.deltas.SCAN_DIFFERENCES_PAGE_LENGTH', 2)
+    differences_request.GET['page'] = '3'
+    response = show_scan_differences(differences_request)
+    assert response['page_count'] == 3
+    assert response['first_difference'] == 5
+    assert len(response['differences']) == 1
+
+
+def test_show_scan_differences_nonexistent_scan_fails(view_request):
+    view_request.matchdict['id'] = str(uuid.uuid4())
+    with pytest.raises(HTTPNotFound):
+        show_scan_differences(view_request)
@@ -1,5 +1,8 @@
+from ipaddress import ip_interface
+
 import pytest
 
+from .network import RouterKnownHost
 from .scans import DeltaScan, PING_SWEEP
 
 
@@ -22,3 +25,22 @@ def test_create_delta_scan_errors_on_no_targets(dbsession, fake_wan_scanners):
         DeltaScan.create(
             session=dbsession, parameters=PING_SWEEP,
             scanner_names=scanner_names, targets=())
+
+
+def test_create_delta_scan_known_hosts_only(
+    dbsession, fake_wan_scanners, fake_wan_routers):
+
+    dmz = fake_wan_routers[2]
+    dmz._known_hosts.append(
+        RouterKnownHost(address=ip_interface('203.0.113.10')))
+    dbsession.flush()
+    scan = DeltaScan.create(
+        session=dbsession, parameters=PING_SWEEP,
+        scanner_names=('external', 'dmzscanner'),
+        targets=('203.0.113.0/24',), known_hosts_only=True)
+    subscan_targets = {
+        target.target
+        for subscan in scan.subscans
+        for target in subscan.targets
+    }
+    assert subscan_targets == {'203.0.113.10/32'}
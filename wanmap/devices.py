@@ -0,0 +1,209 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import errno
+import logging
+import socket
+import threading
+import time
+
+from napalm import get_network_driver
+
+# Probed in order when a device's driver is not yet known.
+CANDIDATE_DRIVERS = ('vyos', 'ios', 'eos', 'junos', 'nxos_ssh', 'iosxr')
+DEVICE_SESSION_IDLE_TIMEOUT = 600
+MAX_IDLE_DEVICE_SESSIONS = 256
+# Hosts that time out are not retried for this long.
+UNREACHABLE_HOST_BACKOFF = 300
+UNREACHABLE_ERRNOS = {errno.EHOSTUNREACH, errno.ENETUNREACH}
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceSessionPool:
+    """
+    Keeps napalm device sessions warm between router collections.
+
+    The driver that first connects to a host is remembered, so later
+    sessions skip probing drivers that already failed. The others are probed
+    again if that driver fails on a host that answers, as the host may have
+    been replaced. A host that does not answer keeps its driver, and fails
+    fast until ``unreachable_backoff`` passes. Released sessions are kept open
+    for reuse until idle longer than ``idle_timeout`` or displaced by newer
+    sessions beyond ``max_idle``. A timer closes idle sessions, so routers'
+    vty lines are freed between discovery runs.
+    """
+
+    def __init__(
+            self, drivers=CANDIDATE_DRIVERS,
+            idle_timeout=DEVICE_SESSION_IDLE_TIMEOUT,
+            max_idle=MAX_IDLE_DEVICE_SESSIONS, clock=time.monotonic,
+            timer=threading.Timer,
+            unreachable_backoff=UNREACHABLE_HOST_BACKOFF):
+        self._drivers = tuple(drivers)
+        self._idle_timeout = idle_timeout
+        self._max_idle = max_idle
+        self._unreachable_backoff = unreachable_backoff
+        self._clock = clock
+        self._timer = timer
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+        # Maps hostnames that timed out to when they may be retried
+        self._unreachable = {}
+        # Maps (hostname, credentials) to (device, released_at), oldest first
+        self._idle = OrderedDict()
+        self._eviction = None
+
+    def fingerprint(self, hostname):
+        """The name of the napalm driver known to work for a host."""
+        return self._fingerprints.get(hostname)
+
+    @contextmanager
+    def session(self, hostname, credentials):
+        """Borrows an open device session, returning it to the pool after."""
+        key = (hostname, tuple(credentials))
+        device = self._acquire(key)
+        try:
+            yield device
+        except Exception:
+            _close(device)
+            raise
+        self._release(key, device)
+
+    def evict_idle(self):
+        """Closes sessions idle beyond the timeout."""
+        expired_before = self._clock() - self._idle_timeout
+        with self._lock:
+            expired = [
+                key for key, (_, released_at) in self._idle.items()
+                if released_at <= expired_before
+            ]
+            devices = [self._idle.pop(key)[0] for key in expired]
+        for device in devices:
+            _close(device)
+
+    def close(self):
+        """Closes every idle session."""
+        with self._lock:
+            devices = [device for device, _ in self._idle.values()]
+            self._idle.clear()
+            if self._eviction:
+                self._eviction.cancel()
+                self._eviction = None
+        for device in devices:
+            _close(device)
+
+    def _evict_on_timer(self):
+        with self._lock:
+            self._eviction = None
+        self.evict_idle()
+        with self._lock:
+            self._schedule_eviction()
+
+    def _schedule_eviction(self):
+        # Called with the lock held. Fires when the oldest session expires.
+        if self._eviction or not self._idle:
+            return
+        _, oldest_released_at = next(iter(self._idle.values()))
+        delay = max(
+            oldest_released_at + self._idle_timeout - self._clock(), 0)
+        self._eviction = self._timer(delay, self._evict_on_timer)
+        self._eviction.daemon = True
+        self._eviction.start()
+
+    def _acquire(self, key):
+        self.evict_idle()
+        with self._lock:
+            device, _ = self._idle.pop(key, (None, None))
+        if device is not None:
+            if _is_alive(device):
+                logger.debug('Reusing device session for %s', key[0])
+                return device
+            _close(device)
+        return self._open(*key)
+
+    def _release(self, key, device):
+        with self._lock:
+            displaced = self._idle.pop(key, None)
+            self._idle[key] = (device, self._clock())
+            while len(self._idle) > self._max_idle:
+                _, (oldest, _) = self._idle.popitem(last=False)
+                _close(oldest)
+            self._schedule_eviction()
+        if displaced:
+            _close(displaced[0])
+
+    def _open(self, hostname, credentials):
+        retry_at = self._unreachable.get(hostname)
+        if retry_at is not None:
+            if self._clock() < retry_at:
+                raise ConnectionError(
+                    f'{hostname} is unreachable, retrying later')
+            self._unreachable.pop(hostname, None)
+        known_driver = self._fingerprints.get(hostname)
+        driver_names = self._drivers
+        if known_driver:
+            # Other drivers are probed again if the host was replaced.
+            driver_names = (known_driver,) + tuple(
+                driver for driver in self._drivers if driver != known_driver)
+        error = None
+        for driver_name in driver_names:
+            driver = get_network_driver(driver_name)
+            device = driver(hostname, *credentials)
+            try:
+                device.open()
+            except Exception as exc:
+                if _is_unreachable(exc):
+                    # Every driver would wait out the same timeout.
+                    self._unreachable[hostname] = (
+                        self._clock() + self._unreachable_backoff)
+                    raise ConnectionError(
+                        f'{hostname} is unreachable') from exc
+                logger.debug(
+                    'Driver %s failed to connect to %s: %s',
+                    driver_name, hostname, exc)
+                error = exc
+                if driver_name == known_driver:
+                    self._fingerprints.pop(hostname, None)
+                continue
+            if driver_name != known_driver:
+                logger.info(
+                    'Fingerprinted %s as %s', hostname, driver_name)
+                self._fingerprints[hostname] = driver_name
+            return device
+        raise ConnectionError(
+            f'Unable to connect to {hostname} with drivers '
+            f'{", ".join(driver_names)}') from error
+
+
+def _is_unreachable(error):
+    """
+    Whether an error opening a session shows the host does not answer,
+    rather than rejects the driver's protocol. Drivers wrap socket errors,
+    so the errors they were raised handling are checked too.
+    """
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (TimeoutError, socket.gaierror)):
+            return True
+        if isinstance(error, OSError) and error.errno in UNREACHABLE_ERRNOS:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _is_alive(device):
+    try:
+        return device.is_alive().get('is_alive', False)
+    except Exception:
+        return False
+
+
+def _close(device):
+    try:
+        device.close()
+    except Exception:
+        logger.debug('Error closing device session', exc_info=True)
+
+
+device_sessions = DeviceSessionPool()
@@ -0,0 +1,259 @@
+import pytest
+
+from .devices import DeviceSessionPool, UNREACHABLE_HOST_BACKOFF
+
+CREDENTIALS = ('wanmap', 'wanmap')
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTimer:
+    """A threading.Timer stand-in that fires when the test says."""
+
+    def __init__(self, interval, function):
+        self.interval = interval
+        self.function = function
+        self.started = self.cancelled = False
+
+    def start(self):
+        self.started = True
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeDevice:
+    """
+    A napalm device stand-in that only connects to matching hosts, and
+    times out connecting to hosts that are down.
+    """
+
+    def __init__(
+            self, driver_name, reachable_hosts, down_hosts, hostname,
+            *credentials):
+        self.driver_name = driver_name
+        self.hostname = hostname
+        self.reachable = hostname in reachable_hosts
+        self.down = hostname in down_hosts
+        self.opened = self.closed = False
+
+    def open(self):
+        if self.down:
+            try:
+                raise TimeoutError(self.hostname)
+            except TimeoutError:
+                # As napalm wraps netmiko's wrapping of socket errors
+                raise RuntimeError(f'Cannot connect to {self.hostname}')
+        if not self.reachable:
+            raise ConnectionRefusedError(self.hostname)
+        self.opened = True
+
+    def close(self):
+        self.closed = True
+
+    def is_alive(self):
+        return {'is_alive': self.opened and not self.closed}
+
+
+@pytest.fixture
+def vendors():
+    """The hosts each driver connects to in a fake mixed-vendor network."""
+    return {'vyos': {'r0', 'r1'}, 'ios': {'r2'}}
+
+
+@pytest.fixture
+def down_hosts():
+    return set()
+
+
+@pytest.fixture
+def opened_devices(monkeypatch, vendors, down_hosts):
+    """Records every device instantiated by the fake network."""
+    devices = []
+
+    def fake_get_network_driver(driver_name):
+        def driver(hostname, *credentials):
+            device = FakeDevice(
+                driver_name, vendors.get(driver_name, set()), down_hosts,
+                hostname, *credentials)
+            devices.append(device)
+            return device
+        return driver
+
+    monkeypatch.setattr(
+        'wanmap.devices.get_network_driver', fake_get_network_driver)
+    return devices
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def timers():
+    return []
+
+
+@pytest.fixture
+def pool(opened_devices, clock, timers):
+    def timer(interval, function):
+        timers.append(FakeTimer(interval, function))
+        return timers[-1]
+
+    return DeviceSessionPool(
+        drivers=('vyos', 'ios'), idle_timeout=60, max_idle=2, clock=clock,
+        timer=timer)
+
+
+def test_pool_fingerprints_driver_by_probing(pool):
+    with pool.session('r2', CREDENTIALS) as device:
+        assert device.driver_name == 'ios'
+    assert pool.fingerprint('r2') == 'ios'
+
+
+def test_pool_skips_failed_probes_after_fingerprinting(pool, opened_devices):
+    with pool.session('r2', CREDENTIALS) as device:
+        pass
+    device.close()
+    opened_devices.clear()
+    with pool.session('r2', CREDENTIALS):
+        pass
+    assert [device.driver_name for device in opened_devices] == ['ios']
+
+
+def test_pool_reprobes_when_fingerprinted_driver_fails(
+    pool, vendors, opened_devices):
+
+    with pool.session('r2', CREDENTIALS) as device:
+        pass
+    device.close()
+    vendors['ios'].remove('r2')
+    vendors['vyos'].add('r2')
+    with pool.session('r2', CREDENTIALS) as device:
+        assert device.driver_name == 'vyos'
+    assert pool.fingerprint('r2') == 'vyos'
+
+
+def test_pool_keeps_fingerprint_of_host_that_times_out(
+    pool, down_hosts, opened_devices):
+
+    with pool.session('r2', CREDENTIALS) as device:
+        pass
+    device.close()
+    opened_devices.clear()
+    down_hosts.add('r2')
+    with pytest.raises(ConnectionError):
+        with pool.session('r2', CREDENTIALS):
+            pass
+    assert [device.driver_name for device in opened_devices] == ['ios']
+    assert pool.fingerprint('r2') == 'ios'
+
+
+def test_pool_backs_off_unreachable_host(
+    pool, clock, down_hosts, opened_devices):
+
+    down_hosts.add('r2')
+    with pytest.raises(ConnectionError):
+        with pool.session('r2', CREDENTIALS):
+            pass
+    assert len(opened_devices) == 1
+    down_hosts.clear()
+    clock.now += UNREACHABLE_HOST_BACKOFF - 1
+    with pytest.raises(ConnectionError):
+        with pool.session('r2', CREDENTIALS):
+            pass
+    assert len(opened_devices) == 1
+    clock.now += 1
+    with pool.session('r2', CREDENTIALS) as device:
+        assert device.driver_name == 'ios'
+
+
+def test_pool_reuses_warm_session(pool):
+    with pool.session('r0', CREDENTIALS) as first:
+        pass
+    with pool.session('r0', CREDENTIALS) as second:
+        pass
+    assert first is second
+    assert not first.closed
+
+
+def test_pool_does_not_share_sessions_across_credentials(pool):
+    with pool.session('r0', CREDENTIALS) as first:
+        pass
+    with pool.session('r0', ('admin', 'admin')) as second:
+        pass
+    assert first is not second
+
+
+def test_pool_evicts_idle_sessions(pool, clock):
+    with pool.session('r0', CREDENTIALS) as first:
+        pass
+    clock.now += 61
+    with pool.session('r0', CREDENTIALS) as second:
+        pass
+    assert first.closed
+    assert first is not second
+
+
+def test_pool_evicts_idle_sessions_on_timer(pool, clock, timers):
+    with pool.session('r0', CREDENTIALS) as first:
+        pass
+    clock.now += 30
+    with pool.session('r1', CREDENTIALS) as second:
+        pass
+    timer, = timers
+    assert timer.started and timer.interval == 60
+    clock.now += 30
+    timer.function()
+    assert first.closed and not second.closed
+    assert timers[-1].interval == 30
+    clock.now += 30
+    timers[-1].function()
+    assert second.closed
+    assert len(timers) == 2
+
+
+def test_pool_close_cancels_eviction(pool, timers):
+    with pool.session('r0', CREDENTIALS) as device:
+        pass
+    pool.close()
+    assert device.closed
+    assert timers[0].cancelled
+
+
+def test_pool_caps_idle_sessions(pool):
+    sessions = []
+    for hostname in ('r0', 'r1', 'r2'):
+        with pool.session(hostname, CREDENTIALS) as device:
+            sessions.append(device)
+    assert [device.closed for device in sessions] == [True, False, False]
+
+
+def test_pool_replaces_dead_sessions(pool):
+    with pool.session('r0', CREDENTIALS) as first:
+        pass
+    first.closed = True
+    with pool.session('r0', CREDENTIALS) as second:
+        pass
+    assert first is not second
+
+
+def test_pool_closes_session_on_error(pool):
+    with pytest.raises(RuntimeError):
+        with pool.session('r0', CREDENTIALS) as device:
+            raise RuntimeError
+    assert device.closed
+
+
+def test_pool_unreachable_host_raises_connection_error(pool):
+    with pytest.raises(ConnectionError):
+        with pool.session('r9', CREDENTIALS):
+            pass
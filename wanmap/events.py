@@ -0,0 +1,113 @@
+"""Scan progress events relayed from the task queue to console clients."""
+
+import json
+import logging
+import threading
+import time
+
+import redis
+import transaction
+
+# Matches the Celery result backend.
+DEFAULT_REDIS_URL = 'redis://'
+EVENT_STREAM_HEARTBEAT_SECONDS = 15
+# Each stream holds a server thread, so streams are capped below the
+# threads setting of the server. Clients beyond the cap poll by
+# reconnecting after the retry delay, and streams end after a while so
+# they get their turn.
+MAX_EVENT_STREAMS = 32
+EVENT_STREAM_MAX_SECONDS = 5 * 60
+EVENT_STREAM_RETRY_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+_clients = {}
+_stream_slots = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+
+
+def get_redis(url=DEFAULT_REDIS_URL):
+    """Returns a shared client, which pools connections per URL."""
+    client = _clients.get(url)
+    if client is None:
+        client = _clients.setdefault(url, redis.Redis.from_url(url))
+    return client
+
+
+def scan_channel(scan_id):
+    return f'wanmap:scans:{scan_id}:events'
+
+
+def publish_scan_event(scan_id, event, data, client=None):
+    client = client or get_redis()
+    message = json.dumps({'event': event, 'data': data})
+    client.publish(scan_channel(scan_id), message)
+
+
+def publish_scan_event_after_commit(scan_id, event, data):
+    """
+    Publishes once the current transaction commits.
+
+    Clients may reload state from the database upon an event, so events
+    must not announce uncommitted changes.
+    """
+    def publish(committed):
+        if not committed:
+            return
+        try:
+            publish_scan_event(scan_id, event, data)
+        except redis.RedisError:
+            logger.warning(
+                'Unable to publish %s event for scan %s', event, scan_id,
+                exc_info=True)
+
+    transaction.get().addAfterCommitHook(publish)
+
+
+def format_server_sent_event(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode()
+
+
+def stream_scan_events(
+        pubsub, initial_events, is_final,
+        heartbeat=EVENT_STREAM_HEARTBEAT_SECONDS,
+        max_seconds=EVENT_STREAM_MAX_SECONDS, clock=time.monotonic):
+    """
+    Yields Server-Sent Events for one scan until ``is_final(event, data)``.
+
+    ``pubsub`` must already be subscribed to the scan's channel before the
+    initial events are read from the database, so no event is missed
+    between the two. Only the initial events are sent while
+    ``MAX_EVENT_STREAMS`` others stream, and the stream ends after
+    ``max_seconds``. Either way, clients are told to reconnect later.
+    """
+    try:
+        for event, data in initial_events:
+            yield format_server_sent_event(event, data)
+            if is_final(event, data):
+                return
+        if not _stream_slots.acquire(blocking=False):
+            yield _retry_later()
+            return
+        try:
+            ends_at = clock() + max_seconds
+            while clock() < ends_at:
+                message = pubsub.get_message(
+                    ignore_subscribe_messages=True, timeout=heartbeat)
+                if message is None:
+                    # Comments keep proxies open and detect closed clients.
+                    yield b': heartbeat\n\n'
+                    continue
+                payload = json.loads(message['data'])
+                event, data = payload['event'], payload['data']
+                yield format_server_sent_event(event, data)
+                if is_final(event, data):
+                    return
+            yield _retry_later()
+        finally:
+            _stream_slots.release()
+    finally:
+        pubsub.close()
+
+
+def _retry_later():
+    return f'retry: {EVENT_STREAM_RETRY_SECONDS * 1000}\n\n'.encode()
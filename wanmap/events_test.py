@@ -0,0 +1,87 @@
+import json
+import threading
+
+from .events import (
+    EVENT_STREAM_RETRY_SECONDS, format_server_sent_event, stream_scan_events,
+)
+
+RETRY_LATER = f'retry: {EVENT_STREAM_RETRY_SECONDS * 1000}\n\n'.encode()
+
+
+class FakePubSub:
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.closed = False
+
+    def get_message(self, ignore_subscribe_messages, timeout):
+        if not self.messages:
+            return None
+        event, data = self.messages.pop(0)
+        return {'data': json.dumps({'event': event, 'data': data})}
+
+    def close(self):
+        self.closed = True
+
+
+def is_done(event, data):
+    return event == 'status' and data == 'done'
+
+
+def test_format_server_sent_event():
+    assert format_server_sent_event('status', {'status': 'SCHEDULED'}) == (
+        b'event: status\ndata: {"status": "SCHEDULED"}\n\n')
+
+
+def test_stream_scan_events_relays_until_final_event():
+    pubsub = FakePubSub([('hosts', []), ('status', 'done'), ('hosts', [])])
+    stream = list(stream_scan_events(pubsub, [('status', 'running')], is_done))
+    assert stream == [
+        format_server_sent_event('status', 'running'),
+        format_server_sent_event('hosts', []),
+        format_server_sent_event('status', 'done'),
+    ]
+    assert pubsub.closed
+
+
+def test_stream_scan_events_stops_after_final_initial_event():
+    pubsub = FakePubSub([('hosts', [])])
+    stream = list(stream_scan_events(pubsub, [('status', 'done')], is_done))
+    assert stream == [format_server_sent_event('status', 'done')]
+    assert pubsub.closed
+
+
+def test_stream_scan_events_sends_heartbeats_while_idle():
+    pubsub = FakePubSub([])
+    stream = stream_scan_events(pubsub, [], is_done)
+    assert next(stream).startswith(b':')
+    stream.close()
+    assert pubsub.closed
+
+
+def test_stream_scan_events_ends_after_max_seconds():
+    pubsub = FakePubSub([('hosts', [])] * 3)
+    clock = iter([0, 0, 10]).__next__
+    stream = list(stream_scan_events(
+        pubsub, [('status', 'running')], is_done, max_seconds=10,
+        clock=clock))
+    assert stream == [
+        format_server_sent_event('status', 'running'),
+        format_server_sent_event('hosts', []),
+        RETRY_LATER,
+    ]
+    assert pubsub.closed
+
+
+def test_stream_scan_events_beyond_cap_sends_initial_events(monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr('wanmap.events._stream_slots', slots)
+    streaming = stream_scan_events(FakePubSub([]), [], is_done)
+    next(streaming)
+    pubsub = FakePubSub([('hosts', [])])
+    stream = list(stream_scan_events(pubsub, [('status', 'running')], is_done))
+    assert stream == [
+        format_server_sent_event('status', 'running'), RETRY_LATER]
+    assert pubsub.closed
+    streaming.close()
+    assert slots.acquire(blocking=False)
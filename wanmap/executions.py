@@ -0,0 +1,138 @@
+"""
+Scanner tasks held on the console until their scanner has a free slot.
+
+Each scanner reports how many nmap processes it can run at once. Tasks
+beyond that wait here, oldest first, instead of queueing on the scanner.
+"""
+
+from uuid import uuid4
+
+import arrow
+from sqlalchemy import Column, DateTime, ForeignKey, func, Index, String
+from sqlalchemy.dialects import postgresql
+
+from .scanners import Scanner
+from .schema import Persistable
+
+# Discovery sweeps run beside the port scans they queue.
+SWEEP_TASK = 'exec_discovery_scan'
+
+
+class ScannerExecution(Persistable):
+    """A scanner task, queued until sent and held until it reports back."""
+
+    __tablename__ = 'scanner_executions'
+    id = Column(postgresql.UUID(as_uuid=True), primary_key=True)
+    scanner_name = Column(
+        String(64), ForeignKey('scanners.name'), nullable=False)
+    scan_id = Column(
+        postgresql.UUID(as_uuid=True), ForeignKey('scans.id'),
+        nullable=False)
+    task = Column(String(64), nullable=False)
+    args = Column(postgresql.JSONB, nullable=False)
+    kwargs = Column(postgresql.JSONB, nullable=False)
+    queued_at = Column(DateTime(timezone=True), nullable=False)
+    sent_at = Column(DateTime(timezone=True))
+
+    __table_args__ = (
+        Index(
+            'ix_scanner_executions_scanner_name_sent_at_queued_at',
+            'scanner_name', 'sent_at', 'queued_at'),
+    )
+
+
+def queue_execution(dbsession, subscan_key, task, args, kwargs=None):
+    scan_id, scanner_name = subscan_key
+    execution = ScannerExecution(
+        id=uuid4(), scanner_name=scanner_name, scan_id=scan_id, task=task,
+        args=args, kwargs=kwargs or {}, queued_at=arrow.now().datetime)
+    dbsession.add(execution)
+    return execution
+
+
+def claim_executions(dbsession, scanner_names, now=None):
+    """
+    Marks the oldest queued tasks of the scanners sent, as many as each has
+    free slots, and returns them.
+
+    Discovery sweeps have slots of their own, as port scans of the hosts a
+    sweep finds cannot start while the sweep holds their slot.
+
+    The scanners are locked, so concurrent claims cannot exceed slots.
+    """
+    now = now or arrow.now().datetime
+    dbsession.flush()
+    scanners = (
+        dbsession.query(Scanner).
+        filter(Scanner.name.in_(sorted(scanner_names))).
+        order_by(Scanner.name).
+        with_for_update().
+        all())
+    claimed = []
+    for scanner in scanners:
+        for kind in (
+                ScannerExecution.task != SWEEP_TASK,
+                ScannerExecution.task == SWEEP_TASK):
+            executions = dbsession.query(ScannerExecution).filter(
+                ScannerExecution.scanner_name == scanner.name, kind)
+            running = (
+                executions.
+                filter(ScannerExecution.sent_at.isnot(None)).
+                with_entities(func.count()).
+                scalar())
+            free_slots = scanner.slots - running
+            if free_slots <= 0:
+                continue
+            queued = (
+                executions.
+                filter(ScannerExecution.sent_at.is_(None)).
+                order_by(ScannerExecution.queued_at, ScannerExecution.id).
+                limit(free_slots).
+                all())
+            for execution in queued:
+                execution.sent_at = now
+            claimed += queued
+    return claimed
+
+
+def requeue_executions(dbsession, scanner_name):
+    """
+    Queues the sent tasks of a scanner again, as a scanner that restarted
+    has lost them.
+
+    Each is queued under a new id. A copy of the lost task the broker still
+    delivers reports under the old id, which is no longer outstanding, so
+    only one of them is recorded.
+    """
+    lost = (
+        dbsession.query(ScannerExecution).
+        filter(
+            ScannerExecution.scanner_name == scanner_name,
+            ScannerExecution.sent_at.isnot(None)).
+        all())
+    for execution in lost:
+        execution.id = uuid4()
+        execution.sent_at = None
+    return len(lost)
+
+
+def get_waiting_scanner_names(dbsession):
+    """The names of scanners with tasks queued or sent."""
+    return {
+        scanner_name for scanner_name, in
+        dbsession.query(ScannerExecution.scanner_name).distinct()
+    }
+
+
+def is_outstanding(dbsession, execution_id):
+    """Whether a task was sent under this id and has not reported back."""
+    return dbsession.query(ScannerExecution).get(execution_id) is not None
+
+
+def finish_execution(dbsession, execution_id):
+    """Frees the slot of a task, returning its scanner's name."""
+    execution = dbsession.query(ScannerExecution).get(execution_id)
+    if not execution:
+        return None
+    dbsession.delete(execution)
+    return execution.scanner_name
@@ -0,0 +1,108 @@
+from datetime import timedelta
+
+import arrow
+import pytest
+
+from .executions import (
+    claim_executions, finish_execution, get_waiting_scanner_names,
+    is_outstanding, queue_execution, requeue_executions, SWEEP_TASK,
+)
+from .scans import PING_SWEEP, SplittingScan
+
+
+@pytest.fixture
+def queue(dbsession, fake_wan_scanners, fake_wan_routers):
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP, targets=('10.1.0.0/24',))
+    dbsession.add(scan)
+    dbsession.flush()
+
+    def queue(count, scanner_name='scanner1', task='exec_nmap_scan'):
+        subscan_key = [str(scan.id), scanner_name]
+        return [
+            queue_execution(
+                dbsession, subscan_key, task,
+                [subscan_key, [str(index)], ['10.1.0.0/24']])
+            for index in range(count)
+        ]
+    return queue
+
+
+def test_claim_executions_fills_free_slots_oldest_first(
+    dbsession, fake_wan_scanners, queue):
+
+    fake_wan_scanners[2].slots = 2
+    executions = queue(3)
+    assert claim_executions(dbsession, ['scanner1']) == executions[:2]
+    assert claim_executions(dbsession, ['scanner1']) == []
+
+
+def test_claim_executions_sends_batches_beside_sweep(
+    dbsession, fake_wan_scanners, queue):
+
+    fake_wan_scanners[2].slots = 1
+    sweep, = queue(1, task=SWEEP_TASK)
+    waiting_sweep, = queue(1, task=SWEEP_TASK)
+    assert claim_executions(dbsession, ['scanner1']) == [sweep]
+    batch, waiting_batch = queue(2)
+    assert claim_executions(dbsession, ['scanner1']) == [batch]
+    assert claim_executions(dbsession, ['scanner1']) == []
+
+
+def test_finish_execution_frees_slot(dbsession, queue):
+    first, second = queue(2)
+    claim_executions(dbsession, ['scanner1'])
+    assert finish_execution(dbsession, first.id) == 'scanner1'
+    assert claim_executions(dbsession, ['scanner1']) == [second]
+
+
+def test_finish_execution_ignores_unknown(dbsession, queue):
+    execution, = queue(1)
+    finish_execution(dbsession, execution.id)
+    dbsession.flush()
+    assert finish_execution(dbsession, execution.id) is None
+
+
+def test_claim_executions_counts_slots_per_scanner(dbsession, queue):
+    queue(2)
+    queue(1, scanner_name='scanner2')
+    claimed = claim_executions(dbsession, ['scanner1', 'scanner2'])
+    assert [execution.scanner_name for execution in claimed] == [
+        'scanner1', 'scanner2']
+
+
+def test_claim_executions_never_resends_running(dbsession, queue):
+    running, waiting = queue(2)
+    sent_at = arrow.now().datetime
+    claim_executions(dbsession, ['scanner1'], now=sent_at)
+    later = sent_at + timedelta(days=2)
+    assert claim_executions(dbsession, ['scanner1'], now=later) == []
+    assert running.sent_at == sent_at
+    assert waiting.sent_at is None
+
+
+def test_requeue_executions_frees_slots_of_restarted_scanner(
+    dbsession, queue):
+
+    lost, waiting = queue(2)
+    claim_executions(dbsession, ['scanner1'])
+    assert requeue_executions(dbsession, 'scanner1') == 1
+    assert claim_executions(dbsession, ['scanner1']) == [lost]
+
+
+def test_requeue_executions_outdates_lost_ids(dbsession, queue):
+    lost, = queue(1)
+    claim_executions(dbsession, ['scanner1'])
+    lost_id = lost.id
+    requeue_executions(dbsession, 'scanner1')
+    dbsession.flush()
+    assert not is_outstanding(dbsession, lost_id)
+    assert finish_execution(dbsession, lost_id) is None
+    assert is_outstanding(dbsession, lost.id)
+
+
+def test_get_waiting_scanner_names(dbsession, queue):
+    queue(2)
+    queue(1, scanner_name='scanner2')
+    dbsession.flush()
+    assert get_waiting_scanner_names(dbsession) == {'scanner1', 'scanner2'}
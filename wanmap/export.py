@@ -0,0 +1,122 @@
+"""Streaming export of host and port results across many scans."""
+
+import csv
+import io
+import json
+import zlib
+
+from .scans import Scan, SubscanHost, SubscanPort
+
+EXPORT_FIELDS = (
+    'scan_id', 'scan_created_at', 'scanner', 'address', 'status', 'hostname',
+    'protocol', 'port', 'state', 'service',
+)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+# Rows fetched per round trip of a server-side cursor.
+EXPORT_BATCH_SIZE = 5000
+# Rows formatted into each chunk written to the client.
+EXPORT_CHUNK_ROWS = 1000
+
+
+def export_chunks(session_factory, format_, compress=False, **criteria):
+    """
+    Yields encoded chunks of the rows matching ``criteria``.
+
+    The rows are read with a session of their own, which lasts while the
+    chunks are consumed.
+    """
+    if format_ not in EXPORT_FORMATS:
+        raise ValueError(f'Unknown export format {format_!r}.')
+    dbsession = session_factory()
+    try:
+        chunks = format_rows(export_rows(dbsession, **criteria), format_)
+        if compress:
+            chunks = gzip_chunks(chunks)
+        yield from chunks
+    finally:
+        dbsession.close()
+
+
+def export_rows(dbsession, since=None, until=None, scan_ids=None):
+    """
+    Yields a row per scanned port, or per host without ports, of the scans
+    created in ``[since, until)`` or with the given IDs.
+
+    Rows are read through a server-side cursor as they are consumed.
+    """
+    # The base table alone, without joining the scan subclass tables
+    scans = Scan.__table__
+    query = (
+        dbsession.query(
+            scans.c.id, scans.c.created_at, SubscanHost.scanner_name,
+            SubscanHost.address, SubscanHost.status, SubscanHost.hostname,
+            SubscanPort.protocol, SubscanPort.number, SubscanPort.state,
+            SubscanPort.service).
+        select_from(scans).
+        join(SubscanHost, SubscanHost.scan_id == scans.c.id).
+        outerjoin(SubscanHost.ports))
+    if since:
+        query = query.filter(scans.c.created_at >= since)
+    if until:
+        query = query.filter(scans.c.created_at < until)
+    if scan_ids:
+        query = query.filter(scans.c.id.in_(scan_ids))
+    rows = (
+        query.
+        order_by(
+            scans.c.created_at, scans.c.id, SubscanHost.scanner_name,
+            SubscanHost.address, SubscanPort.protocol, SubscanPort.number).
+        execution_options(stream_results=True).
+        yield_per(EXPORT_BATCH_SIZE))
+    for scan_id, created_at, scanner, address, *rest in rows:
+        yield (str(scan_id), created_at.isoformat(), scanner,
+               str(address.ip), *rest)
+
+
+def format_rows(rows, format_):
+    """Encodes rows as chunks of CSV with a header, or of JSON Lines."""
+    if format_ == 'csv':
+        return _csv_chunks(rows)
+    if format_ == 'jsonl':
+        return _jsonl_chunks(rows)
+    raise ValueError(f'Unknown export format {format_!r}.')
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def _csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield _drain(buffer)
+    yield _drain(buffer)
+
+
+def _jsonl_chunks(rows):
+    buffer = io.StringIO()
+    for count, row in enumerate(rows, 1):
+        buffer.write(json.dumps(dict(zip(EXPORT_FIELDS, row))))
+        buffer.write('\n')
+        if count % EXPORT_CHUNK_ROWS == 0:
+            yield _drain(buffer)
+    yield _drain(buffer)
+
+
+def _drain(buffer):
+    chunk = buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+    return chunk
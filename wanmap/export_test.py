@@ -0,0 +1,107 @@
+import csv
+import gzip
+import io
+import json
+from unittest.mock import Mock
+
+import arrow
+import pytest
+
+from .export import (
+    export_chunks, export_rows, format_rows, gzip_chunks, EXPORT_CHUNK_ROWS,
+    EXPORT_FIELDS,
+)
+from .scans import SplittingScan, PING_SWEEP
+
+FAKE_HOST_RESULT_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<nmaprun>'
+    '<host><status state="up"/><address addr="10.1.0.1" addrtype="ipv4"/>'
+    '<ports>'
+    '<port protocol="tcp" portid="22"><state state="open"/>'
+    '<service name="ssh"/></port>'
+    '<port protocol="tcp" portid="80"><state state="closed"/></port>'
+    '</ports></host>'
+    '<host><status state="up"/><address addr="10.1.0.2" addrtype="ipv4"/>'
+    '</host>'
+    '</nmaprun>'
+)
+
+
+@pytest.fixture
+def completed_scan(dbsession, fake_wan_scanners, fake_wan_routers):
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP, targets=('10.1.0.0/24',))
+    dbsession.add(scan)
+    started_at = arrow.now().datetime
+    for subscan in scan.subscans:
+        subscan.complete(FAKE_HOST_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    return scan
+
+
+def test_export_rows_has_row_per_port(dbsession, completed_scan):
+    rows = list(export_rows(dbsession, scan_ids=[completed_scan.id]))
+    scanner_name = completed_scan.subscans[0].scanner_name
+    assert rows[:3] == [
+        (str(completed_scan.id), completed_scan.created_at.isoformat(),
+         scanner_name, '10.1.0.1', 'up', None, 'tcp', 22, 'open', 'ssh'),
+        (str(completed_scan.id), completed_scan.created_at.isoformat(),
+         scanner_name, '10.1.0.1', 'up', None, 'tcp', 80, 'closed', None),
+        (str(completed_scan.id), completed_scan.created_at.isoformat(),
+         scanner_name, '10.1.0.2', 'up', None, None, None, None, None),
+    ]
+
+
+def test_export_rows_by_date_range(dbsession, completed_scan):
+    created_at = arrow.get(completed_scan.created_at)
+    assert list(export_rows(
+        dbsession, since=created_at.datetime,
+        until=created_at.shift(seconds=1).datetime))
+    assert not list(export_rows(
+        dbsession, since=created_at.shift(seconds=1).datetime))
+    assert not list(export_rows(dbsession, until=created_at.datetime))
+
+
+FAKE_ROWS = [
+    ('id', 'time', 'scanner1', f'10.1.0.{i}', 'up', None, 'tcp', 22, 'open',
+     'ssh')
+    for i in range(EXPORT_CHUNK_ROWS + 1)
+]
+
+
+def test_format_rows_csv_has_header():
+    chunks = list(format_rows(FAKE_ROWS, 'csv'))
+    assert len(chunks) == 2
+    rows = list(csv.reader(io.StringIO(b''.join(chunks).decode())))
+    assert tuple(rows[0]) == EXPORT_FIELDS
+    assert rows[1] == [
+        'id', 'time', 'scanner1', '10.1.0.0', 'up', '', 'tcp', '22', 'open',
+        'ssh']
+    assert len(rows) == len(FAKE_ROWS) + 1
+
+
+def test_format_rows_jsonl():
+    lines = b''.join(format_rows(FAKE_ROWS, 'jsonl')).splitlines()
+    assert len(lines) == len(FAKE_ROWS)
+    assert json.loads(lines[0]) == dict(zip(EXPORT_FIELDS, FAKE_ROWS[0]))
+
+
+def test_format_rows_unknown_format_fails():
+    with pytest.raises(ValueError):
+        format_rows(FAKE_ROWS, 'xlsx')
+
+
+def test_gzip_chunks_round_trip():
+    chunks = list(format_rows(FAKE_ROWS, 'csv'))
+    assert gzip.decompress(b''.join(gzip_chunks(chunks))) == b''.join(chunks)
+
+
+def test_export_chunks_closes_session(dbsession, completed_scan):
+    session_factory = Mock(return_value=dbsession)
+    chunks = export_chunks(
+        session_factory, 'jsonl', scan_ids=[completed_scan.id])
+    assert not session_factory.called
+    assert next(chunks)
+    chunks.close()
+    assert session_factory.called
@@ -0,0 +1,198 @@
+"""Index of every host's status and port states over all scans."""
+
+from ipaddress import ip_interface, ip_network
+
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.view import view_config
+from sqlalchemy import (
+    and_, Boolean, Column, DateTime, exists, ForeignKey, Index, Integer,
+    literal, select, String, true, union_all, update,
+)
+from sqlalchemy.dialects import postgresql
+
+from .scans import SubscanHost, SubscanPort
+from .schema import Persistable
+
+HOST_HISTORY_PAGE_LENGTH = 100
+HOST_HISTORY_FILTERS = ('port', 'state')
+
+
+def includeme(config):
+    config.add_route('show_host_history', '/hosts/')
+
+
+class HostHistory(Persistable):
+    """
+    A host status or port state seen by a scanner over successive scans.
+
+    A row lasts from the scan that first saw the state until another state
+    is seen, so there is a row per change rather than per scan.
+    """
+
+    __tablename__ = 'host_history'
+    address = Column(postgresql.INET, primary_key=True)
+    # Empty for the status of the host itself
+    protocol = Column(String(8), primary_key=True, default='')
+    number = Column(Integer, primary_key=True, default=0)
+    scanner_name = Column(String(64), primary_key=True)
+    first_scan_id = Column(
+        postgresql.UUID(as_uuid=True), ForeignKey('scans.id'),
+        primary_key=True)
+    last_scan_id = Column(
+        postgresql.UUID(as_uuid=True), ForeignKey('scans.id'),
+        nullable=False)
+    first_seen_at = Column(DateTime(timezone=True), nullable=False)
+    last_seen_at = Column(DateTime(timezone=True), nullable=False)
+    state = Column(String(16))
+    # Whether this is the latest state seen for the host or port
+    current = Column(Boolean, nullable=False, default=True)
+
+    __table_args__ = (
+        # Serves lookups of addresses within CIDRs.
+        Index(
+            'ix_host_history_address', 'address',
+            postgresql_using='gist', postgresql_ops={'address': 'inet_ops'}),
+        Index(
+            'ix_host_history_current',
+            'address', 'protocol', 'number', 'scanner_name', unique=True,
+            postgresql_where=current),
+    )
+
+    @property
+    def ip(self):
+        return ip_interface(self.address).ip
+
+    @property
+    def port(self):
+        return f'{self.number}/{self.protocol}' if self.protocol else None
+
+
+def record_host_history(dbsession, subscan):
+    """
+    Extends or closes the current history of the hosts and ports reported
+    by a completed subscan, and starts history for any new states.
+
+    The subscan's parsed hosts are merged in the database, in three
+    statements regardless of their number. Results older than the current
+    history are ignored.
+    """
+    history = HostHistory.__table__
+    seen = _subscan_states(subscan)
+    same_key = and_(
+        history.c.current,
+        history.c.address == seen.c.address,
+        history.c.protocol == seen.c.protocol,
+        history.c.number == seen.c.number,
+        history.c.scanner_name == seen.c.scanner_name)
+    finished_at, scan_id = subscan.finished_at, subscan.scan_id
+    dbsession.execute(
+        update(history).
+        where(same_key).
+        where(history.c.state.isnot_distinct_from(seen.c.state)).
+        where(history.c.last_seen_at <= finished_at).
+        values(last_seen_at=finished_at, last_scan_id=scan_id))
+    dbsession.execute(
+        update(history).
+        where(same_key).
+        where(history.c.state.is_distinct_from(seen.c.state)).
+        where(history.c.last_seen_at <= finished_at).
+        values(current=False))
+    new_states = select([
+        seen.c.address, seen.c.protocol, seen.c.number, seen.c.scanner_name,
+        literal(scan_id, postgresql.UUID(as_uuid=True)),
+        literal(scan_id, postgresql.UUID(as_uuid=True)),
+        literal(finished_at), literal(finished_at), seen.c.state, true(),
+    ]).where(~exists().where(same_key))
+    insert = postgresql.insert(history).from_select(
+        ('address', 'protocol', 'number', 'scanner_name', 'first_scan_id',
+         'last_scan_id', 'first_seen_at', 'last_seen_at', 'state', 'current'),
+        new_states)
+    # Results recorded again for the same scan replace its states.
+    insert = insert.on_conflict_do_update(
+        index_elements=[column.name for column in history.primary_key],
+        set_={
+            key: insert.excluded[key]
+            for key in ('last_scan_id', 'last_seen_at', 'state', 'current')
+        })
+    dbsession.execute(insert)
+
+
+def _subscan_states(subscan):
+    hosts, ports = SubscanHost.__table__, SubscanPort.__table__
+    # Hosts served from recent results were not seen again.
+    scanned_hosts = (
+        (hosts.c.scan_id == subscan.scan_id) &
+        (hosts.c.scanner_name == subscan.scanner_name) &
+        hosts.c.cached_scan_id.is_(None))
+    host_states = select([
+        hosts.c.address, literal('').label('protocol'),
+        literal(0).label('number'), hosts.c.scanner_name,
+        hosts.c.status.label('state'),
+    ]).where(scanned_hosts)
+    port_states = select([
+        ports.c.address, ports.c.protocol, ports.c.number,
+        ports.c.scanner_name, ports.c.state,
+    ]).select_from(ports.join(hosts)).where(scanned_hosts)
+    return union_all(host_states, port_states).alias('seen')
+
+
+def find_host_history(dbsession, address, port=None, state=None):
+    """
+    Queries the history of the hosts within an address or CIDR, latest
+    first, optionally of one port or in one state.
+    """
+    try:
+        network = ip_network(address, strict=False)
+    except ValueError:
+        raise ValueError(f'Invalid address or CIDR {address!r}.')
+    query = dbsession.query(HostHistory).filter(
+        HostHistory.address.op('<<=')(network))
+    if port:
+        try:
+            number, _, protocol = port.partition('/')
+            query = query.filter(HostHistory.number == int(number))
+        except ValueError:
+            raise ValueError(f'Invalid port {port!r}.')
+        if protocol:
+            query = query.filter(HostHistory.protocol == protocol)
+    if state:
+        query = query.filter(HostHistory.state == state)
+    return query.order_by(
+        HostHistory.last_seen_at.desc(), HostHistory.address,
+        HostHistory.protocol, HostHistory.number, HostHistory.scanner_name)
+
+
+@view_config(
+    route_name='show_host_history', renderer='templates/host_history.jinja2')
+def show_host_history(request):
+    """Looks up the history of an address or CIDR."""
+    address = request.params.get('address', '').strip()
+    filters = {
+        key: request.params[key] for key in HOST_HISTORY_FILTERS
+        if request.params.get(key)
+    }
+    response = {'address': address, 'filters': filters, 'history': None}
+    if not address:
+        return response
+    try:
+        page = max(1, int(request.params.get('page', 1)))
+        history = find_host_history(request.dbsession, address, **filters)
+    except ValueError as e:
+        raise HTTPBadRequest(str(e))
+    rows = (
+        history.
+        offset((page - 1) * HOST_HISTORY_PAGE_LENGTH).
+        limit(HOST_HISTORY_PAGE_LENGTH + 1).
+        all())
+
+    def page_url(page):
+        query = dict(filters, address=address, page=page)
+        return request.route_url('show_host_history', _query=query)
+
+    response.update(
+        history=rows[:HOST_HISTORY_PAGE_LENGTH],
+        previous_page=page_url(page - 1) if page > 1 else None,
+        next_page=(
+            page_url(page + 1) if len(rows) > HOST_HISTORY_PAGE_LENGTH
+            else None))
+    return response
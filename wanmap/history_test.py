@@ -0,0 +1,116 @@
+from datetime import timedelta
+
+import arrow
+from bs4 import BeautifulSoup
+from pyramid.httpexceptions import HTTPBadRequest
+from pyramid.renderers import render
+import pytest
+
+from .history import (
+    find_host_history, HostHistory, record_host_history, show_host_history,
+)
+
+START = arrow.get('2020-01-01T00:00:00Z')
+
+
+@pytest.fixture
+def scan_history(dbsession, scan_results, result_xml):
+    def scan_history(*hosts, days=0):
+        scan = scan_results(
+            result_xml(*hosts), finished_at=START.shift(days=days).datetime)
+        for subscan in scan.subscans:
+            record_host_history(dbsession, subscan)
+        return scan
+    return scan_history
+
+
+def history(dbsession, address, **filters):
+    return [
+        (row.port, row.state, row.first_seen_at.day, row.last_seen_at.day,
+         row.current)
+        for row in find_host_history(dbsession, address, **filters)
+    ]
+
+
+def test_unchanged_states_extend_history(dbsession, scan_history):
+    first_scan = scan_history(('10.1.0.7', 'up', {22: 'open'}))
+    last_scan = scan_history(('10.1.0.7', 'up', {22: 'open'}), days=7)
+    assert dbsession.query(HostHistory).count() == 2
+    row = find_host_history(dbsession, '10.1.0.7', port='22').one()
+    assert row.first_scan_id == first_scan.id
+    assert row.last_scan_id == last_scan.id
+    assert row.last_seen_at - row.first_seen_at == timedelta(days=7)
+
+
+def test_changed_states_start_history(dbsession, scan_history):
+    scan_history(('10.1.0.7', 'up', {22: 'open'}))
+    scan_history(('10.1.0.7', 'up', {22: 'open'}), days=7)
+    scan_history(('10.1.0.7', 'up', {22: 'filtered'}), days=14)
+    assert history(dbsession, '10.1.0.7', port='22/tcp') == [
+        ('22/tcp', 'filtered', 15, 15, True),
+        ('22/tcp', 'open', 1, 8, False),
+    ]
+
+
+def test_last_seen_with_port_open(dbsession, scan_history):
+    scan_history(('10.1.0.7', 'up', {22: 'open'}))
+    scan_history(('10.1.0.7', 'up', {22: 'closed'}), days=7)
+    row = find_host_history(
+        dbsession, '10.1.0.7', port='22/tcp', state='open').first()
+    assert row.last_seen_at.day == 1
+
+
+def test_late_results_do_not_change_history(dbsession, scan_history):
+    scan_history(('10.1.0.7', 'up', {}), days=7)
+    scan_history(('10.1.0.7', 'down', {}))
+    assert history(dbsession, '10.1.0.7') == [(None, 'up', 8, 8, True)]
+
+
+def test_find_host_history_within_cidr(dbsession, scan_history):
+    scan_history(
+        ('10.1.0.7', 'up', {}), ('10.1.0.200', 'up', {}))
+    addresses = {
+        str(row.ip) for row in find_host_history(dbsession, '10.1.0.0/25')}
+    assert addresses == {'10.1.0.7'}
+
+
+@pytest.mark.parametrize('address, port', [
+    ('10.1.0.300', None), ('10.1.0.7', 'ssh'),
+])
+def test_find_host_history_invalid_criteria_fail(dbsession, address, port):
+    with pytest.raises(ValueError):
+        find_host_history(dbsession, address, port=port)
+
+
+@pytest.fixture
+def history_request(rendering_request, scan_history):
+    scan_history(('10.1.0.7', 'up', {22: 'open', 80: 'open'}))
+    return rendering_request
+
+
+def test_show_host_history_without_address_has_no_history(history_request):
+    assert show_host_history(history_request)['history'] is None
+
+
+def test_show_host_history_renders_table(history_request):
+    history_request.params['address'] = '10.1.0.0/24'
+    html = render(
+        'wanmap:templates/host_history.jinja2',
+        show_host_history(history_request), request=history_request)
+    table = BeautifulSoup(html, 'html.parser').find(id='host-history')
+    assert len(table.tbody.find_all('tr')) == 3
+
+
+def test_show_host_history_pages(monkeypatch, history_request):
+    monkeypatch.setattr('wanmap.history.HOST_HISTORY_PAGE_LENGTH', 2)
+    history_request.params['address'] = '10.1.0.7'
+    response = show_host_history(history_request)
+    assert len(response['history']) == 2
+    assert response['previous_page'] is None
+    assert 'page=2' in response['next_page']
+
+
+def test_show_host_history_invalid_address_fails(history_request):
+    history_request.params['address'] = 'router'
+    with pytest.raises(HTTPBadRequest):
+        show_host_history(history_request)
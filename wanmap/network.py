@@ -8,14 +8,17 @@ import arrow
 import colander
 from deform import Form, ValidationFailure
 from deform.widget import PasswordWidget
-from napalm import get_network_driver
 from pyramid.httpexceptions import HTTPFound
 from pyramid.view import view_config
-from sqlalchemy import Column, DateTime, ForeignKey, String
+from sqlalchemy import (
+    any_, bindparam, Column, DateTime, ForeignKey, func, select, String,
+    tuple_,
+)
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import joinedload, relationship
 import transaction
 
+from .devices import device_sessions
 from .schema import Persistable
 from .util import intersect_network_sets
 
@@ -70,8 +73,7 @@ def post_network_update(request):
     credentials = (appstruct['username'], appstruct['password'])
     with transaction.manager:
         routers = discover_network(seed_router_address, credentials)
-        for router in routers:
-            request.dbsession.merge(router)
+        persist_routers(request.dbsession, routers)
 
     network_redirect = request.route_url('show_network')
     return HTTPFound(location=network_redirect)
@@ -86,22 +88,48 @@ class Router(Persistable):
 
     _interfaces = relationship(
         'RouterInterface', cascade='all, delete-orphan', backref='router')
+    _known_hosts = relationship(
+        'RouterKnownHost', cascade='all, delete-orphan', backref='router')
+    _neighbors = relationship(
+        'RouterNeighbor', cascade='all, delete-orphan', backref='router')
 
     @classmethod
-    def create(cls, hostname, interfaces):
+    def create(cls, hostname, interfaces, known_hosts=(), neighbors=()):
         interfaces = [
             RouterInterface(address=interface) for interface in interfaces
         ]
+        known_hosts = [
+            RouterKnownHost(address=ip_interface(address))
+            for address in known_hosts
+        ]
+        neighbors = [
+            RouterNeighbor(neighbor_hostname=neighbor)
+            for neighbor in neighbors
+        ]
         return cls(
             hostname=hostname,
             last_collected_at=arrow.now().datetime,
             _interfaces=interfaces,
+            _known_hosts=known_hosts,
+            _neighbors=neighbors,
         )
 
     @property
     def interfaces(self):
         return frozenset(interface.address for interface in self._interfaces)
 
+    @property
+    def known_hosts(self):
+        """Live host addresses seen in the ARP and neighbor tables."""
+        return frozenset(
+            ip_interface(host.address).ip for host in self._known_hosts)
+
+    @property
+    def neighbors(self):
+        """Hostnames of LLDP neighbors."""
+        return frozenset(
+            neighbor.neighbor_hostname for neighbor in self._neighbors)
+
     @property
     def connected_subnets(self):
         return frozenset(interface.network for interface in self.interfaces)
@@ -124,6 +152,26 @@ class RouterInterface(Persistable):
     address = Column(postgresql.INET, primary_key=True)
 
 
+class RouterKnownHost(Persistable):
+    """A live host on a connected subnet, learned from ARP or IPv6 ND."""
+
+    __tablename__ = 'router_known_hosts'
+
+    router_hostname = Column(
+        String, ForeignKey('routers.hostname'), primary_key=True)
+    address = Column(postgresql.INET, primary_key=True)
+
+
+class RouterNeighbor(Persistable):
+    """An LLDP adjacency reported by a router."""
+
+    __tablename__ = 'router_neighbors'
+
+    router_hostname = Column(
+        String, ForeignKey('routers.hostname'), primary_key=True)
+    neighbor_hostname = Column(String, primary_key=True)
+
+
 class DiscoveryValidator(colander.Schema):
     seed_router_host = colander.SchemaNode(
         colander.String(), title='Seed Router IP Address')
@@ -139,6 +187,84 @@ class DiscoveryValidator(colander.Schema):
         return Form(schema, formid='discover-network', buttons=('submit',))
 
 
+def persist_routers(dbsession, routers):
+    """
+    Upserts collected routers and replaces their interfaces in bulk.
+
+    Rows are passed as column arrays and expanded server-side with unnest, so
+    each table is written by a single statement regardless of network size.
+    """
+    # Seed routers are collected by address rather than by name.
+    routers = {str(router.hostname): router for router in routers}
+    if not routers:
+        return
+    hostnames = list(routers)
+    collected_at = [router.last_collected_at for router in routers.values()]
+
+    routers_table = Router.__table__
+    collected_routers = select([
+        _unnest('hostnames', hostnames, String),
+        _unnest('collected_at', collected_at, DateTime(timezone=True)),
+    ])
+    upsert_routers = postgresql.insert(routers_table).from_select(
+        ['hostname', 'last_collected_at'], collected_routers)
+    upsert_routers = upsert_routers.on_conflict_do_update(
+        index_elements=[routers_table.c.hostname],
+        set_={'last_collected_at': upsert_routers.excluded.last_collected_at})
+    dbsession.execute(upsert_routers)
+
+    # psycopg2 adapts interfaces, but not bare addresses, to INET.
+    interfaces = {
+        hostname: router.interfaces for hostname, router in routers.items()}
+    known_hosts = {
+        hostname: set(map(ip_interface, router.known_hosts))
+        for hostname, router in routers.items()
+    }
+    neighbors = {
+        hostname: router.neighbors for hostname, router in routers.items()}
+    _replace_router_rows(
+        dbsession, RouterInterface.address, postgresql.INET, interfaces)
+    _replace_router_rows(
+        dbsession, RouterKnownHost.address, postgresql.INET, known_hosts)
+    _replace_router_rows(
+        dbsession, RouterNeighbor.neighbor_hostname, String, neighbors)
+    logger.info(
+        'Persisted %d routers with %d interfaces, %d known hosts and %d '
+        'neighbors', len(hostnames), sum(map(len, interfaces.values())),
+        sum(map(len, known_hosts.values())),
+        sum(map(len, neighbors.values())))
+
+
+def _replace_router_rows(dbsession, column, type_, values_by_router):
+    """Replaces the rows of a per-router table with the collected values."""
+    table = column.table
+    value_column = table.c[column.key]
+    hostnames, values = [], []
+    for hostname, router_values in values_by_router.items():
+        for value in router_values:
+            hostnames.append(hostname)
+            values.append(value)
+    collected = select([
+        _unnest(f'{table.name}_hostnames', hostnames, String),
+        _unnest(f'{table.name}_values', values, type_),
+    ])
+    routers = bindparam(
+        f'{table.name}_routers', list(values_by_router),
+        type_=postgresql.ARRAY(String))
+    stale = table.delete().where(table.c.router_hostname == any_(routers))
+    stale = stale.where(
+        tuple_(table.c.router_hostname, value_column).notin_(collected))
+    dbsession.execute(stale)
+    insert = postgresql.insert(table).from_select(
+        ['router_hostname', value_column.name], collected)
+    dbsession.execute(insert.on_conflict_do_nothing())
+
+
+def _unnest(name, values, type_):
+    array = bindparam(name, values, type_=postgresql.ARRAY(type_))
+    return func.unnest(array).label(name)
+
+
 def discover_network(seed_router_hostname, credentials):
     """Traverses the network using BFS and collects router information."""
 
@@ -160,17 +286,19 @@ def discover_network(seed_router_hostname, credentials):
 def get_router(hostname, credentials):
     """Collects router information and returns its LLDP neighbors."""
 
-    # TODO: Fingerprint router before initializing proper driver
-    driver = get_network_driver('vyos')
-    with driver(hostname, *credentials) as device:
+    with device_sessions.session(hostname, credentials) as device:
         logger.info('Collecting router information for %s', hostname)
+        interfaces = _get_router_interfaces(device)
+        neighbors = _get_neighbors(device)
         router = Router.create(
             hostname=hostname,
-            interfaces=_get_router_interfaces(device))
+            interfaces=interfaces,
+            known_hosts=_get_known_hosts(device, interfaces),
+            neighbors=neighbors)
         logger.info(
-            'Collected router %s with %d interfaces',
-            router.hostname, len(router.interfaces))
-        neighbors = _get_neighbors(device)
+            'Collected router %s with %d interfaces and %d known hosts',
+            router.hostname, len(router.interfaces),
+            len(router.known_hosts))
         return router, neighbors
 
 
@@ -183,6 +311,11 @@ def _get_router_interfaces(device):
                 address = ip_interface(
                     f"{address}/{prefix_len['prefix_length']}")
                 interfaces.append(address)
+    return routable_interfaces(interfaces)
+
+
+def routable_interfaces(interfaces):
+    """Filters out interfaces that cannot reach scannable subnets."""
     return frozenset(
         interface for interface in interfaces
         if not interface.is_link_local if not interface.is_loopback
@@ -190,6 +323,28 @@ def _get_router_interfaces(device):
     )
 
 
+def _get_known_hosts(device, interfaces):
+    """Collects neighbor addresses on the router's connected subnets."""
+    entries = list(device.get_arp_table())
+    try:
+        entries += device.get_ipv6_neighbors_table()
+    except NotImplementedError:
+        logger.debug('%s does not report IPv6 neighbors', device.hostname)
+    subnets = {interface.network for interface in interfaces}
+    own_addresses = {interface.ip for interface in interfaces}
+    known_hosts = set()
+    for entry in entries:
+        try:
+            address = ip_address(entry['ip'])
+        except ValueError:
+            continue
+        if address in own_addresses:
+            continue
+        if any(address in subnet for subnet in subnets):
+            known_hosts.add(address)
+    return frozenset(known_hosts)
+
+
 def _get_neighbors(device):
     lldp_neighbors = device.get_lldp_neighbors()
     neighbors = set()
@@ -1,7 +1,11 @@
+from ipaddress import ip_address, ip_interface
+
 from deform import ValidationFailure
 import pytest
 
-from .network import DiscoveryValidator
+from .network import (
+    _get_known_hosts, DiscoveryValidator, persist_routers, Router,
+)
 
 
 @pytest.fixture
@@ -37,3 +41,77 @@ def test_discovery_form_rejects_blank_password(discovery_form):
     with pytest.raises(ValidationFailure) as exc:
         discovery_form.validate_pstruct(appstruct)
     assert 'Required' in exc.value.render()
+
+
+def _interfaces(*addresses):
+    return tuple(map(ip_interface, addresses))
+
+
+def test_persist_routers_inserts_new_routers(dbsession):
+    routers = (
+        Router.create('r0', _interfaces('10.1.0.1/24', '192.168.0.1/30')),
+        Router.create('r1', _interfaces('10.2.0.1/24', '192.168.0.2/30')),
+    )
+    persist_routers(dbsession, routers)
+    persisted = {
+        router.hostname: router.interfaces
+        for router in dbsession.query(Router)
+    }
+    assert persisted == {
+        'r0': frozenset(_interfaces('10.1.0.1/24', '192.168.0.1/30')),
+        'r1': frozenset(_interfaces('10.2.0.1/24', '192.168.0.2/30')),
+    }
+
+
+def test_persist_routers_replaces_stale_interfaces(dbsession):
+    persist_routers(
+        dbsession,
+        (Router.create('r0', _interfaces('10.1.0.1/24', '10.3.0.1/24')),))
+    rediscovered = Router.create(
+        'r0', _interfaces('10.1.0.1/24', '10.4.0.1/24'))
+    persist_routers(dbsession, (rediscovered,))
+    router = dbsession.query(Router).get('r0')
+    assert router.interfaces == frozenset(
+        _interfaces('10.1.0.1/24', '10.4.0.1/24'))
+    assert router.last_collected_at == rediscovered.last_collected_at
+
+
+def test_persist_routers_leaves_other_routers(dbsession):
+    persist_routers(
+        dbsession, (Router.create('r0', _interfaces('10.1.0.1/24')),))
+    persist_routers(
+        dbsession, (Router.create('r1', _interfaces('10.2.0.1/24')),))
+    router = dbsession.query(Router).get('r0')
+    assert router.interfaces == frozenset(_interfaces('10.1.0.1/24'))
+
+
+def test_persist_routers_replaces_known_hosts(dbsession):
+    interfaces = _interfaces('10.1.0.1/24')
+    persist_routers(
+        dbsession,
+        (Router.create('r0', interfaces, map(ip_address, ('10.1.0.5',))),))
+    persist_routers(
+        dbsession,
+        (Router.create('r0', interfaces, map(ip_address, ('10.1.0.6',))),))
+    router = dbsession.query(Router).get('r0')
+    assert router.known_hosts == {ip_address('10.1.0.6')}
+
+
+class FakeNeighborDevice:
+    hostname = 'r0'
+
+    def get_arp_table(self):
+        return [
+            {'interface': 'eth0', 'ip': '10.1.0.5', 'mac': '', 'age': 1.0},
+            {'interface': 'eth0', 'ip': '10.1.0.1', 'mac': '', 'age': 1.0},
+            {'interface': 'eth1', 'ip': '172.16.0.9', 'mac': '', 'age': 1.0},
+        ]
+
+    def get_ipv6_neighbors_table(self):
+        raise NotImplementedError
+
+
+def test_get_known_hosts_keeps_connected_neighbors():
+    known_hosts = _get_known_hosts(
+        FakeNeighborDevice(), _interfaces('10.1.0.1/24'))
+    assert known_hosts == {ip_address('10.1.0.5')}
@@ -0,0 +1,94 @@
+"""Splitting of nmap port specifications into disjoint shards."""
+
+import re
+
+MAX_PORT = 65535
+# Numeric ports and ranges; protocol prefixes and service names are not
+# split.
+PORT_RANGE_PATTERN = re.compile(r'^(\d*)-(\d*)$|^(\d+)$')
+
+
+def shard_port_options(nmap_options, shard_count):
+    """
+    Splits nmap options with a port specification into options scanning
+    disjoint slices of about as many ports each.
+
+    Options without a numeric ``-p`` specification are not split.
+    """
+    nmap_options = list(nmap_options)
+    found = _find_port_spec(nmap_options)
+    if shard_count <= 1 or not found:
+        return [nmap_options]
+    port_option, spec = found
+    ranges = parse_port_spec(spec)
+    if ranges is None:
+        return [nmap_options]
+    shards = []
+    for shard in split_port_ranges(ranges, shard_count):
+        options = list(nmap_options)
+        options[port_option] = ['-p', format_port_ranges(shard)]
+        shards.append(options)
+    return shards
+
+
+def _find_port_spec(nmap_options):
+    """Returns the slice of the port option and its specification."""
+    for index, option in enumerate(nmap_options):
+        if option == '-p' and index + 1 < len(nmap_options):
+            return slice(index, index + 2), nmap_options[index + 1]
+        if option.startswith('-p') and len(option) > 2:
+            return slice(index, index + 1), option[2:]
+
+
+def parse_port_spec(spec):
+    """
+    Returns the merged (first, last) port ranges of a numeric port
+    specification, or None for other specifications.
+    """
+    ranges = []
+    for item in spec.split(','):
+        match = PORT_RANGE_PATTERN.match(item)
+        if not match:
+            return None
+        first, last, port = match.groups()
+        if port:
+            first = last = port
+        first, last = int(first or 1), int(last or MAX_PORT)
+        if not 0 <= first <= last <= MAX_PORT:
+            return None
+        ranges.append((first, last))
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], last))
+        else:
+            merged.append((first, last))
+    return merged
+
+
+def split_port_ranges(ranges, shard_count):
+    """Divides port ranges into at most as many slices of even size."""
+    port_count = sum(last - first + 1 for first, last in ranges)
+    shard_count = min(shard_count, port_count)
+    shards, shard, shard_size = [], [], 0
+    ranges = list(ranges)
+    while ranges:
+        # The remaining ports are spread over the remaining shards.
+        target_size = -(-port_count // (shard_count - len(shards)))
+        first, last = ranges.pop(0)
+        take = min(last - first + 1, target_size - shard_size)
+        shard.append((first, first + take - 1))
+        shard_size += take
+        if first + take <= last:
+            ranges.insert(0, (first + take, last))
+        if shard_size == target_size:
+            shards.append(shard)
+            port_count -= shard_size
+            shard, shard_size = [], 0
+    return shards
+
+
+def format_port_ranges(ranges):
+    return ','.join(
+        str(first) if first == last else f'{first}-{last}'
+        for first, last in ranges)
@@ -0,0 +1,39 @@
+import pytest
+
+from .ports import parse_port_spec, shard_port_options, split_port_ranges
+
+
+def test_shard_port_options_splits_all_ports():
+    shards = shard_port_options(['-sS', '-p-', '-n'], 4)
+    assert shards == [
+        ['-sS', '-p', '1-16384', '-n'],
+        ['-sS', '-p', '16385-32768', '-n'],
+        ['-sS', '-p', '32769-49152', '-n'],
+        ['-sS', '-p', '49153-65535', '-n'],
+    ]
+
+
+def test_shard_port_options_splits_separate_port_list():
+    shards = shard_port_options(['-sS', '-p', '22,80,443,8000-8010'], 3)
+    assert [options[-1] for options in shards] == [
+        '22,80,443,8000-8001', '8002-8006', '8007-8010']
+
+
+@pytest.mark.parametrize('nmap_options', [
+    ['-sS'], ['-sS', '-pT:22,U:53'], ['-sS', '-phttp'],
+])
+def test_shard_port_options_leaves_other_options(nmap_options):
+    assert shard_port_options(nmap_options, 4) == [nmap_options]
+
+
+def test_shard_port_options_not_more_shards_than_ports():
+    assert len(shard_port_options(['-p', '22,80'], 4)) == 2
+
+
+def test_parse_port_spec_merges_ranges():
+    assert parse_port_spec('80,-22,21-25,81') == [(1, 25), (80, 81)]
+
+
+def test_split_port_ranges_spreads_ports_evenly():
+    shards = split_port_ranges([(1, 10)], 3)
+    assert shards == [[(1, 4)], [(5, 7)], [(8, 10)]]
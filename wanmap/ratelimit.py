@@ -0,0 +1,183 @@
+"""
+Packet rate budgets of WAN links, shared by the scanners scanning across
+them.
+
+Each running nmap process reserves a rate on every link toward its
+targets, and is limited to it by ``--max-rate``. Reservations are kept in
+Redis, so scanners on different hosts divide the same budgets. They are
+renewed while nmap runs, so those of scanners that die soon expire.
+"""
+
+from contextlib import contextmanager
+import threading
+import time
+from uuid import uuid4
+
+import redis
+
+# Packets per second each WAN link can spare for scanning
+LINK_RATE = 1000
+# Reserved by scans that do not set their own --max-rate
+DEFAULT_SCAN_RATE = 250
+# Scans wait rather than run slower than this
+MIN_SCAN_RATE = 25
+# Reservations not renewed for this long are dropped, as their scanner died.
+RESERVATION_SECONDS = 5 * 60
+RESERVATION_RENEW_SECONDS = 60
+RESERVATION_RETRY_SECONDS = 10
+
+
+def link_key(router_hostname):
+    return f'wanmap:links:{router_hostname}:reservations'
+
+
+def requested_rate(nmap_options):
+    """The scan's own --max-rate, or the default share of a link."""
+    nmap_options = list(nmap_options)
+    if '--max-rate' in nmap_options:
+        index = nmap_options.index('--max-rate')
+        try:
+            return min(int(float(nmap_options[index + 1])), LINK_RATE)
+        except (IndexError, ValueError):
+            pass
+    return DEFAULT_SCAN_RATE
+
+
+def cap_min_rate(nmap_options, rate):
+    """
+    Lowers any --min-rate to a granted rate, as nmap refuses a minimum
+    above the maximum.
+    """
+    nmap_options = list(nmap_options)
+    for index, option in enumerate(nmap_options[:-1]):
+        if option != '--min-rate':
+            continue
+        try:
+            min_rate = float(nmap_options[index + 1])
+        except ValueError:
+            continue
+        if min_rate > rate:
+            nmap_options[index + 1] = str(rate)
+    return nmap_options
+
+
+def reserve_link_rate(client, links, rate, now=None):
+    """
+    Atomically reserves up to a packet rate on every link, returning the
+    reservation ID and the rate granted, or None if a link lacks the
+    minimum rate.
+    """
+    now = time.time() if now is None else now
+    keys = sorted(map(link_key, links))
+    reservation_id = uuid4().hex
+
+    def reserve(pipe):
+        available = rate
+        expired = {}
+        for key in keys:
+            reserved = 0
+            expired[key] = []
+            for field, value in pipe.hgetall(key).items():
+                reserved_rate, expires_at = map(float, value.split())
+                if expires_at <= now:
+                    expired[key].append(field)
+                else:
+                    reserved += reserved_rate
+            available = min(available, LINK_RATE - reserved)
+        pipe.multi()
+        for key in keys:
+            if expired[key]:
+                pipe.hdel(key, *expired[key])
+            if available >= MIN_SCAN_RATE:
+                pipe.hset(
+                    key, reservation_id,
+                    f'{int(available)} {now + RESERVATION_SECONDS}')
+                pipe.expire(key, RESERVATION_SECONDS)
+        return int(available)
+
+    granted = client.transaction(reserve, *keys, value_from_callable=True)
+    if granted < MIN_SCAN_RATE:
+        return None
+    return reservation_id, granted
+
+
+def renew_link_rate(client, links, reservation_id, rate, now=None):
+    """Extends a reservation of a scan that is still running."""
+    now = time.time() if now is None else now
+    for key in sorted(map(link_key, links)):
+        client.hset(
+            key, reservation_id, f'{rate} {now + RESERVATION_SECONDS}')
+        client.expire(key, RESERVATION_SECONDS)
+
+
+@contextmanager
+def renewing_link_rate(client, links, reservation_id, rate, logger):
+    """Renews a reservation in the background until the block exits."""
+    stopped = threading.Event()
+
+    def renew():
+        while not stopped.wait(RESERVATION_RENEW_SECONDS):
+            try:
+                renew_link_rate(client, links, reservation_id, rate)
+            except redis.RedisError:
+                logger.warning('Unable to renew link rate', exc_info=True)
+
+    renewer = threading.Thread(target=renew, daemon=True)
+    renewer.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        renewer.join()
+
+
+def release_link_rate(client, links, reservation_id):
+    for link in links:
+        client.hdel(link_key(link), reservation_id)
+
+
+def wait_for_link_rate(client, links, rate, logger):
+    """
+    Reserves a rate on the links, waiting for other scans to release
+    theirs. Scans proceed unlimited if Redis is unavailable.
+    """
+    while True:
+        try:
+            reservation = reserve_link_rate(client, links, rate)
+        except redis.RedisError:
+            logger.warning(
+                'Unable to reserve link rate, scanning unlimited',
+                exc_info=True)
+            return None
+        if reservation:
+            return reservation
+        logger.info(
+            'Waiting for rate on links %s', ', '.join(sorted(links)))
+        time.sleep(RESERVATION_RETRY_SECONDS)
+
+
+@contextmanager
+def limit_link_rate(client, links, nmap_options, logger):
+    """
+    Holds a rate reservation on the links while nmap runs, yielding the
+    options limited to the granted rate.
+    """
+    nmap_options = list(nmap_options)
+    reservation = None
+    if links:
+        reservation = wait_for_link_rate(
+            client, links, requested_rate(nmap_options), logger)
+    if not reservation:
+        yield nmap_options
+        return
+    reservation_id, granted = reservation
+    try:
+        with renewing_link_rate(
+                client, links, reservation_id, granted, logger):
+            yield cap_min_rate(nmap_options, granted) + [
+                '--max-rate', str(granted)]
+    finally:
+        try:
+            release_link_rate(client, links, reservation_id)
+        except redis.RedisError:
+            logger.warning('Unable to release link rate', exc_info=True)
@@ -0,0 +1,150 @@
+import logging
+import time
+
+import pytest
+import redis
+
+from .ratelimit import (
+    cap_min_rate, DEFAULT_SCAN_RATE, limit_link_rate, LINK_RATE, link_key,
+    MIN_SCAN_RATE, release_link_rate, renew_link_rate, requested_rate,
+    reserve_link_rate, RESERVATION_SECONDS,
+)
+from .timing import timing_options
+
+_logger = logging.getLogger(__name__)
+
+
+class FakeRedis:
+    """Hashes, with transactions that apply commands immediately."""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        return func(self)
+
+    def multi(self):
+        pass
+
+    def hgetall(self, key):
+        return {
+            field.encode(): value.encode()
+            for field, value in self.hashes.get(key, {}).items()
+        }
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+
+    def hdel(self, key, *fields):
+        for field in fields:
+            field = field.decode() if isinstance(field, bytes) else field
+            self.hashes.get(key, {}).pop(field, None)
+
+    def expire(self, key, seconds):
+        pass
+
+
+class UnavailableRedis:
+
+    def transaction(self, *args, **kwargs):
+        raise redis.ConnectionError()
+
+
+@pytest.fixture
+def client():
+    return FakeRedis()
+
+
+@pytest.mark.parametrize('nmap_options, rate', [
+    (['-sS'], DEFAULT_SCAN_RATE),
+    (['-sS', '--max-rate', '100'], 100),
+    (['--max-rate', '100000'], LINK_RATE),
+])
+def test_requested_rate(nmap_options, rate):
+    assert requested_rate(nmap_options) == rate
+
+
+def test_reservations_share_link_rate(client):
+    reservations = [
+        reserve_link_rate(client, ['core'], 400, now=0) for _ in range(3)]
+    assert [granted for _, granted in reservations] == [400, 400, 200]
+    assert reserve_link_rate(client, ['core'], 400, now=0) is None
+
+
+def test_reservation_limited_by_busiest_link(client):
+    reserve_link_rate(client, ['branch'], 900, now=0)
+    _, granted = reserve_link_rate(client, ['core', 'branch'], 400, now=0)
+    assert granted == LINK_RATE - 900
+    assert len(client.hashes[link_key('core')]) == 1
+
+
+def test_released_rate_is_available(client):
+    reservation_id, _ = reserve_link_rate(client, ['core'], LINK_RATE, now=0)
+    release_link_rate(client, ['core'], reservation_id)
+    assert reserve_link_rate(client, ['core'], LINK_RATE, now=0)
+
+
+def test_expired_reservations_are_dropped(client):
+    reserve_link_rate(client, ['core'], LINK_RATE, now=0)
+    assert reserve_link_rate(
+        client, ['core'], LINK_RATE, now=RESERVATION_SECONDS)
+
+
+def test_renewed_reservations_are_kept(client):
+    reservation_id, granted = reserve_link_rate(
+        client, ['core'], LINK_RATE, now=0)
+    renew_link_rate(
+        client, ['core'], reservation_id, granted, now=RESERVATION_SECONDS)
+    assert not reserve_link_rate(
+        client, ['core'], LINK_RATE, now=RESERVATION_SECONDS)
+
+
+def test_limit_link_rate_renews_while_scanning(client, monkeypatch):
+    monkeypatch.setattr('wanmap.ratelimit.RESERVATION_RENEW_SECONDS', 0.01)
+    reservations = client.hashes.setdefault(link_key('core'), {})
+    with limit_link_rate(client, ['core'], ['-sS'], _logger):
+        reserved = dict(reservations)
+        deadline = time.time() + 5
+        while reservations == reserved and time.time() < deadline:
+            time.sleep(0.01)
+        renewed = dict(reservations)
+    assert renewed.keys() == reserved.keys()
+    assert renewed != reserved
+    assert not reservations
+
+
+def test_limit_link_rate_limits_nmap_while_scanning(client):
+    with limit_link_rate(client, ['core'], ['-sS'], _logger) as options:
+        assert options == ['-sS', '--max-rate', str(DEFAULT_SCAN_RATE)]
+        assert client.hashes[link_key('core')]
+    assert not client.hashes[link_key('core')]
+
+
+def test_limit_link_rate_caps_auto_timing_min_rate(client):
+    reserve_link_rate(client, ['core'], LINK_RATE - MIN_SCAN_RATE)
+    nmap_options = ['-sS'] + timing_options(srtt=1000, rttvar=200)
+    assert '--min-rate' in nmap_options
+    with limit_link_rate(client, ['core'], nmap_options, _logger) as options:
+        min_rate = options[options.index('--min-rate') + 1]
+        max_rate = options[options.index('--max-rate') + 1]
+    assert int(min_rate) == int(max_rate) == MIN_SCAN_RATE
+
+
+@pytest.mark.parametrize('nmap_options, capped', [
+    (['--min-rate', '1000'], ['--min-rate', '250']),
+    (['--min-rate', '100'], ['--min-rate', '100']),
+    (['-sS', '--min-rate'], ['-sS', '--min-rate']),
+])
+def test_cap_min_rate(nmap_options, capped):
+    assert cap_min_rate(nmap_options, 250) == capped
+
+
+def test_limit_link_rate_without_links_does_not_limit(client):
+    with limit_link_rate(client, [], ['-sS'], _logger) as options:
+        assert options == ['-sS']
+
+
+def test_limit_link_rate_without_redis_does_not_limit():
+    client = UnavailableRedis()
+    with limit_link_rate(client, ['core'], ['-sS'], _logger) as options:
+        assert options == ['-sS']
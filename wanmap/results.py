@@ -0,0 +1,78 @@
+"""Parsing of nmap XML output into host and port records."""
+
+from collections import namedtuple
+import io
+from xml.etree import ElementTree
+
+Host = namedtuple(
+    'Host', 'address status hostname ports times', defaults=(None,))
+Port = namedtuple('Port', 'protocol number state service')
+# Round trip time estimates of a host, in microseconds
+Times = namedtuple('Times', 'srtt rttvar timeout')
+
+
+def parse_hosts(xml_results):
+    """
+    Yields the hosts of an nmap XML report in document order.
+
+    The report is parsed incrementally and each host element is discarded
+    once read, so memory use is bounded by the largest host.
+    """
+    if not xml_results:
+        return
+    yield from parse_host_stream(io.StringIO(xml_results))
+
+
+def parse_host_stream(stream):
+    """
+    Yields the hosts of an nmap XML report as they are read from a file,
+    such as the output of a running nmap process.
+    """
+    events = ElementTree.iterparse(stream, events=('start', 'end'))
+    _, root = next(events)
+    for event, element in events:
+        if event == 'end' and element.tag == 'host':
+            yield _parse_host(element)
+            root.clear()
+
+
+def _parse_host(element):
+    address = _host_address(element)
+    status = element.find('status')
+    hostname = element.find('hostnames/hostname')
+    ports = tuple(
+        _parse_port(port) for port in element.iterfind('ports/port'))
+    return Host(
+        address=address,
+        status=status.get('state') if status is not None else None,
+        hostname=hostname.get('name') if hostname is not None else None,
+        ports=ports,
+        times=_parse_times(element.find('times')),
+    )
+
+
+def _parse_times(element):
+    if element is None:
+        return None
+    try:
+        return Times(*(
+            int(element.get(key)) for key in ('srtt', 'rttvar', 'to')))
+    except (TypeError, ValueError):
+        return None
+
+
+def _host_address(element):
+    for address in element.iterfind('address'):
+        if address.get('addrtype') in ('ipv4', 'ipv6'):
+            return address.get('addr')
+
+
+def _parse_port(element):
+    state = element.find('state')
+    service = element.find('service')
+    return Port(
+        protocol=element.get('protocol'),
+        number=int(element.get('portid')),
+        state=state.get('state') if state is not None else None,
+        service=service.get('name') if service is not None else None,
+    )
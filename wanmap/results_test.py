@@ -0,0 +1,54 @@
+import io
+
+from .results import Host, parse_host_stream, parse_hosts, Port, Times
+
+NMAP_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<!DOCTYPE nmaprun>'
+    '<?xml-stylesheet href="file:///usr/bin/../share/nmap/nmap.xsl" type="text/xsl"?>'   # noqa
+    '<nmaprun scanner="nmap" args="nmap -oX - -sS 10.1.0.0/30">'
+    '<host><status state="up" reason="echo-reply"/>'
+    '<address addr="10.1.0.1" addrtype="ipv4"/>'
+    '<address addr="52:54:00:12:34:56" addrtype="mac"/>'
+    '<hostnames><hostname name="r0.wanmap.local" type="PTR"/></hostnames>'
+    '<ports>'
+    '<extraports state="closed" count="998"/>'
+    '<port protocol="tcp" portid="22"><state state="open" reason="syn-ack"/>'
+    '<service name="ssh" method="table" conf="3"/></port>'
+    '<port protocol="tcp" portid="179">'
+    '<state state="filtered" reason="no-response"/></port>'
+    '</ports>'
+    '<times srtt="1523" rttvar="312" to="100000"/>'
+    '</host>'
+    '<host><status state="down" reason="no-response"/>'
+    '<address addr="10.1.0.2" addrtype="ipv4"/>'
+    '</host>'
+    '<runstats><finished time="1"/><hosts up="1" down="1" total="2"/>'
+    '</runstats>'
+    '</nmaprun>'
+)
+
+
+def test_parse_hosts_reads_hosts_and_ports():
+    hosts = list(parse_hosts(NMAP_XML))
+    assert hosts == [
+        Host(
+            address='10.1.0.1', status='up', hostname='r0.wanmap.local',
+            ports=(
+                Port(protocol='tcp', number=22, state='open', service='ssh'),
+                Port(
+                    protocol='tcp', number=179, state='filtered',
+                    service=None),
+            ),
+            times=Times(srtt=1523, rttvar=312, timeout=100000)),
+        Host(address='10.1.0.2', status='down', hostname=None, ports=()),
+    ]
+
+
+def test_parse_hosts_without_results():
+    assert list(parse_hosts(None)) == []
+
+
+def test_parse_host_stream_reads_hosts_from_file():
+    hosts = parse_host_stream(io.StringIO(NMAP_XML))
+    assert [host.address for host in hosts] == ['10.1.0.1', '10.1.0.2']
@@ -2,7 +2,7 @@ from ipaddress import ip_interface
 import logging
 
 from pyramid.view import view_config
-from sqlalchemy import Column, String
+from sqlalchemy import Column, Integer, String
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import relationship
 
@@ -21,13 +21,15 @@ class Scanner(Persistable):
     __tablename__ = 'scanners'
     name = Column(String(64), primary_key=True)
     interface = Column(postgresql.INET, nullable=False)
+    # How many nmap processes the scanner runs at once
+    slots = Column(Integer, nullable=False, default=1)
 
     subscans = relationship('Subscan', backref='scanner')
 
     @classmethod
-    def create(cls, name, interface_address):
+    def create(cls, name, interface_address, slots=1):
         interface = ip_interface(interface_address)
-        scanner = cls(name=name, interface=interface)
+        scanner = cls(name=name, interface=interface, slots=slots)
         return scanner
 
 
@@ -1,31 +1,66 @@
+from datetime import timedelta
 import enum
-from ipaddress import ip_network
-from itertools import combinations, product
+import hashlib
+from ipaddress import ip_address, ip_interface, ip_network
+from itertools import combinations
 import logging
+import os.path
 from uuid import uuid4, UUID
 
 import arrow
 import colander
 from deform import Form, widget, ValidationFailure
-from pyramid.httpexceptions import HTTPFound, HTTPNotFound
+from pyramid.decorator import reify
+from pyramid.httpexceptions import (
+    HTTPBadRequest, HTTPFound, HTTPNotFound, HTTPNotModified
+)
+from pyramid.renderers import render
+from pyramid.response import Response
 from pyramid.view import view_config
+from repoze.lru import LRUCache
 
 from sqlalchemy import (
-    Column, DateTime, ForeignKey, ForeignKeyConstraint, String
+    Boolean, case, cast, Column, DateTime, Enum, ForeignKey,
+    ForeignKeyConstraint, func, Index, inspect, Integer, or_, String, tuple_
 )
 from sqlalchemy.dialects import postgresql
-from sqlalchemy.orm import joinedload, relationship
+from sqlalchemy.orm import (
+    deferred, object_session, query_expression, relationship, selectinload
+)
+from sqlalchemy.sql import ClauseElement
 import transaction
 
-from .network import Router, RouterInterface
+from .events import (
+    DEFAULT_REDIS_URL, get_redis, scan_channel, stream_scan_events,
+)
+from .network import RouterInterface, RouterKnownHost
+from .results import parse_hosts
 from .scanners import Scanner
 from .schema import Persistable
+from .topology import get_topology
 from .util import intersect_network_sets, to_ip_network
 
 
 PING_SWEEP = '-sn -PE -n'
 SCAN_FORM_TITLE = 'Scan Network'
+BULK_SCAN_LIMIT = 10000
 SCAN_LISTING_PAGE_LENGTH = 20
+SCAN_LISTING_FILTERS = ('type', 'status', 'scanner', 'target')
+SUBSCAN_HOSTS_PAGE_LENGTH = 50
+SUBSCAN_HOSTS_FILTERS = ('address', 'port', 'status')
+# Rendered pages of completed subscans, which never change.
+SUBSCAN_HOSTS_CACHE_SIZE = 1024
+# Bound scan schemas and blank forms, per set of scanners and subnets.
+SCAN_FORM_CACHE_SIZE = 16
+MAX_PORT_SHARDS = 16
+# Raw results of completed subscans never change, so caches keep them.
+RESULTS_MAX_AGE = 365 * 24 * 60 * 60
+# Rendered pages of completed scans change only with a deploy, so caches
+# revalidate them soon after.
+PAGE_MAX_AGE = 5 * 60
+NO_KNOWN_HOSTS_MESSAGE = (
+    'No hosts within the scan targets are known from router ARP or '
+    'neighbor tables. Rediscover the network or scan the full targets.')
 NO_KNOWN_SUBNETS_ALERT_MESSAGE = (
     'WANmap does not know any scannable networks. Scan targets are '
     'constrained to known routeable subnets to optimize scanning. Discover '
@@ -39,11 +74,38 @@ ONLY_ONE_SCANNER_ALERT_MESSAGE = (
 
 logger = logging.getLogger(__name__)
 
+_subscan_hosts_cache = LRUCache(SUBSCAN_HOSTS_CACHE_SIZE)
+_scan_form_cache = LRUCache(SCAN_FORM_CACHE_SIZE)
+
+
+def _render_version():
+    """Digests the views and templates that render scan pages."""
+    package_dir = os.path.dirname(__file__)
+    templates_dir = os.path.join(package_dir, 'templates')
+    paths = [__file__] + sorted(
+        os.path.join(templates_dir, name)
+        for name in os.listdir(templates_dir) if name.endswith('.jinja2'))
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as source:
+            digest.update(source.read())
+    return digest.hexdigest()[:12]
+
+
+# Part of the ETags of rendered pages, so a deploy that changes them
+# invalidates cached copies.
+RENDER_VERSION = _render_version()
+
 
 def includeme(config):
     config.add_route('new_scan', '/scans/new')
     config.add_route('show_scans', '/scans/')
     config.add_route('show_scan', '/scans/{id}/')
+    config.add_route('show_scan_events', '/scans/{id}/events')
+    config.add_route(
+        'show_subscan_hosts', '/scans/{id}/{scanner_name}/hosts')
+    config.add_route(
+        'show_subscan_results', '/scans/{id}/{scanner_name}/results.xml')
 
 
 @view_config(
@@ -56,8 +118,7 @@ def get_new_scan(request):
     scanner_names = get_scanner_names(request.dbsession)
     if not scanner_names:
         return {'error_message': NO_SCANNERS_ALERT_MESSAGE}
-    scan_form = ScanSchema.form(scanner_names, subnets)
-    scan_form = scan_form.render({'scan_targets': ('',)})
+    _, scan_form = get_scan_form(scanner_names, subnets)
     return {'form_title': SCAN_FORM_TITLE, 'scan_form': scan_form}
 
 
@@ -71,7 +132,9 @@ def post_new_scan(request):
     scanner_names = get_scanner_names(request.dbsession)
     if not scanner_names:
         return {'error_message': NO_SCANNERS_ALERT_MESSAGE}
-    scan_form = ScanSchema.form(scanner_names, subnets)
+    schema, _ = get_scan_form(scanner_names, subnets)
+    # Forms keep the submitted values and errors, so are not shared.
+    scan_form = make_scan_form(schema)
     controls = request.POST.items()
     try:
         appstruct = scan_form.validate(controls)
@@ -81,8 +144,15 @@ def post_new_scan(request):
             'scan_form': e.render()
         }
     scan_class = SplittingScan if not appstruct['scanners'] else DeltaScan
-    with transaction.manager:
-        scan_id = schedule_scan(request.dbsession, scan_class, appstruct)
+    try:
+        with transaction.manager:
+            scan_id = schedule_scan(request.dbsession, scan_class, appstruct)
+    except ValueError as e:
+        return {
+            'form_title': SCAN_FORM_TITLE,
+            'scan_form': scan_form.render(appstruct),
+            'error_message': str(e),
+        }
     scan_redirect = request.route_url('show_scan', id=scan_id)
     return HTTPFound(location=scan_redirect)
 
@@ -103,27 +173,94 @@ class Scan(Persistable):
     id = Column(postgresql.UUID(as_uuid=True), primary_key=True)
     created_at = Column(DateTime(timezone=True), nullable=False)
     parameters = Column(String, nullable=False)
+    # Limits subscan targets to live hosts learned during discovery.
+    known_hosts_only = Column(Boolean, nullable=False, default=False)
+    # Runs the parameters only against live hosts found by a ping sweep.
+    discover_first = Column(Boolean, nullable=False, default=False)
+    # Splits an explicit port range into disjoint slices scanned in parallel.
+    port_shards = Column(Integer, nullable=False, default=1)
+    # Adds nmap timing options chosen from the round trip times of the
+    # scanned subnets.
+    auto_timing = Column(Boolean, nullable=False, default=False)
     _type = Column('type', String, nullable=False)
+    # Denormalized from subscans, and updated atomically as they progress,
+    # so listing scans by status never loads subscans.
+    status = Column(
+        'state', Enum(States, name='scan_state'), nullable=False,
+        default=States.SCHEDULED)
+    subscan_count = Column(Integer, nullable=False, default=0)
+    completed_subscan_count = Column(Integer, nullable=False, default=0)
+    # The latest subscan finish time, which is the completion time of a
+    # completed scan.
+    completed_at = Column(DateTime(timezone=True), index=True)
 
     targets = relationship('ScanTarget', backref='scan')
     subscans = relationship('Subscan', backref='scan')
 
+    # Each listing filter has an index in the listing's (created_at, id)
+    # seek order.
+    __table_args__ = (
+        Index('ix_scans_created_at_id', 'created_at', 'id'),
+        Index('ix_scans_state_created_at_id', 'state', 'created_at', 'id'),
+        Index('ix_scans_type_created_at_id', 'type', 'created_at', 'id'),
+    )
+
     __mapper_args__ = {
         'polymorphic_identity': 'scan',
         'polymorphic_on': '_type'
     }
 
-    # TODO: Encapsulate Subscan status in Subscan class while implementing
-    # Scan cancellation.
-    @property
-    def status(self):
-        """The aggregate status of the Scan's subscans."""
-        if all(subscan.finished_at for subscan in self.subscans):
-            return Scan.States.COMPLETED
-        elif any(subscan.started_at for subscan in self.subscans):
-            return Scan.States.PROGRESSING
-        else:
-            return Scan.States.SCHEDULED
+    def _count_subscans(self):
+        self.subscan_count = len(self.subscans)
+
+    def _start_subscan(self):
+        if not self._is_persisted():
+            if self.status == Scan.States.SCHEDULED:
+                self.status = Scan.States.PROGRESSING
+            return
+        if self._pending_update('status', None) is not None:
+            # A subscan completed in this flush already advanced the status.
+            return
+        self.status = case(
+            [(Scan.status == Scan.States.SCHEDULED,
+              _state_literal(Scan.States.PROGRESSING))],
+            else_=Scan.status)
+
+    def _complete_subscan(self, finished_at):
+        if not self._is_persisted():
+            self.completed_subscan_count = (
+                self.completed_subscan_count or 0) + 1
+            self.status = (
+                Scan.States.COMPLETED
+                if self.completed_subscan_count >= self.subscan_count
+                else Scan.States.PROGRESSING)
+            self.completed_at = max(
+                filter(None, (self.completed_at, finished_at)))
+            return
+        # Evaluated by the database against the locked row, so concurrent
+        # subscan completions cannot lose an update. Completions within one
+        # flush build upon the pending expressions.
+        completed_subscan_count = self._pending_update(
+            'completed_subscan_count', Scan.completed_subscan_count) + 1
+        completed_at = self._pending_update('completed_at', Scan.completed_at)
+        self.status = case(
+            [(completed_subscan_count >= Scan.subscan_count,
+              _state_literal(Scan.States.COMPLETED))],
+            else_=_state_literal(Scan.States.PROGRESSING))
+        self.completed_subscan_count = completed_subscan_count
+        self.completed_at = func.greatest(completed_at, finished_at)
+
+    def _is_persisted(self):
+        # A scan yet to be inserted has no row to update.
+        return inspect(self).has_identity
+
+    def _pending_update(self, key, default):
+        value = self.__dict__.get(key)
+        return value if isinstance(value, ClauseElement) else default
+
+
+def _state_literal(state):
+    return cast(state, Scan.__table__.c.state.type)
 
 
 class DeltaScan(Scan):
@@ -132,10 +269,14 @@ class DeltaScan(Scan):
         postgresql.UUID(as_uuid=True), ForeignKey('scans.id'),
         primary_key=True)
 
-    __mapper_args__ = {'polymorphic_identity': 'delta'}
+    __mapper_args__ = {
+        'polymorphic_identity': 'delta',
+        # Joined into base scan queries rather than loaded per row.
+        'polymorphic_load': 'inline',
+    }
 
     @classmethod
-    def from_appstruct(cls, dbsession, appstruct):
+    def from_appstruct(cls, dbsession, appstruct, planner=None):
         nmap_options = appstruct['nmap_options'],
         scanner_names = (
             appstruct['scanners']['scanner_a'],
@@ -144,27 +285,52 @@ class DeltaScan(Scan):
         targets = appstruct['scan_targets']
         return cls.create(
             dbsession, parameters=nmap_options,
-            scanner_names=scanner_names, targets=targets)
+            scanner_names=scanner_names, targets=targets,
+            known_hosts_only=appstruct.get('known_hosts_only', False),
+            discover_first=appstruct.get('discover_first', False),
+            port_shards=appstruct.get('port_shards', 1),
+            auto_timing=appstruct.get('auto_timing', False),
+            freshness_minutes=appstruct.get('freshness_minutes', 0),
+            planner=planner)
 
     @classmethod
-    def create(cls, session, parameters, scanner_names, targets):
+    def create(
+            cls, session, parameters, scanner_names, targets,
+            known_hosts_only=False, discover_first=False, port_shards=1,
+            auto_timing=False, freshness_minutes=0, planner=None):
         if not targets:
             raise ValueError('Must specify at least one scanning target.')
+        planner = planner or ScanPlanner(session)
         created_at = arrow.now().datetime
-        scan = cls(id=uuid4(), created_at=created_at, parameters=parameters)
+        scan = cls(
+            id=uuid4(), created_at=created_at, parameters=parameters,
+            known_hosts_only=known_hosts_only, discover_first=discover_first,
+            port_shards=port_shards, auto_timing=auto_timing,
+            status=Scan.States.SCHEDULED)
         scan.targets.extend(ScanTarget.from_fields(targets))
-        scannable_subnets = get_scannable_subnets(session)
         scan_targets = {target.net_block for target in scan.targets}
         subscan_targets = intersect_network_sets(
-            scan_targets, scannable_subnets)
-
-        scanner_a = session.query(Scanner).get(scanner_names[0])
-        scanner_b = session.query(Scanner).get(scanner_names[1])
+            scan_targets, planner.scannable_subnets)
+        if known_hosts_only:
+            subscan_targets = narrow_to_known_hosts(
+                subscan_targets, get_known_hosts(session, subscan_targets))
+            if not subscan_targets:
+                raise ValueError(NO_KNOWN_HOSTS_MESSAGE)
+
+        unknown_scanners = set(scanner_names) - set(planner.scanners)
+        if unknown_scanners:
+            raise ValueError(
+                f'Unknown scanners {", ".join(sorted(unknown_scanners))}.')
+        scanner_a = planner.scanners[scanner_names[0]]
+        scanner_b = planner.scanners[scanner_names[1]]
 
         scan.subscans += [
             Subscan.create(scanner_a, subscan_targets),
             Subscan.create(scanner_b, subscan_targets),
         ]
+        scan._count_subscans()
+        if freshness_minutes:
+            reuse_recent_results(session, scan, freshness_minutes)
         return scan
 
 
@@ -174,48 +340,154 @@ class SplittingScan(Scan):
         postgresql.UUID(as_uuid=True), ForeignKey('scans.id'),
         primary_key=True)
 
-    __mapper_args__ = {'polymorphic_identity': 'splitting'}
+    __mapper_args__ = {
+        'polymorphic_identity': 'splitting',
+        'polymorphic_load': 'inline',
+    }
 
     @classmethod
-    def from_appstruct(cls, dbsession, appstruct):
+    def from_appstruct(cls, dbsession, appstruct, planner=None):
         nmap_options = appstruct['nmap_options'],
         targets = appstruct['scan_targets']
-        return cls.create(dbsession, parameters=nmap_options, targets=targets)
+        return cls.create(
+            dbsession, parameters=nmap_options, targets=targets,
+            known_hosts_only=appstruct.get('known_hosts_only', False),
+            discover_first=appstruct.get('discover_first', False),
+            port_shards=appstruct.get('port_shards', 1),
+            auto_timing=appstruct.get('auto_timing', False),
+            freshness_minutes=appstruct.get('freshness_minutes', 0),
+            planner=planner)
 
     @classmethod
-    def create(cls, session, parameters, targets):
+    def create(
+            cls, session, parameters, targets, known_hosts_only=False,
+            discover_first=False, port_shards=1, auto_timing=False,
+            freshness_minutes=0, planner=None):
         if not targets:
             raise ValueError('Must specify at least one scanning target.')
+        planner = planner or ScanPlanner(session)
         created_at = arrow.now().datetime
-        scan = cls(id=uuid4(), created_at=created_at, parameters=parameters)
+        scan = cls(
+            id=uuid4(), created_at=created_at, parameters=parameters,
+            known_hosts_only=known_hosts_only, discover_first=discover_first,
+            port_shards=port_shards, auto_timing=auto_timing,
+            status=Scan.States.SCHEDULED)
         scan.targets.extend(ScanTarget.from_fields(targets))
         scan_targets = {target.net_block for target in scan.targets}
-        scanners = session.query(Scanner).all()
-        routers = (
-            session.query(Router).
-            options(joinedload('_interfaces')).all())
-        router_scanner_map = {
-            router: scanner for router, scanner in product(routers, scanners)
-            if router.is_scanner_link_local(scanner)
-        }
-
-        routers_and_matching_targets = {
-            router: router.intersect_scan_targets(scan_targets)
-            for router in routers
-        }
-        # intersect_network_sets(scan_targets, self.subnet_blocks)
-        if not any(routers_and_matching_targets.values()):
-            raise Exception('No routers have scan targets directly attached.')
+        scanner_targets = planner.topology.assign_targets(scan_targets)
+        if not scanner_targets:
+            raise ValueError('No scanners can reach the scan targets.')
+        if known_hosts_only:
+            known_hosts = get_known_hosts(session, scan_targets)
+            scanner_targets = {
+                scanner_name: narrow_to_known_hosts(targets, known_hosts)
+                for scanner_name, targets in scanner_targets.items()
+            }
+            if not any(scanner_targets.values()):
+                raise ValueError(NO_KNOWN_HOSTS_MESSAGE)
 
         scan.subscans += [
-            Subscan.create(router_scanner_map[router], matched_targets)
-            for router, matched_targets
-            in routers_and_matching_targets.items()
-            if matched_targets
+            Subscan.create(planner.scanners[name], scanner_targets[name])
+            for name in sorted(scanner_targets)
+            if name in planner.scanners and scanner_targets[name]
         ]
+        scan._count_subscans()
+        if freshness_minutes:
+            reuse_recent_results(session, scan, freshness_minutes)
         return scan
 
 
+class ScanPlanner:
+    """
+    The network state consulted while planning scans.
+
+    Each is loaded once on first use, so planning many scans together does
+    not repeat the queries.
+    """
+
+    def __init__(self, dbsession):
+        self.dbsession = dbsession
+
+    @reify
+    def scanners(self):
+        return {
+            scanner.name: scanner
+            for scanner in self.dbsession.query(Scanner)
+        }
+
+    @reify
+    def scannable_subnets(self):
+        return get_scannable_subnets(self.dbsession)
+
+    @reify
+    def topology(self):
+        return get_topology(self.dbsession)
+
+
+def reuse_recent_results(dbsession, scan, freshness_minutes):
+    """
+    Serves subscan targets from the results of recent scans instead of
+    scanning them again.
+
+    A target is served by the latest completed subscan of the same scanner
+    with the same parameters, finished within the freshness window, that
+    scanned a target containing it. Subscans with every target served are
+    completed as planned.
+    """
+    cutoff = scan.created_at - timedelta(minutes=freshness_minutes)
+    scanner_names = [subscan.scanner.name for subscan in scan.subscans]
+    # The scan may already be in the session through its scanners.
+    with dbsession.no_autoflush:
+        recent_targets = (
+            dbsession.query(
+                SubscanTarget.scanner_name, SubscanTarget.target,
+                SubscanTarget.scan_id).
+            join(Subscan).
+            join(Scan, Scan.id == Subscan.scan_id).
+            filter(
+                Scan.parameters == scan.parameters,
+                Subscan.finished_at >= cutoff,
+                SubscanTarget.scanner_name.in_(scanner_names),
+                SubscanTarget.cached_scan_id.is_(None)).
+            order_by(Subscan.finished_at.desc()).
+            all())
+        for subscan in scan.subscans:
+            for target in subscan.targets:
+                target.cached_scan_id = _find_recent_scan(
+                    subscan.scanner.name, ip_network(target.target),
+                    recent_targets)
+                if target.cached_scan_id:
+                    subscan.hosts += [
+                        host.cached_copy() for host in
+                        _get_scanned_hosts(
+                            dbsession, target.cached_scan_id,
+                            subscan.scanner.name, target.target)
+                    ]
+            if subscan.is_cached:
+                subscan.started_at = subscan.finished_at = scan.created_at
+                scan._complete_subscan(scan.created_at)
+
+
+def _find_recent_scan(scanner_name, target, recent_targets):
+    for recent_scanner_name, recent_target, scan_id in recent_targets:
+        recent_target = ip_network(recent_target)
+        if (recent_scanner_name == scanner_name and
+                recent_target.version == target.version and
+                target.subnet_of(recent_target)):
+            return scan_id
+
+
+def _get_scanned_hosts(dbsession, scan_id, scanner_name, target):
+    return (
+        dbsession.query(SubscanHost).
+        options(selectinload(SubscanHost.ports)).
+        filter(
+            SubscanHost.scan_id == scan_id,
+            SubscanHost.scanner_name == scanner_name,
+            SubscanHost.address.op('<<=')(ip_network(target)),
+            SubscanHost.cached_scan_id.is_(None)))
+
+
 class ScanTarget(Persistable):
     """Scan task targets as initially specified."""
 
@@ -227,6 +499,12 @@ class ScanTarget(Persistable):
     hostname = Column(String(255))
     # Maps to multiple targets of one nmap instance
 
+    __table_args__ = (
+        Index(
+            'ix_scan_targets_net_block', 'net_block',
+            postgresql_using='gist', postgresql_ops={'net_block': 'inet_ops'}),
+    )
+
     @classmethod
     def from_fields(cls, targets):
         return map(cls.from_field, targets)
@@ -253,12 +531,24 @@ class Subscan(Persistable):
         postgresql.UUID(as_uuid=True), ForeignKey('scans.id'),
         primary_key=True)
     scanner_name = Column(
-        String(64), ForeignKey('scanners.name'), primary_key=True)
+        String(64), ForeignKey('scanners.name'), primary_key=True,
+        index=True)
     started_at = Column(DateTime(timezone=True))
     finished_at = Column(DateTime(timezone=True))
-    xml_results = Column(String)
+    # Loaded on access; views page through the parsed hosts instead.
+    xml_results = deferred(Column(String))
+    results_length = query_expression()
+    # The batches of a scan that discovers hosts first or shards ports,
+    # counted once all are sent. Their parsed hosts are kept, not their XML.
+    batch_count = Column(Integer)
+    completed_batch_count = Column(Integer, nullable=False, default=0)
+    # The nmap options chosen by auto timing when dispatched
+    timing_options = Column(String)
 
     targets = relationship('SubscanTarget', backref='subscan')
+    # Parsed from the results, for paging, sorting and filtering by host.
+    hosts = relationship(
+        'SubscanHost', backref='subscan', cascade='all, delete-orphan')
 
     @classmethod
     def create(cls, scanner, targets):
@@ -269,10 +559,76 @@ class Subscan(Persistable):
         ]
         return subscan
 
-    # TODO: Make symmetric start method?
+    def start(self, started_at):
+        self.started_at = started_at
+        self.scan._start_subscan()
+
+    @property
+    def is_cached(self):
+        """Whether every target was served from recent results."""
+        return all(target.cached_scan_id for target in self.targets)
+
+    @property
+    def scanned_targets(self):
+        return [
+            target.target for target in self.targets
+            if not target.cached_scan_id
+        ]
+
     def complete(self, xml_results, duration):
+        already_completed = self.finished_at is not None
         self.xml_results = xml_results
+        self.hosts = [
+            host for host in self.hosts if host.cached_scan_id
+        ] + [
+            SubscanHost.from_result(host) for host in parse_hosts(xml_results)
+            if host.address
+        ]
         self.started_at, self.finished_at = duration
+        if not already_completed:
+            self.scan._complete_subscan(self.finished_at)
+
+    def add_batch(self, xml_results, duration):
+        """
+        Adds the hosts of a batch, returning them. Hosts already found by
+        other port shards gain the batch's ports.
+
+        The subscan completes with the last batch once all are sent.
+        """
+        results = [
+            host for host in parse_hosts(xml_results) if host.address]
+        found = {}
+        session = object_session(self)
+        if results and session:
+            found = {
+                host.ip: host
+                for host in session.query(SubscanHost).with_parent(self).
+                filter(SubscanHost.address.in_(
+                    [host.address for host in results]))
+            }
+        hosts = []
+        for result in results:
+            host = found.get(ip_address(result.address))
+            if host:
+                host.add_result(result)
+            else:
+                host = SubscanHost.from_result(result)
+                # Appended without loading the hosts of earlier batches.
+                host.subscan = self
+            hosts.append(host)
+        self.completed_batch_count = (self.completed_batch_count or 0) + 1
+        self._finish_batches(duration[1])
+        return hosts
+
+    def finish_discovery(self, batch_count, finished_at):
+        self.batch_count = batch_count
+        self._finish_batches(finished_at)
+
+    def _finish_batches(self, finished_at):
+        if (self.finished_at is None and self.batch_count is not None and
+                (self.completed_batch_count or 0) >= self.batch_count):
+            self.finished_at = finished_at
+            self.scan._complete_subscan(finished_at)
 
 
 class SubscanTarget(Persistable):
@@ -282,6 +638,42 @@ class SubscanTarget(Persistable):
     scan_id = Column(postgresql.UUID(as_uuid=True), primary_key=True)
     scanner_name = Column(String(64), primary_key=True)
     target = Column(postgresql.CIDR, primary_key=True)
+    # The scan whose recent results served this target instead of a scan.
+    cached_scan_id = Column(
+        postgresql.UUID(as_uuid=True), ForeignKey('scans.id'))
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ('scan_id', 'scanner_name'),
+            ('subscans.scan_id', 'subscans.scanner_name'),
+        ),
+    )
+
+
+class SubscanHost(Persistable):
+    """A host reported in a subscan's results."""
+
+    __tablename__ = 'subscan_hosts'
+    scan_id = Column(postgresql.UUID(as_uuid=True), primary_key=True)
+    scanner_name = Column(String(64), primary_key=True)
+    address = Column(postgresql.INET, primary_key=True)
+    status = Column(String(16))
+    hostname = Column(String(255))
+    # Denormalized from ports for sorting.
+    open_port_count = Column(Integer, nullable=False, default=0)
+    # Digest of the status and port states, for comparing hosts across
+    # subscans without comparing their ports.
+    fingerprint = Column(String(32))
+    # Smoothed round trip time and its variance in microseconds
+    srtt = Column(Integer)
+    rttvar = Column(Integer)
+    # The scan this host was copied from when served from recent results.
+    cached_scan_id = Column(
+        postgresql.UUID(as_uuid=True), ForeignKey('scans.id'))
+
+    ports = relationship(
+        'SubscanPort', backref='host', cascade='all, delete-orphan',
+        order_by='(SubscanPort.protocol, SubscanPort.number)')
 
     __table_args__ = (
         ForeignKeyConstraint(
@@ -290,6 +682,97 @@ class SubscanTarget(Persistable):
         ),
     )
 
+    @classmethod
+    def from_result(cls, host):
+        ports = list(map(SubscanPort.from_result, host.ports))
+        return cls(
+            address=host.address, status=host.status, hostname=host.hostname,
+            ports=ports,
+            open_port_count=sum(port.state == 'open' for port in ports),
+            fingerprint=host_fingerprint(host),
+            srtt=host.times.srtt if host.times else None,
+            rttvar=host.times.rttvar if host.times else None)
+
+    def add_result(self, host):
+        """Merges in the other ports of a host scanned in another shard."""
+        self.ports += map(SubscanPort.from_result, host.ports)
+        if host.status == 'up':
+            self.status = host.status
+        self.hostname = self.hostname or host.hostname
+        self.open_port_count = sum(port.state == 'open' for port in self.ports)
+        self.fingerprint = host_fingerprint(self)
+
+    def cached_copy(self):
+        """Copies the host, and its ports, as served from this scan."""
+        ports = list(map(SubscanPort.from_result, self.ports))
+        return SubscanHost(
+            address=self.address, status=self.status, hostname=self.hostname,
+            ports=ports, open_port_count=self.open_port_count,
+            fingerprint=self.fingerprint, srtt=self.srtt, rttvar=self.rttvar,
+            cached_scan_id=self.scan_id)
+
+    @property
+    def ip(self):
+        return ip_interface(self.address).ip
+
+    @property
+    def open_ports(self):
+        return [
+            f'{port.number}/{port.protocol}'
+            for port in self.ports if port.state == 'open'
+        ]
+
+
+def host_fingerprint(host):
+    port_states = sorted(
+        (port.protocol, port.number, port.state or '') for port in host.ports)
+    digest = hashlib.md5(repr((host.status, port_states)).encode())
+    return digest.hexdigest()
+
+
+class SubscanPort(Persistable):
+    """A scanned port of a host in a subscan's results."""
+
+    __tablename__ = 'subscan_ports'
+    scan_id = Column(postgresql.UUID(as_uuid=True), primary_key=True)
+    scanner_name = Column(String(64), primary_key=True)
+    address = Column(postgresql.INET, primary_key=True)
+    protocol = Column(String(8), primary_key=True)
+    number = Column(Integer, primary_key=True)
+    state = Column(String(16))
+    service = Column(String(64))
+
+    __table_args__ = (
+        ForeignKeyConstraint(
+            ('scan_id', 'scanner_name', 'address'),
+            ('subscan_hosts.scan_id', 'subscan_hosts.scanner_name',
+             'subscan_hosts.address'),
+        ),
+    )
+
+    @classmethod
+    def from_result(cls, port):
+        return cls(
+            protocol=port.protocol, number=port.number, state=port.state,
+            service=port.service)
+
+
+# Loads a scan and its subscans in a fixed number of queries, leaving
+# results in the database.
+SCAN_DETAIL_LOADER_OPTIONS = (
+    selectinload(Scan.subscans).
+    with_expression(
+        Subscan.results_length, func.length(Subscan.xml_results)),
+    selectinload(Scan.subscans).selectinload(Subscan.targets),
+)
+
+
+SUBSCAN_HOSTS_ORDERINGS = {
+    'address': (SubscanHost.address,),
+    'hostname': (SubscanHost.hostname.nullslast(), SubscanHost.address),
+    'ports': (SubscanHost.open_port_count.desc(), SubscanHost.address),
+}
+
 
 class ScanTargetNode(colander.SchemaNode):
     schema_type = colander.String
@@ -340,6 +823,25 @@ class ScanTargets(colander.SequenceSchema):
         raise exc
 
 
+def get_scan_form(scanner_names, subnets):
+    """
+    Returns the bound scan schema and the blank form rendered from it.
+
+    Both are built once per set of scanners and subnets.
+    """
+    key = frozenset(scanner_names), frozenset(subnets)
+    cached = _scan_form_cache.get(key)
+    if cached is None:
+        scan_form = ScanSchema.form(scanner_names, subnets)
+        cached = scan_form.schema, scan_form.render({'scan_targets': ('',)})
+        _scan_form_cache.put(key, cached)
+    return cached
+
+
+def make_scan_form(schema):
+    return Form(schema, formid='scan', buttons=('submit',))
+
+
 def get_scanner_names(dbsession):
     return {name for name, in dbsession.query(Scanner.name)}
 
@@ -351,6 +853,27 @@ def get_scannable_subnets(dbsession):
     }
 
 
+def get_known_hosts(dbsession, targets):
+    """Finds the known live hosts within any of the targets."""
+    if not targets:
+        return set()
+    within_targets = or_(*(
+        RouterKnownHost.address.op('<<=')(target) for target in targets))
+    return {
+        ip_interface(address).ip
+        for address, in dbsession.query(RouterKnownHost.address).
+        filter(within_targets)
+    }
+
+
+def narrow_to_known_hosts(targets, known_hosts):
+    """Replaces target networks with the known live hosts inside them."""
+    return {
+        ip_network(host) for host in known_hosts
+        if any(host in target for target in targets)
+    }
+
+
 def does_target_match_subnets(target, subnets):
     target = ip_network(target)
     subnets = tuple(map(ip_network, subnets))
@@ -409,6 +932,49 @@ class ScanSchema(colander.Schema):
     scanners = ScannerPair(
         widget=widget.MappingWidget(template='mapping_accordion', open=False))
     scan_targets = ScanTargets()
+    known_hosts_only = colander.SchemaNode(
+        colander.Boolean(),
+        missing=False,
+        title='Known Hosts Only',
+        description=(
+            'Scan only hosts seen in router ARP and neighbor tables instead '
+            'of sweeping whole subnets.'),
+    )
+    discover_first = colander.SchemaNode(
+        colander.Boolean(),
+        missing=False,
+        title='Discover Hosts First',
+        description=(
+            'Sweep the targets for live hosts, and run the nmap options '
+            'against the hosts found, in batches as the sweep finds them.'),
+    )
+    port_shards = colander.SchemaNode(
+        colander.Integer(),
+        missing=1,
+        validator=colander.Range(min=1, max=MAX_PORT_SHARDS),
+        title='Port Shards',
+        description=(
+            'Split a numeric -p port range into this many scans of disjoint '
+            'ports, run in parallel by each scanner.'),
+    )
+    auto_timing = colander.SchemaNode(
+        colander.Boolean(),
+        missing=False,
+        title='Auto Timing',
+        description=(
+            'Add timing options chosen for each scanner from the round trip '
+            'times of earlier scans of the target subnets.'),
+    )
+    freshness_minutes = colander.SchemaNode(
+        colander.Integer(),
+        missing=0,
+        validator=colander.Range(min=0),
+        title='Reuse Results (minutes)',
+        description=(
+            'Serve targets scanned within this many minutes, by the same '
+            'scanner with the same options, from their results instead of '
+            'scanning them again.'),
+    )
 
     def after_bind(self, schema, kw):
         if len(kw['scanner_names']) <= 1:
@@ -417,7 +983,19 @@ class ScanSchema(colander.Schema):
     @classmethod
     def form(cls, scanner_names, subnets):
         schema = cls().bind(scanner_names=scanner_names, subnets=subnets)
-        return Form(schema, formid='scan', buttons=('submit',))
+        return make_scan_form(schema)
+
+
+class BulkScanSchema(colander.SequenceSchema):
+    """A batch of scans, each as submitted by the new scan form."""
+    scan = ScanSchema()
+
+    def validator(self, node, cstruct):
+        if not cstruct:
+            raise colander.Invalid(node, 'Must submit at least one scan')
+        if len(cstruct) > BULK_SCAN_LIMIT:
+            raise colander.Invalid(
+                node, f'Must submit at most {BULK_SCAN_LIMIT} scans')
 
 
 @view_config(route_name='show_scan', renderer='templates/scan.jinja2')
@@ -428,20 +1006,301 @@ def show_scan(request):
         id_ = UUID(request.matchdict['id'])
     except ValueError:
         raise HTTPNotFound()
+    standalone = 'standalone' in request.params
+    state = (
+        request.dbsession.query(Scan.status, Scan.completed_at).
+        filter(Scan.id == id_).
+        one_or_none())
+    if not state:
+        raise HTTPNotFound()
+    status, completed_at = state
+    if status == Scan.States.COMPLETED:
+        variant = 'standalone' if standalone else 'page'
+        etag = (
+            f'{id_}-{variant}-{completed_at.timestamp()}-{RENDER_VERSION}')
+        not_modified = check_not_modified(
+            request, etag, completed_at, max_age=PAGE_MAX_AGE,
+            immutable=False)
+        if not_modified:
+            return not_modified
+    scan = (
+        request.dbsession.query(Scan).
+        options(*SCAN_DETAIL_LOADER_OPTIONS).
+        filter(Scan.id == id_).
+        one())
+    return {'scan': scan, 'standalone': standalone}
+
+
+@view_config(route_name='show_subscan_hosts')
+def show_subscan_hosts(request):
+    """
+    Renders a page of a subscan's hosts as an HTML fragment.
+
+    Pages of completed subscans are cached once rendered.
+    """
+    try:
+        id_ = UUID(request.matchdict['id'])
+    except ValueError:
+        raise HTTPNotFound()
+    scanner_name = request.matchdict['scanner_name']
+    subscan = request.dbsession.query(Subscan).get((id_, scanner_name))
+    if not subscan:
+        raise HTTPNotFound()
+    filters = {
+        key: request.params[key] for key in SUBSCAN_HOSTS_FILTERS
+        if request.params.get(key)
+    }
+    ordering = request.params.get('sort', 'address')
+    if ordering not in SUBSCAN_HOSTS_ORDERINGS:
+        raise HTTPBadRequest(f'Unknown host ordering {ordering!r}.')
+    try:
+        page = max(1, int(request.params.get('page', 1)))
+    except ValueError:
+        raise HTTPBadRequest('Invalid page number.')
+
+    cache_key = None
+    if subscan.finished_at:
+        cache_key = (
+            id_, scanner_name, subscan.finished_at, ordering, page,
+            tuple(sorted(filters.items())))
+        html = _subscan_hosts_cache.get(cache_key)
+        if html is not None:
+            return Response(html)
+
+    try:
+        hosts = filter_subscan_hosts(
+            request.dbsession.query(SubscanHost).with_parent(subscan),
+            **filters)
+    except ValueError as e:
+        raise HTTPBadRequest(str(e))
+    host_count = hosts.count()
+    hosts = (
+        hosts.
+        options(selectinload(SubscanHost.ports)).
+        order_by(*SUBSCAN_HOSTS_ORDERINGS[ordering]).
+        offset((page - 1) * SUBSCAN_HOSTS_PAGE_LENGTH).
+        limit(SUBSCAN_HOSTS_PAGE_LENGTH).
+        all())
+
+    def page_url(**params):
+        query = dict(filters, sort=ordering, page=page)
+        query.update(params)
+        return request.route_url(
+            'show_subscan_hosts', id=id_, scanner_name=scanner_name,
+            _query=query)
+
+    html = render('wanmap:templates/subscan_hosts.jinja2', {
+        'subscan': subscan,
+        'hosts': hosts,
+        'host_count': host_count,
+        'first_host': (page - 1) * SUBSCAN_HOSTS_PAGE_LENGTH + 1,
+        'filters': filters,
+        'ordering': ordering,
+        'page': page,
+        'page_count': -(-host_count // SUBSCAN_HOSTS_PAGE_LENGTH),
+        'page_url': page_url,
+    }, request=request)
+    if cache_key:
+        _subscan_hosts_cache.put(cache_key, html)
+    return Response(html)
+
+
+def filter_subscan_hosts(query, address=None, port=None, status=None):
+    """Narrows a subscan host query by the listing filters."""
+    if address:
+        query = query.filter(
+            SubscanHost.address.op('<<=')(ip_network(address, strict=False)))
+    if port:
+        try:
+            port = int(port)
+        except ValueError:
+            raise ValueError(f'Invalid port {port!r}.')
+        query = query.filter(SubscanHost.ports.any(
+            (SubscanPort.number == port) & (SubscanPort.state == 'open')))
+    if status:
+        query = query.filter(SubscanHost.status == status)
+    return query
+
+
+@view_config(route_name='show_subscan_results')
+def show_subscan_results(request):
+    """
+    Serves the complete nmap XML results of one subscan. Subscans served
+    from cache or scanned in batches have none.
+    """
+    try:
+        id_ = UUID(request.matchdict['id'])
+    except ValueError:
+        raise HTTPNotFound()
+    scanner_name = request.matchdict['scanner_name']
+    subscan_filter = (
+        Subscan.scan_id == id_, Subscan.scanner_name == scanner_name,
+        Subscan.xml_results.isnot(None))
+    finished_at = (
+        request.dbsession.query(Subscan.finished_at).
+        filter(*subscan_filter).
+        scalar())
+    if finished_at is None:
+        raise HTTPNotFound()
+    etag = f'{id_}-{scanner_name}-{finished_at.timestamp()}'
+    not_modified = check_not_modified(request, etag, finished_at)
+    if not_modified:
+        return not_modified
+    xml_results = (
+        request.dbsession.query(Subscan.xml_results).
+        filter(*subscan_filter).
+        scalar())
+    response = request.response
+    response.content_type = 'application/xml'
+    response.text = xml_results
+    return response
+
+
+def check_not_modified(
+        request, etag, last_modified, max_age=RESULTS_MAX_AGE,
+        immutable=True):
+    """
+    Marks a response of a completed scan cacheable, returning a 304 response
+    if the client's copy is current.
+
+    Raw results never change, so shared caches may keep them indefinitely.
+    Rendered pages are revalidated after ``max_age``.
+    """
+    response = request.response
+    response.etag = etag
+    response.last_modified = last_modified
+    response.cache_control = f'public, max-age={max_age}' + (
+        ', immutable' if immutable else '')
+    if request.if_none_match:
+        not_modified = etag in request.if_none_match
+    else:
+        not_modified = bool(
+            request.if_modified_since and
+            request.if_modified_since >= response.last_modified)
+    if not_modified:
+        return HTTPNotModified(headers={
+            header: response.headers[header]
+            for header in ('Cache-Control', 'ETag', 'Last-Modified')
+        })
+
+
+@view_config(route_name='show_scan_events')
+def show_scan_events(request):
+    """Streams status changes and newly found hosts as Server-Sent Events."""
+    try:
+        id_ = UUID(request.matchdict['id'])
+    except ValueError:
+        raise HTTPNotFound()
+    redis_url = request.registry.settings.get(
+        'wanmap.redis_url', DEFAULT_REDIS_URL)
+    pubsub = get_redis(redis_url).pubsub()
+    # Subscribe before reading the current status so no event is missed.
+    pubsub.subscribe(scan_channel(id_))
     scan = request.dbsession.query(Scan).get(id_)
     if not scan:
+        pubsub.close()
         raise HTTPNotFound()
-    standalone = 'standalone' in request.params
-    return {'scan': scan, 'standalone': standalone}
+    response = request.response
+    response.content_type = 'text/event-stream'
+    response.cache_control = 'no-cache'
+    # Prevents nginx from buffering the stream.
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.app_iter = stream_scan_events(
+        pubsub, [scan_status_event(scan)], is_scan_completed_event)
+    return response
+
+
+def scan_status_event(scan):
+    return 'status', {
+        'status': scan.status.name,
+        'completed_subscans': scan.completed_subscan_count,
+        'total_subscans': scan.subscan_count,
+    }
+
+
+def subscan_hosts_event(subscan, hosts=None):
+    """
+    Summarizes the responsive hosts and open ports of a subscan, or of some
+    of its hosts.
+    """
+    hosts = [
+        {
+            'address': str(host.ip),
+            'hostname': host.hostname,
+            'ports': host.open_ports,
+        }
+        for host in (subscan.hosts if hosts is None else hosts)
+        if host.status == 'up'
+    ]
+    return 'hosts', {'scanner': subscan.scanner_name, 'hosts': hosts}
+
+
+def is_scan_completed_event(event, data):
+    return (
+        event == 'status' and data['status'] == Scan.States.COMPLETED.name)
 
 
 @view_config(route_name='show_scans', renderer='templates/scans.jinja2')
 def show_scans(request):
+    """
+    Lists scans newest first, a page at a time.
+
+    Pages are sought by the (created_at, id) of the last scan of the previous
+    page rather than by offset, so each page costs the same however deep.
+    """
+    filters = {
+        key: request.params[key] for key in SCAN_LISTING_FILTERS
+        if request.params.get(key)
+    }
+    try:
+        query = filter_scans(request.dbsession.query(Scan), **filters)
+        before = request.params.get('before')
+        if before:
+            query = query.filter(
+                tuple_(Scan.created_at, Scan.id) < decode_scan_cursor(before))
+    except ValueError as e:
+        raise HTTPBadRequest(str(e))
     scans = tuple(
-        request.dbsession.query(Scan).
-        order_by(Scan.created_at.desc())
-        [:SCAN_LISTING_PAGE_LENGTH])
-    return {'scans': scans}
+        query.
+        order_by(Scan.created_at.desc(), Scan.id.desc()).
+        limit(SCAN_LISTING_PAGE_LENGTH + 1))
+    next_page = None
+    if len(scans) > SCAN_LISTING_PAGE_LENGTH:
+        scans = scans[:SCAN_LISTING_PAGE_LENGTH]
+        next_page = request.route_url('show_scans', _query=dict(
+            filters, before=encode_scan_cursor(scans[-1])))
+    return {'scans': scans, 'filters': filters, 'next_page': next_page}
+
+
+def filter_scans(query, type=None, status=None, scanner=None, target=None):
+    """Narrows a scan query by the listing filters, which may be unset."""
+    if type:
+        query = query.filter(Scan._type == type)
+    if status:
+        try:
+            query = query.filter(Scan.status == Scan.States[status.upper()])
+        except KeyError:
+            raise ValueError(f'Unknown scan status {status!r}.')
+    if scanner:
+        query = query.filter(
+            Scan.subscans.any(Subscan.scanner_name == scanner))
+    if target:
+        # Overlapping targets, whether containing or contained by the filter.
+        query = query.filter(Scan.targets.any(
+            ScanTarget.net_block.op('&&')(ip_network(target, strict=False))))
+    return query
+
+
+def encode_scan_cursor(scan):
+    return f'{scan.created_at.isoformat()},{scan.id}'
+
+
+def decode_scan_cursor(cursor):
+    try:
+        created_at, id_ = cursor.rsplit(',', 1)
+        return arrow.get(created_at).datetime, UUID(id_)
+    except (arrow.parser.ParserError, ValueError):
+        raise ValueError(f'Invalid scan listing cursor {cursor!r}.')
 
 
 def schedule_scan(dbsession, scan_class, appstruct):
@@ -455,3 +1314,28 @@ def schedule_scan(dbsession, scan_class, appstruct):
     dbsession.flush()
     scan_workflow.delay(scan_id)
     return scan_id
+
+
+def schedule_scans(dbsession, appstructs):
+    """
+    Plans, inserts and dispatches a batch of validated scans together.
+
+    The scans are flushed at once, which the engine may send as multi-row
+    inserts, and dispatched by a single task message.
+    """
+    from .tasks import scan_workflows
+    planner = ScanPlanner(dbsession)
+    scans = []
+    for index, appstruct in enumerate(appstructs):
+        scan_class = (
+            DeltaScan if appstruct.get('scanners') else SplittingScan)
+        try:
+            scans.append(
+                scan_class.from_appstruct(dbsession, appstruct, planner))
+        except ValueError as e:
+            raise ValueError(f'Scan {index}: {e}') from e
+    dbsession.add_all(scans)
+    dbsession.flush()
+    scan_ids = [scan.id for scan in scans]
+    scan_workflows.delay(scan_ids)
+    return scan_ids
@@ -4,15 +4,24 @@ import logging
 import uuid
 
 import arrow
+from bs4 import BeautifulSoup
 from deform import ValidationFailure
-from pyramid.httpexceptions import HTTPNotFound
+from pyramid import testing
+from pyramid.httpexceptions import (
+    HTTPBadRequest, HTTPNotFound, HTTPNotModified
+)
+from pyramid.request import Request
+from pyramid.threadlocal import get_current_registry
 import pytest
+from sqlalchemy import event
 
 from .scans import (
-    get_scannable_subnets, Scan, SplittingScan, ScanSchema, show_scan,
-    show_scans, PING_SWEEP,
+    encode_scan_cursor, get_scannable_subnets, _scan_form_cache, Scan,
+    SplittingScan, ScanSchema, show_scan, show_scan_events, show_scans,
+    show_subscan_hosts, show_subscan_results, subscan_hosts_event, PING_SWEEP,
+    SCAN_LISTING_PAGE_LENGTH, SUBSCAN_HOSTS_PAGE_LENGTH,
     NO_SCANNERS_ALERT_MESSAGE, ONLY_ONE_SCANNER_ALERT_MESSAGE,
-    NO_KNOWN_SUBNETS_ALERT_MESSAGE,
+    NO_KNOWN_HOSTS_MESSAGE, NO_KNOWN_SUBNETS_ALERT_MESSAGE, PAGE_MAX_AGE,
 )
 
 FAKE_SCAN_RESULT_XML = (
@@ -22,6 +31,18 @@ FAKE_SCAN_RESULT_XML = (
     '<nmaprun/>'
 )
 
+FAKE_HOST_RESULT_XML = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<!DOCTYPE nmaprun>'
+    '<nmaprun>'
+    '<host><status state="up"/><address addr="10.1.0.1" addrtype="ipv4"/>'
+    '<ports><port protocol="tcp" portid="22"><state state="open"/></port>'
+    '</ports></host>'
+    '<host><status state="down"/><address addr="10.1.0.2" addrtype="ipv4"/>'
+    '</host>'
+    '</nmaprun>'
+)
+
 
 _logger = logging.getLogger(__name__)
 
@@ -136,6 +157,77 @@ def test_new_scan_with_two_scanners_has_scanner_selection(
     assert response.forms['scan'].fields['scanner_b'][0].tag == 'select'
 
 
+@pytest.fixture
+def count_scan_forms(monkeypatch):
+    built = []
+    form = ScanSchema.form.__func__
+
+    def counting_form(cls, scanner_names, subnets):
+        built.append((scanner_names, subnets))
+        return form(cls, scanner_names, subnets)
+
+    _scan_form_cache.clear()
+    monkeypatch.setattr(ScanSchema, 'form', classmethod(counting_form))
+    yield built
+    _scan_form_cache.clear()
+
+
+def test_new_scan_form_is_built_once(monkeypatch, fresh_app, count_scan_forms):
+    monkeypatch.setattr(
+        'wanmap.scans.get_scannable_subnets',
+        lambda _: {'10.1.0.0/24'})
+    monkeypatch.setattr(
+        'wanmap.scans.get_scanner_names',
+        lambda _: {'dc', 'branch'})
+    first = fresh_app.get('/scans/new')
+    fresh_app.get('/scans/new')
+    response = fresh_app.post('/scans/new', {'nmap_options': ''})
+    assert len(count_scan_forms) == 1
+    assert first.forms['scan'].fields['scanner_a'][0].tag == 'select'
+    assert response.html.find(class_='has-error')
+
+
+def test_new_scan_form_is_rebuilt_for_new_scanners(
+    monkeypatch, fresh_app, count_scan_forms):
+
+    scanner_names = {'dc'}
+    monkeypatch.setattr(
+        'wanmap.scans.get_scannable_subnets',
+        lambda _: {'10.1.0.0/24'})
+    monkeypatch.setattr(
+        'wanmap.scans.get_scanner_names',
+        lambda _: scanner_names)
+    fresh_app.get('/scans/new')
+    scanner_names = {'dc', 'branch'}
+    response = fresh_app.get('/scans/new')
+    assert len(count_scan_forms) == 2
+    assert response.forms['scan'].fields['scanner_a'][0].tag == 'select'
+
+
+def test_new_scan_without_known_hosts_alerts(monkeypatch, fresh_app):
+    monkeypatch.setattr(
+        'wanmap.scans.get_scannable_subnets',
+        lambda _: {'10.1.0.0/24'})
+    monkeypatch.setattr(
+        'wanmap.scans.get_scanner_names',
+        lambda _: {'dc', 'branch'})
+
+    def schedule_scan(dbsession, scan_class, appstruct):
+        raise ValueError(NO_KNOWN_HOSTS_MESSAGE)
+
+    monkeypatch.setattr('wanmap.scans.schedule_scan', schedule_scan)
+    response = fresh_app.post('/scans/new', [
+        ('nmap_options', PING_SWEEP),
+        ('__start__', 'scan_targets:sequence'),
+        ('scan_target', '10.1.0.0/24'),
+        ('__end__', 'scan_targets:sequence'),
+        ('known_hosts_only', 'true'),
+    ])
+    alert_div = response.html.find('div', class_='alert')
+    assert NO_KNOWN_HOSTS_MESSAGE in alert_div.text
+    assert response.forms['scan']
+
+
 @pytest.fixture
 def persisted_scan(dbsession, fake_wan_scanners, fake_wan_routers):
     scan = SplittingScan.create(
@@ -163,6 +255,305 @@ def test_show_scan_with_valid_id(view_request, persisted_scan):
     assert response['scan'] is not None
 
 
+@pytest.fixture
+def completed_scan(dbsession, persisted_scan):
+    for subscan in persisted_scan.subscans:
+        started_at = arrow.now().datetime
+        subscan.complete(FAKE_HOST_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    return persisted_scan
+
+
+def make_request(dbsession, scan, **headers):
+    """A real request, where conditional headers are parsed."""
+    request = Request.blank('/', headers=headers)
+    request.registry = get_current_registry()
+    request.dbsession = dbsession
+    request.matchdict = {'id': str(scan.id)}
+    return request
+
+
+def test_show_scan_completed_is_cacheable(dbsession, completed_scan):
+    request = make_request(dbsession, completed_scan)
+    show_scan(request)
+    assert request.response.etag
+    assert request.response.last_modified
+    assert request.response.cache_control.max_age == PAGE_MAX_AGE
+    assert 'immutable' not in request.response.cache_control.header_value
+
+
+def test_show_scan_etag_changes_with_render_version(
+    monkeypatch, dbsession, completed_scan):
+
+    request = make_request(dbsession, completed_scan)
+    show_scan(request)
+    etag = request.response.headers['ETag']
+    monkeypatch.setattr('wanmap.scans.RENDER_VERSION', 'redeployed')
+    request = make_request(
+        dbsession, completed_scan, **{'If-None-Match': etag})
+    assert isinstance(show_scan(request), dict)
+
+
+def test_show_scan_progressing_is_not_cacheable(dbsession, persisted_scan):
+    request = make_request(dbsession, persisted_scan)
+    show_scan(request)
+    assert request.response.etag is None
+    assert not request.response.cache_control.max_age
+
+
+def test_show_scan_matching_etag_not_modified(dbsession, completed_scan):
+    request = make_request(dbsession, completed_scan)
+    show_scan(request)
+    etag = request.response.headers['ETag']
+    request = make_request(
+        dbsession, completed_scan, **{'If-None-Match': etag})
+    assert isinstance(show_scan(request), HTTPNotModified)
+
+
+def test_show_scan_standalone_has_distinct_etag(dbsession, completed_scan):
+    request = make_request(dbsession, completed_scan)
+    show_scan(request)
+    etag = request.response.headers['ETag']
+    request = make_request(
+        dbsession, completed_scan, **{'If-None-Match': etag})
+    request.GET['standalone'] = 'yes'
+    assert isinstance(show_scan(request), dict)
+
+
+def test_show_scan_unmodified_since_completion(dbsession, completed_scan):
+    request = make_request(dbsession, completed_scan)
+    show_scan(request)
+    last_modified = request.response.headers['Last-Modified']
+    request = make_request(
+        dbsession, completed_scan, **{'If-Modified-Since': last_modified})
+    assert isinstance(show_scan(request), HTTPNotModified)
+
+
+def test_show_subscan_results_matching_etag_not_modified(
+    dbsession, completed_scan):
+
+    request = make_request(dbsession, completed_scan)
+    request.matchdict['scanner_name'] = completed_scan.subscans[0].scanner_name
+    etag = show_subscan_results(request).headers['ETag']
+    request = make_request(
+        dbsession, completed_scan, **{'If-None-Match': etag})
+    request.matchdict['scanner_name'] = completed_scan.subscans[0].scanner_name
+    assert isinstance(show_subscan_results(request), HTTPNotModified)
+
+
+def many_hosts_result_xml(count):
+    hosts = ''.join(
+        f'<host><status state="up"/>'
+        f'<address addr="10.1.{i // 256}.{i % 256}" addrtype="ipv4"/>'
+        f'<ports><port protocol="tcp" portid="{1 + i % 3}">'
+        f'<state state="open"/></port></ports></host>'
+        for i in range(count))
+    return f'<?xml version="1.0"?><nmaprun>{hosts}</nmaprun>'
+
+
+@pytest.fixture
+def hosts_request(dbsession, subscan):
+    request = make_request(dbsession, subscan.scan)
+    request.matchdict['scanner_name'] = subscan.scanner_name
+    with testing.testConfig(request=request) as config:
+        request.registry = config.registry
+        config.include('pyramid_jinja2')
+        config.include('wanmap.scans')
+        yield request
+
+
+@pytest.fixture
+def many_hosts_subscan(dbsession, subscan):
+    started_at = arrow.now().datetime
+    subscan.complete(
+        many_hosts_result_xml(SUBSCAN_HOSTS_PAGE_LENGTH + 10),
+        (started_at, started_at))
+    dbsession.flush()
+    return subscan
+
+
+def host_rows(response):
+    return [
+        row.find('td').text
+        for row in BeautifulSoup(response.text, 'html.parser').
+        select('tbody tr')
+    ]
+
+
+def test_show_subscan_hosts_pages(hosts_request, many_hosts_subscan):
+    first_page = host_rows(show_subscan_hosts(hosts_request))
+    assert len(first_page) == SUBSCAN_HOSTS_PAGE_LENGTH
+    assert first_page[:2] == ['10.1.0.0', '10.1.0.1']
+    hosts_request.GET['page'] = '2'
+    assert len(host_rows(show_subscan_hosts(hosts_request))) == 10
+
+
+def test_show_subscan_hosts_sorts(hosts_request, many_hosts_subscan):
+    hosts_request.GET['sort'] = 'hostname'
+    assert host_rows(show_subscan_hosts(hosts_request))[0] == '10.1.0.0'
+
+
+@pytest.mark.parametrize('filters,count', [
+    ({'port': '1'}, 20),
+    ({'address': '10.1.0.0/28'}, 16),
+    ({'address': '10.1.0.0/28', 'port': '2'}, 5),
+])
+def test_show_subscan_hosts_filters(
+    hosts_request, many_hosts_subscan, filters, count):
+
+    hosts_request.GET.update(filters)
+    assert len(host_rows(show_subscan_hosts(hosts_request))) == count
+
+
+def test_show_subscan_hosts_filters_none(hosts_request, many_hosts_subscan):
+    hosts_request.GET['status'] = 'down'
+    rows = host_rows(show_subscan_hosts(hosts_request))
+    assert rows == ['No hosts found.']
+
+
+@pytest.mark.parametrize('params', [
+    {'sort': 'color'}, {'page': 'last'}, {'port': 'ssh'},
+])
+def test_show_subscan_hosts_invalid_params_fail(
+    hosts_request, many_hosts_subscan, params):
+
+    hosts_request.GET.update(params)
+    with pytest.raises(HTTPBadRequest):
+        show_subscan_hosts(hosts_request)
+
+
+def test_show_subscan_hosts_caches_completed(
+    dbsession, hosts_request, many_hosts_subscan, count_queries):
+
+    show_subscan_hosts(hosts_request)
+    dbsession.expunge_all()
+    count_queries.clear()
+    show_subscan_hosts(hosts_request)
+    # Only the subscan itself
+    assert len(count_queries) == 1
+
+
+@pytest.fixture
+def count_queries(dbsession):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = dbsession.get_bind()
+    event.listen(engine, 'before_cursor_execute', count)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', count)
+
+
+def test_show_scan_loads_in_fixed_queries(
+    dbsession, completed_scan, count_queries):
+
+    dbsession.expunge_all()
+    count_queries.clear()
+    scan = show_scan(make_request(dbsession, completed_scan))['scan']
+    # Everything the template reads
+    assert isinstance(scan, SplittingScan)
+    for subscan in scan.subscans:
+        assert subscan.results_length == len(FAKE_HOST_RESULT_XML)
+        assert subscan.targets
+    # The scan state, then the scan, subscans and subscan targets
+    assert len(count_queries) == 4
+    assert not any('xml_results AS' in query for query in count_queries)
+
+
+def test_show_subscan_results(dbsession, completed_scan):
+    request = make_request(dbsession, completed_scan)
+    request.matchdict['scanner_name'] = completed_scan.subscans[0].scanner_name
+    response = show_subscan_results(request)
+    assert response.content_type == 'application/xml'
+    assert 'immutable' in response.cache_control.header_value
+    assert response.text == FAKE_HOST_RESULT_XML
+
+
+def test_show_subscan_results_pending_fails(view_request, subscan):
+    view_request.matchdict.update(
+        id=str(subscan.scan_id), scanner_name=subscan.scanner_name)
+    with pytest.raises(HTTPNotFound):
+        show_subscan_results(view_request)
+
+
+class FakeRedis:
+
+    def __init__(self):
+        self.pubsubs = []
+
+    def pubsub(self):
+        pubsub = FakePubSub()
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+
+class FakePubSub:
+
+    def __init__(self):
+        self.channels = []
+        self.closed = False
+
+    def subscribe(self, channel):
+        self.channels.append(channel)
+
+    def get_message(self, ignore_subscribe_messages, timeout):
+        return None
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_redis(monkeypatch, view_request):
+    monkeypatch.setattr(view_request.registry, 'settings', {}, raising=False)
+    redis = FakeRedis()
+    monkeypatch.setattr('wanmap.scans.get_redis', lambda url: redis)
+    return redis
+
+
+def test_show_scan_events_nonexistent_scan_fails(view_request, fake_redis):
+    view_request.matchdict['id'] = str(uuid.uuid4())
+    with pytest.raises(HTTPNotFound):
+        show_scan_events(view_request)
+    assert fake_redis.pubsubs[0].closed
+
+
+def test_show_scan_events_streams_current_status(
+    view_request, fake_redis, persisted_scan):
+
+    view_request.matchdict['id'] = str(persisted_scan.id)
+    response = show_scan_events(view_request)
+    assert response.content_type == 'text/event-stream'
+    assert fake_redis.pubsubs[0].channels
+    first_event = next(iter(response.app_iter))
+    assert first_event.startswith(b'event: status\n')
+    assert b'SCHEDULED' in first_event
+
+
+def test_show_scan_events_ends_for_completed_scan(
+    dbsession, view_request, fake_redis, persisted_scan):
+
+    for subscan in persisted_scan.subscans:
+        started_at = arrow.now().datetime
+        subscan.complete(FAKE_SCAN_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    view_request.matchdict['id'] = str(persisted_scan.id)
+    response = show_scan_events(view_request)
+    assert len(list(response.app_iter)) == 1
+    assert fake_redis.pubsubs[0].closed
+
+
+def test_subscan_hosts_event_lists_responsive_hosts(subscan):
+    started_at = arrow.now().datetime
+    subscan.complete(FAKE_HOST_RESULT_XML, (started_at, started_at))
+    event, data = subscan_hosts_event(subscan)
+    assert event == 'hosts'
+    assert data['hosts'] == [
+        {'address': '10.1.0.1', 'hostname': None, 'ports': ['22/tcp']}]
+
+
 def test_list_scans_empty(view_request):
     result = show_scans(view_request)
     assert result['scans'] == ()
@@ -173,38 +564,151 @@ def test_list_scans_exist(view_request, persisted_scan):
     assert result['scans'] == (persisted_scan,)
 
 
-@pytest.mark.xfail(reason='Pagination not yet implemented.')
-def test_list_scans_pagination(view_request):
-    from .scans import SCAN_LISTING_PAGE_LENGTH
+@pytest.fixture
+def scan_routes(view_request):
+    with testing.testConfig(request=view_request) as config:
+        config.include('wanmap.scans')
+        yield
+
+
+@pytest.fixture
+def many_scans(dbsession):
+    created_at = arrow.now()
+    scans = [
+        Scan(
+            id=uuid.uuid4(), parameters=PING_SWEEP,
+            created_at=created_at.shift(minutes=-minutes).datetime)
+        for minutes in range(SCAN_LISTING_PAGE_LENGTH + 5)
+    ]
+    dbsession.add_all(scans)
+    dbsession.flush()
+    return scans
+
+
+def test_list_scans_pagination(view_request, scan_routes, many_scans):
+    result = show_scans(view_request)
+    assert result['scans'] == tuple(many_scans[:SCAN_LISTING_PAGE_LENGTH])
+    assert 'before=' in result['next_page']
+
+
+def test_list_scans_next_page(view_request, many_scans):
+    view_request.params['before'] = encode_scan_cursor(
+        many_scans[SCAN_LISTING_PAGE_LENGTH - 1])
     result = show_scans(view_request)
-    assert len(result['scans']) == SCAN_LISTING_PAGE_LENGTH
+    assert result['scans'] == tuple(many_scans[SCAN_LISTING_PAGE_LENGTH:])
+    assert result['next_page'] is None
+
+
+def test_list_scans_invalid_cursor_fails(view_request):
+    view_request.params['before'] = '🐢'
+    with pytest.raises(HTTPBadRequest):
+        show_scans(view_request)
+
+
+@pytest.mark.parametrize('filters,matches', [
+    ({'type': 'splitting'}, True),
+    ({'type': 'delta'}, False),
+    ({'status': 'scheduled'}, True),
+    ({'status': 'completed'}, False),
+    ({'scanner': 'scanner1'}, True),
+    ({'scanner': 'nonexistent'}, False),
+    ({'target': '10.1.0.0/16'}, True),
+    ({'target': '0.0.0.0/0'}, True),
+    ({'target': '192.168.0.0/16'}, False),
+])
+def test_list_scans_filters(view_request, persisted_scan, filters, matches):
+    view_request.params.update(filters)
+    result = show_scans(view_request)
+    assert result['scans'] == ((persisted_scan,) if matches else ())
+    assert result['filters'] == filters
+
+
+def test_list_scans_invalid_status_fails(view_request):
+    view_request.params['status'] = 'lost'
+    with pytest.raises(HTTPBadRequest):
+        show_scans(view_request)
 
 
 def test_scan_initially_scheduled(persisted_scan):
     assert persisted_scan.status == Scan.States.SCHEDULED
 
 
-def test_scan_starting_subscan_marks_scan_progressing(persisted_scan):
-    persisted_scan.subscans[0].started_at = arrow.now().datetime
+def test_scan_counts_subscans(persisted_scan):
+    assert persisted_scan.subscan_count == len(persisted_scan.subscans)
+    assert persisted_scan.completed_subscan_count == 0
+
+
+def test_scan_starting_subscan_marks_scan_progressing(
+    dbsession, persisted_scan):
+
+    persisted_scan.subscans[0].start(arrow.now().datetime)
+    dbsession.flush()
     assert persisted_scan.status == Scan.States.PROGRESSING
 
 
-def test_scan_all_subscans_finished_marks_scan_completed(persisted_scan):
+def test_scan_all_subscans_finished_marks_scan_completed(
+    dbsession, persisted_scan):
+
     for subscan in persisted_scan.subscans:
         started_at = arrow.now().datetime
         finished_at = started_at + timedelta(seconds=1)
         subscan.complete(FAKE_SCAN_RESULT_XML, (started_at, finished_at))
+        dbsession.flush()
     assert persisted_scan.status == Scan.States.COMPLETED
+    assert persisted_scan.completed_subscan_count == (
+        persisted_scan.subscan_count)
+    assert persisted_scan.completed_at == max(
+        subscan.finished_at for subscan in persisted_scan.subscans)
+
 
+def test_scan_not_all_subscans_finished_marks_scan_progressing(
+    dbsession, persisted_scan):
 
-def test_scan_not_all_subscans_finished_marks_scan_progressing(persisted_scan):
     for subscan in persisted_scan.subscans:
-        subscan.started_at = arrow.now().datetime
+        subscan.start(arrow.now().datetime)
     for subscan in persisted_scan.subscans[:-1]:
         started_at = arrow.now().datetime
         finished_at = started_at + timedelta(seconds=1)
         subscan.complete(FAKE_SCAN_RESULT_XML, (started_at, finished_at))
+    dbsession.flush()
     assert persisted_scan.status == Scan.States.PROGRESSING
+    assert persisted_scan.completed_at is not None
+
+
+def test_scan_starting_subscan_after_completion_stays_completed(
+    dbsession, persisted_scan):
+
+    started_at = arrow.now().datetime
+    for subscan in persisted_scan.subscans:
+        subscan.complete(FAKE_SCAN_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    persisted_scan.subscans[0].start(started_at)
+    dbsession.flush()
+    assert persisted_scan.status == Scan.States.COMPLETED
+
+
+def test_subscan_completing_twice_counts_once(dbsession, persisted_scan):
+    subscan = persisted_scan.subscans[0]
+    started_at = arrow.now().datetime
+    subscan.complete(FAKE_SCAN_RESULT_XML, (started_at, started_at))
+    subscan.complete(FAKE_SCAN_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    assert persisted_scan.completed_subscan_count == 1
+
+
+def test_scan_completed_before_insert_counts_subscans(
+    dbsession, fake_wan_scanners, fake_wan_routers):
+
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP, targets=('10.0.0.0/8',))
+    started_at = arrow.now().datetime
+    for subscan in scan.subscans:
+        subscan.complete(FAKE_SCAN_RESULT_XML, (started_at, started_at))
+    dbsession.add(scan)
+    dbsession.flush()
+    assert scan.status == Scan.States.COMPLETED
+    assert scan.completed_subscan_count == scan.subscan_count
+    assert scan.completed_at == started_at
 
 
 @pytest.fixture
@@ -232,6 +736,25 @@ def test_subscan_complete_sets_xml_result(subscan):
     assert len(subscan.xml_results)
 
 
+def test_subscan_complete_records_hosts(dbsession, subscan):
+    started_at = arrow.now().datetime
+    subscan.complete(FAKE_HOST_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    up, down = sorted(subscan.hosts, key=lambda host: host.ip)
+    assert (str(up.ip), up.status, up.open_port_count) == ('10.1.0.1', 'up', 1)
+    assert up.open_ports == ['22/tcp']
+    assert (str(down.ip), down.status, down.ports) == ('10.1.0.2', 'down', [])
+
+
+def test_subscan_complete_again_replaces_hosts(dbsession, subscan):
+    started_at = arrow.now().datetime
+    subscan.complete(FAKE_HOST_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    subscan.complete(FAKE_SCAN_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    assert subscan.hosts == []
+
+
 def test_get_scannable_subnets_includes_glue_nets(dbsession, fake_wan_routers):
     assert ip_network('192.168.0.0/30') in get_scannable_subnets(dbsession)
 
@@ -398,3 +921,133 @@ def test_scan_form_restricts_overlapping_host(scan_form, fake_dns):
         }
         scan_form.validate_pstruct(appstruct)
     assert 'Target cannot overlap' in exc.value.render()
+
+
+@pytest.fixture
+def recent_scan(scan_results):
+    def recent_scan(minutes_ago=0, parameters=PING_SWEEP):
+        return scan_results(
+            FAKE_HOST_RESULT_XML, parameters=parameters,
+            finished_at=arrow.now().shift(minutes=-minutes_ago).datetime)
+    return recent_scan
+
+
+def test_scan_reuses_recent_results(dbsession, recent_scan):
+    previous_scan = recent_scan(minutes_ago=5)
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP, targets=('10.1.0.0/25',),
+        freshness_minutes=10)
+    subscan, = scan.subscans
+    assert subscan.is_cached
+    assert subscan.targets[0].cached_scan_id == previous_scan.id
+    assert {(str(host.ip), host.cached_scan_id) for host in subscan.hosts} == {
+        ('10.1.0.1', previous_scan.id), ('10.1.0.2', previous_scan.id)}
+    assert scan.status == Scan.States.COMPLETED
+    dbsession.add(scan)
+    dbsession.flush()
+
+
+def test_show_subscan_results_of_cached_subscan_fails(
+    dbsession, view_request, recent_scan):
+
+    recent_scan()
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP, targets=('10.1.0.0/24',),
+        freshness_minutes=10)
+    dbsession.add(scan)
+    dbsession.flush()
+    view_request.matchdict.update(
+        id=str(scan.id), scanner_name=scan.subscans[0].scanner_name)
+    with pytest.raises(HTTPNotFound):
+        show_subscan_results(view_request)
+
+
+def test_scan_does_not_reuse_stale_results(dbsession, recent_scan):
+    recent_scan(minutes_ago=30)
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP, targets=('10.1.0.0/24',),
+        freshness_minutes=10)
+    assert not scan.subscans[0].is_cached
+    assert scan.status == Scan.States.SCHEDULED
+
+
+def test_scan_does_not_reuse_results_of_other_parameters(
+    dbsession, recent_scan):
+
+    recent_scan(parameters='-sS')
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP, targets=('10.1.0.0/24',),
+        freshness_minutes=10)
+    assert scan.subscans[0].hosts == []
+
+
+def test_scan_scans_targets_without_recent_results(dbsession, recent_scan):
+    recent_scan()
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP,
+        targets=('10.1.0.0/24', '10.2.0.0/24'), freshness_minutes=10)
+    scanned_targets = {
+        str(target)
+        for subscan in scan.subscans for target in subscan.scanned_targets
+    }
+    assert scanned_targets == {'10.2.0.0/24'}
+    assert scan.status == Scan.States.PROGRESSING
+
+
+def test_subscan_complete_keeps_cached_hosts(dbsession, recent_scan):
+    recent_scan()
+    scan = SplittingScan.create(
+        dbsession, parameters=PING_SWEEP,
+        targets=('10.1.0.0/24', '10.2.0.0/24'), freshness_minutes=10)
+    dbsession.add(scan)
+    dbsession.flush()
+    for subscan in scan.subscans:
+        started_at = arrow.now().datetime
+        subscan.complete(FAKE_SCAN_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    assert sum(len(subscan.hosts) for subscan in scan.subscans) == 2
+
+
+def test_subscan_batches_add_hosts(dbsession, subscan):
+    started_at = arrow.now().datetime
+    hosts = subscan.add_batch(FAKE_HOST_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    assert len(hosts) == 2
+    assert len(subscan.hosts) == 2
+    assert subscan.finished_at is None
+
+
+def test_subscan_completes_with_last_batch_after_discovery(
+    dbsession, subscan):
+
+    started_at = arrow.now().datetime
+    subscan.add_batch(FAKE_HOST_RESULT_XML, (started_at, started_at))
+    subscan.finish_discovery(2, started_at)
+    dbsession.flush()
+    assert subscan.finished_at is None
+    subscan.add_batch(FAKE_SCAN_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    assert subscan.finished_at is not None
+    assert subscan.scan.completed_subscan_count == 1
+
+
+def test_subscan_without_live_hosts_completes_after_discovery(
+    dbsession, subscan):
+
+    subscan.finish_discovery(0, arrow.now().datetime)
+    dbsession.flush()
+    assert subscan.scan.completed_subscan_count == 1
+
+
+def test_subscan_batches_merge_port_shards(dbsession, subscan):
+    started_at = arrow.now().datetime
+    subscan.finish_discovery(2, started_at)
+    subscan.add_batch(FAKE_HOST_RESULT_XML, (started_at, started_at))
+    dbsession.flush()
+    subscan.add_batch(
+        FAKE_HOST_RESULT_XML.replace('portid="22"', 'portid="80"'),
+        (started_at, started_at))
+    dbsession.flush()
+    up, down = sorted(subscan.hosts, key=lambda host: host.ip)
+    assert (up.open_ports, up.open_port_count) == (['22/tcp', '80/tcp'], 2)
+    assert subscan.finished_at is not None
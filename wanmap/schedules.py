@@ -0,0 +1,275 @@
+"""Recurring scans, started by Celery beat at spread out times."""
+
+from collections import Counter
+from datetime import datetime, time, timedelta, timezone
+import logging
+from math import ceil
+import random
+from uuid import uuid4, UUID
+
+import arrow
+import colander
+from deform import Form, ValidationFailure
+from pyramid.httpexceptions import HTTPFound, HTTPNotFound
+from pyramid.view import view_config
+from sqlalchemy import (
+    Boolean, Column, DateTime, ForeignKey, Integer, String,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import relationship
+
+from .scans import (
+    DeltaScan, get_scannable_subnets, get_scanner_names, Scan, ScanPlanner,
+    ScanSchema, SplittingScan, NO_KNOWN_SUBNETS_ALERT_MESSAGE,
+    NO_SCANNERS_ALERT_MESSAGE,
+)
+from .schema import Persistable
+
+SCHEDULE_FORM_TITLE = 'Schedule Recurring Scan'
+# Runs are spread over the slots of each schedule's window.
+SCHEDULE_SLOT_MINUTES = 5
+SCAN_FIELDS = (
+    'nmap_options', 'scanners', 'scan_targets', 'known_hosts_only',
+    'discover_first', 'port_shards', 'auto_timing', 'freshness_minutes',
+)
+
+logger = logging.getLogger(__name__)
+
+
+def includeme(config):
+    config.add_route('show_schedules', '/schedules/')
+    config.add_route('delete_schedule', '/schedules/{id}/delete')
+
+
+class ScheduledScan(Persistable):
+    """A scan definition that runs every interval."""
+
+    __tablename__ = 'scheduled_scans'
+    id = Column(postgresql.UUID(as_uuid=True), primary_key=True)
+    name = Column(String(64), nullable=False, unique=True)
+    # The new scan form's fields, planned afresh for each run.
+    appstruct = Column(postgresql.JSONB, nullable=False)
+    interval_minutes = Column(Integer, nullable=False)
+    # Each run starts within this many minutes after it is due.
+    window_minutes = Column(Integer, nullable=False, default=0)
+    due_at = Column(DateTime(timezone=True), nullable=False)
+    next_run_at = Column(DateTime(timezone=True), nullable=False, index=True)
+    # The scanners of the latest run, to spread runs by scanner.
+    scanner_names = Column(postgresql.ARRAY(String(64)), nullable=False)
+    enabled = Column(Boolean, nullable=False, default=True)
+    last_scan_id = Column(
+        postgresql.UUID(as_uuid=True), ForeignKey('scans.id'))
+
+    last_scan = relationship(Scan)
+
+    @classmethod
+    def create(
+            cls, dbsession, name, appstruct, interval_minutes,
+            window_minutes, due_at):
+        scanners = appstruct.get('scanners') or {}
+        schedule = cls(
+            id=uuid4(), name=name, appstruct=appstruct,
+            interval_minutes=interval_minutes, window_minutes=window_minutes,
+            due_at=due_at, scanner_names=sorted(scanners.values()),
+            enabled=True)
+        schedule.next_run_at = plan_run(dbsession, schedule)
+        return schedule
+
+    @property
+    def interval(self):
+        return timedelta(minutes=self.interval_minutes)
+
+    @property
+    def window(self):
+        return timedelta(minutes=self.window_minutes)
+
+
+def plan_run(dbsession, schedule):
+    """
+    Picks when a schedule next runs, within the window after it is due.
+
+    The window is divided into slots. The run goes in the slot with the
+    fewest runs already planned on any of the schedule's scanners, or on
+    any scanner until its scanners are known, at a random time in the slot.
+    """
+    slot = timedelta(minutes=SCHEDULE_SLOT_MINUTES)
+    slot_count = max(1, ceil(schedule.window / slot))
+    planned = dbsession.query(
+        ScheduledScan.next_run_at, ScheduledScan.scanner_names).filter(
+        ScheduledScan.id != schedule.id,
+        ScheduledScan.enabled,
+        ScheduledScan.next_run_at >= schedule.due_at,
+        ScheduledScan.next_run_at < schedule.due_at + schedule.window)
+    if schedule.scanner_names:
+        planned = planned.filter(
+            ScheduledScan.scanner_names.overlap(schedule.scanner_names))
+    loads = [Counter() for _ in range(slot_count)]
+    for run_at, scanner_names in planned:
+        index = min(int((run_at - schedule.due_at) / slot), slot_count - 1)
+        loads[index].update(scanner_names)
+        loads[index][None] += 1
+
+    def load(index):
+        if not schedule.scanner_names:
+            return loads[index][None]
+        return max(loads[index][name] for name in schedule.scanner_names)
+
+    least_load = min(map(load, range(slot_count)))
+    index = random.choice([
+        index for index in range(slot_count) if load(index) == least_load])
+    slot_start = index * slot
+    slot_length = min(slot, schedule.window - slot_start)
+    jitter = timedelta(seconds=random.uniform(0, slot_length.total_seconds()))
+    return schedule.due_at + slot_start + jitter
+
+
+def run_due_schedules(dbsession, now=None):
+    """
+    Creates the scans of the schedules due to run, and plans their next
+    runs. Returns the IDs of the scans.
+
+    Due schedules are locked, so concurrent schedulers skip them. A run
+    missed by more than an interval is not repeated.
+    """
+    now = now or arrow.now().datetime
+    due = (
+        dbsession.query(ScheduledScan).
+        filter(ScheduledScan.enabled, ScheduledScan.next_run_at <= now).
+        order_by(ScheduledScan.next_run_at).
+        with_for_update(skip_locked=True).
+        all())
+    planner = ScanPlanner(dbsession)
+    scans = []
+    for schedule in due:
+        appstruct = schedule.appstruct
+        scan_class = DeltaScan if appstruct.get('scanners') else SplittingScan
+        try:
+            scan = scan_class.from_appstruct(dbsession, appstruct, planner)
+        except ValueError:
+            logger.warning(
+                'Unable to plan scheduled scan %s', schedule.name,
+                exc_info=True)
+        else:
+            dbsession.add(scan)
+            scans.append(scan)
+            schedule.last_scan = scan
+            schedule.scanner_names = sorted(
+                subscan.scanner.name for subscan in scan.subscans)
+        missed = (now - schedule.due_at) // schedule.interval
+        schedule.due_at += (missed + 1) * schedule.interval
+        schedule.next_run_at = plan_run(dbsession, schedule)
+    dbsession.flush()
+    if due:
+        logger.info(
+            'Started %d of %d scheduled scans', len(scans), len(due))
+    return [scan.id for scan in scans]
+
+
+@colander.deferred
+def deferred_schedule_name_validator(node, kw):
+    schedule_names = kw.get('schedule_names', ())
+    return colander.All(
+        colander.Length(1, 64),
+        colander.Function(
+            lambda name: name not in schedule_names,
+            'Must be different from other schedules'))
+
+
+class ScheduleSchema(ScanSchema):
+    name = colander.SchemaNode(
+        colander.String(), validator=deferred_schedule_name_validator)
+    interval_hours = colander.SchemaNode(
+        colander.Integer(), default=24, validator=colander.Range(min=1),
+        title='Interval (hours)')
+    start_time = colander.SchemaNode(
+        colander.String(), default='00:00', title='Start Time (UTC)',
+        validator=colander.Regex(
+            r'^([01]\d|2[0-3]):[0-5]\d$', 'Must be a time as HH:MM'))
+    window_minutes = colander.SchemaNode(
+        colander.Integer(), default=0, validator=colander.Range(min=0),
+        title='Spread Window (minutes)',
+        description=(
+            'Start each run at a time within this window, avoiding times '
+            'when the same scanners run other scheduled scans.'))
+
+    @classmethod
+    def form(cls, scanner_names, subnets, schedule_names=()):
+        schema = cls().bind(
+            scanner_names=scanner_names, subnets=subnets,
+            schedule_names=schedule_names)
+        return Form(schema, formid='schedule', buttons=('submit',))
+
+
+def next_time_of_day(start_time, now):
+    """Returns the next occurrence of an HH:MM time in UTC."""
+    hour, minute = map(int, start_time.split(':'))
+    now = now.astimezone(timezone.utc)
+    due_at = datetime.combine(now.date(), time(hour, minute), timezone.utc)
+    return due_at if due_at > now else due_at + timedelta(days=1)
+
+
+@view_config(
+    route_name='show_schedules', request_method='GET',
+    renderer='templates/schedules.jinja2')
+def get_schedules(request):
+    response, schedule_form = _schedules_page(request)
+    if schedule_form:
+        response['schedule_form'] = schedule_form.render(
+            {'scan_targets': ('',)})
+    return response
+
+
+@view_config(
+    route_name='show_schedules', request_method='POST',
+    renderer='templates/schedules.jinja2')
+def post_schedule(request):
+    response, schedule_form = _schedules_page(request)
+    if not schedule_form:
+        return response
+    try:
+        appstruct = schedule_form.validate(request.POST.items())
+    except ValidationFailure as e:
+        response['schedule_form'] = e.render()
+        return response
+    schedule = ScheduledScan.create(
+        request.dbsession, name=appstruct['name'],
+        appstruct={
+            key: appstruct[key] for key in SCAN_FIELDS if key in appstruct},
+        interval_minutes=appstruct['interval_hours'] * 60,
+        window_minutes=appstruct['window_minutes'],
+        due_at=next_time_of_day(
+            appstruct['start_time'], arrow.now().datetime))
+    request.dbsession.add(schedule)
+    return HTTPFound(location=request.route_url('show_schedules'))
+
+
+def _schedules_page(request):
+    schedules = (
+        request.dbsession.query(ScheduledScan).
+        order_by(ScheduledScan.next_run_at).
+        all())
+    response = {'schedules': schedules, 'form_title': SCHEDULE_FORM_TITLE}
+    subnets = get_scannable_subnets(request.dbsession)
+    if not subnets:
+        response['error_message'] = NO_KNOWN_SUBNETS_ALERT_MESSAGE
+        return response, None
+    scanner_names = get_scanner_names(request.dbsession)
+    if not scanner_names:
+        response['error_message'] = NO_SCANNERS_ALERT_MESSAGE
+        return response, None
+    schedule_names = {schedule.name for schedule in schedules}
+    return response, ScheduleSchema.form(
+        scanner_names, subnets, schedule_names)
+
+
+@view_config(route_name='delete_schedule', request_method='POST')
+def delete_schedule(request):
+    try:
+        id_ = UUID(request.matchdict['id'])
+    except ValueError:
+        raise HTTPNotFound()
+    schedule = request.dbsession.query(ScheduledScan).get(id_)
+    if not schedule:
+        raise HTTPNotFound()
+    request.dbsession.delete(schedule)
+    return HTTPFound(location=request.route_url('show_schedules'))
@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta, timezone
+
+from pyramid import testing
+from pyramid.httpexceptions import HTTPFound
+import pytest
+
+from .scans import DeltaScan, PING_SWEEP, Scan, SplittingScan
+from .schedules import (
+    delete_schedule, get_schedules, next_time_of_day, post_schedule,
+    run_due_schedules, ScheduledScan, SCHEDULE_SLOT_MINUTES,
+)
+
+MIDNIGHT = datetime(2020, 1, 1, tzinfo=timezone.utc)
+SPLITTING_SCAN = {
+    'nmap_options': PING_SWEEP, 'scanners': {},
+    'scan_targets': ['10.1.0.0/24'], 'known_hosts_only': False,
+}
+DELTA_SCAN = dict(
+    SPLITTING_SCAN,
+    scanners={'scanner_a': 'scanner1', 'scanner_b': 'external'})
+
+
+@pytest.fixture
+def create_schedule(dbsession, fake_wan_scanners, fake_wan_routers):
+    count = 0
+
+    def create_schedule(
+            appstruct=SPLITTING_SCAN, window_minutes=60, due_at=MIDNIGHT):
+        nonlocal count
+        count += 1
+        schedule = ScheduledScan.create(
+            dbsession, name=f'site{count}', appstruct=appstruct,
+            interval_minutes=24 * 60, window_minutes=window_minutes,
+            due_at=due_at)
+        dbsession.add(schedule)
+        dbsession.flush()
+        return schedule
+    return create_schedule
+
+
+def slot(schedule):
+    return (schedule.next_run_at - schedule.due_at) // timedelta(
+        minutes=SCHEDULE_SLOT_MINUTES)
+
+
+def test_schedule_without_window_runs_when_due(create_schedule):
+    schedule = create_schedule(window_minutes=0)
+    assert schedule.next_run_at == MIDNIGHT
+
+
+def test_schedule_runs_within_window(create_schedule):
+    schedule = create_schedule()
+    assert MIDNIGHT <= schedule.next_run_at < MIDNIGHT + timedelta(hours=1)
+
+
+def test_schedules_of_same_scanners_spread_over_window(create_schedule):
+    schedules = [create_schedule(appstruct=DELTA_SCAN) for _ in range(12)]
+    assert sorted(map(slot, schedules)) == list(range(12))
+
+
+def test_schedules_of_other_scanners_share_slots(
+    monkeypatch, create_schedule):
+
+    monkeypatch.setattr(
+        'wanmap.schedules.random.choice', lambda candidates: candidates[0])
+    busy = create_schedule(appstruct=DELTA_SCAN, window_minutes=10)
+    same = create_schedule(appstruct=DELTA_SCAN, window_minutes=10)
+    other = create_schedule(
+        appstruct=dict(
+            DELTA_SCAN,
+            scanners={'scanner_a': 'scanner2', 'scanner_b': 'dmzscanner'}),
+        window_minutes=10)
+    assert (slot(busy), slot(same), slot(other)) == (0, 1, 0)
+
+
+def test_schedule_avoids_busiest_slots(dbsession, create_schedule):
+    busy = create_schedule(appstruct=DELTA_SCAN, window_minutes=10)
+    schedule = create_schedule(appstruct=DELTA_SCAN, window_minutes=10)
+    assert {slot(busy), slot(schedule)} == {0, 1}
+
+
+def test_run_due_schedules_creates_scans(dbsession, create_schedule):
+    splitting = create_schedule(window_minutes=0)
+    delta = create_schedule(appstruct=DELTA_SCAN, window_minutes=0)
+    scan_ids = run_due_schedules(dbsession, now=MIDNIGHT)
+    scans = {
+        scan.id: scan
+        for scan in dbsession.query(Scan).filter(Scan.id.in_(scan_ids))
+    }
+    assert isinstance(scans[splitting.last_scan_id], SplittingScan)
+    assert isinstance(scans[delta.last_scan_id], DeltaScan)
+
+
+def test_run_due_schedules_plans_next_run(dbsession, create_schedule):
+    schedule = create_schedule()
+    run_due_schedules(dbsession, now=MIDNIGHT + timedelta(hours=1))
+    assert schedule.due_at == MIDNIGHT + timedelta(days=1)
+    assert schedule.next_run_at >= schedule.due_at
+    assert schedule.scanner_names == ['scanner1']
+
+
+def test_run_due_schedules_skips_missed_runs(dbsession, create_schedule):
+    schedule = create_schedule(window_minutes=0)
+    run_due_schedules(dbsession, now=MIDNIGHT + timedelta(days=3, hours=1))
+    assert schedule.due_at == MIDNIGHT + timedelta(days=4)
+
+
+def test_run_due_schedules_ignores_future_and_disabled(
+    dbsession, create_schedule):
+
+    create_schedule(due_at=MIDNIGHT + timedelta(days=1))
+    create_schedule(window_minutes=0).enabled = False
+    assert run_due_schedules(dbsession, now=MIDNIGHT) == []
+
+
+def test_run_due_schedules_continues_after_planning_fails(
+    dbsession, create_schedule):
+
+    unscannable = create_schedule(
+        appstruct=dict(SPLITTING_SCAN, scan_targets=['172.16.0.0/24']),
+        window_minutes=0)
+    create_schedule(window_minutes=0)
+    assert len(run_due_schedules(dbsession, now=MIDNIGHT)) == 1
+    assert unscannable.due_at == MIDNIGHT + timedelta(days=1)
+
+
+def test_run_due_schedules_skips_removed_scanners(dbsession, create_schedule):
+    removed = create_schedule(
+        appstruct=dict(
+            DELTA_SCAN,
+            scanners={'scanner_a': 'scanner1', 'scanner_b': 'removed'}),
+        window_minutes=0)
+    assert run_due_schedules(dbsession, now=MIDNIGHT) == []
+    assert removed.due_at == MIDNIGHT + timedelta(days=1)
+
+
+@pytest.mark.parametrize('start_time, expected', [
+    ('02:30', MIDNIGHT + timedelta(hours=2, minutes=30)),
+    ('00:00', MIDNIGHT + timedelta(days=1)),
+])
+def test_next_time_of_day(start_time, expected):
+    assert next_time_of_day(start_time, MIDNIGHT) == expected
+
+
+@pytest.fixture
+def schedules_request(view_request, fake_wan_scanners, fake_wan_routers):
+    with testing.testConfig(request=view_request) as config:
+        view_request.registry = config.registry
+        config.include('wanmap.scans')
+        config.include('wanmap.schedules')
+        yield view_request
+
+
+def test_get_schedules_has_form(schedules_request):
+    response = get_schedules(schedules_request)
+    assert 'id="schedule"' in response['schedule_form']
+
+
+def test_post_schedule_creates_schedule(dbsession, schedules_request):
+    schedules_request.method = 'POST'
+    schedules_request.POST.update([
+        ('name', 'nightly'), ('nmap_options', PING_SWEEP),
+        ('__start__', 'scan_targets:sequence'),
+        ('scan_target', '10.1.0.0/24'),
+        ('__end__', 'scan_targets:sequence'),
+        ('interval_hours', '24'), ('start_time', '01:00'),
+        ('window_minutes', '30'),
+    ])
+    assert isinstance(post_schedule(schedules_request), HTTPFound)
+    schedule = dbsession.query(ScheduledScan).filter_by(name='nightly').one()
+    assert schedule.appstruct['scan_targets'] == ['10.1.0.0/24']
+    assert schedule.next_run_at.astimezone(timezone.utc).hour == 1
+
+
+def test_post_schedule_requires_unique_name(
+    dbsession, create_schedule, schedules_request):
+
+    create_schedule()
+    schedules_request.method = 'POST'
+    schedules_request.POST.update([
+        ('name', 'site1'), ('nmap_options', PING_SWEEP),
+        ('interval_hours', '24'), ('start_time', '01:00'),
+        ('window_minutes', '0'),
+    ])
+    response = post_schedule(schedules_request)
+    assert 'Must be different from other schedules' in (
+        response['schedule_form'])
+
+
+def test_delete_schedule(dbsession, create_schedule, schedules_request):
+    schedule = create_schedule()
+    schedules_request.matchdict['id'] = str(schedule.id)
+    assert isinstance(delete_schedule(schedules_request), HTTPFound)
+    dbsession.flush()
+    assert dbsession.query(ScheduledScan).count() == 0
@@ -0,0 +1,59 @@
+import os
+import sys
+from uuid import UUID
+
+import arrow
+from pyramid.paster import get_appsettings, setup_logging
+from pyramid.scripts.common import parse_vars
+
+from ..export import export_chunks, EXPORT_FORMATS
+from ..schema import get_session_factory
+
+# Export criteria given like settings overrides, as the API's parameters
+EXPORT_VARS = ('since', 'until', 'scans', 'format', 'gzip')
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> <output_file|-> [since=<time>] '
+          '[until=<time>] [scans=<id>,...] [format=%s] [gzip=true] '
+          '[var=value]\n'
+          '(example: "%s development.ini results.csv.gz since=2020-05-01 '
+          'until=2020-06-01 gzip=true")'
+          % (cmd, '|'.join(sorted(EXPORT_FORMATS)), cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 3:
+        usage(argv)
+    config_uri, output_path = argv[1:3]
+    options = parse_vars(argv[3:])
+    export_vars = {
+        key: options.pop(key) for key in EXPORT_VARS if key in options}
+    format_ = export_vars.get('format', 'csv')
+    compress = export_vars.get('gzip', '') not in ('', '0', 'false')
+    try:
+        criteria = {
+            key: arrow.get(export_vars[key]).datetime
+            for key in ('since', 'until') if export_vars.get(key)
+        }
+        if export_vars.get('scans'):
+            criteria['scan_ids'] = [
+                UUID(id_) for id_ in export_vars['scans'].split(',')]
+    except (arrow.parser.ParserError, ValueError):
+        usage(argv)
+    if format_ not in EXPORT_FORMATS:
+        usage(argv)
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, name='wanmap', options=options)
+    session_factory = get_session_factory(settings)
+    chunks = export_chunks(session_factory, format_, compress, **criteria)
+    to_stdout = output_path == '-'
+    output = sys.stdout.buffer if to_stdout else open(output_path, 'wb')
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if not to_stdout:
+            output.close()
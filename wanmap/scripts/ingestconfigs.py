@@ -0,0 +1,31 @@
+import os
+import sys
+
+from pyramid.paster import get_appsettings, setup_logging
+from pyramid.scripts.common import parse_vars
+import transaction
+
+from ..configs import ingest_configs
+from ..network import persist_routers
+from ..schema import get_session_factory, get_tm_session
+
+
+def usage(argv):
+    cmd = os.path.basename(argv[0])
+    print('usage: %s <config_uri> <router_config_dir> [var=value]\n'
+          '(example: "%s development.ini /var/backups/routers")' % (cmd, cmd))
+    sys.exit(1)
+
+
+def main(argv=sys.argv):
+    if len(argv) < 3:
+        usage(argv)
+    config_uri, config_dir = argv[1:3]
+    options = parse_vars(argv[3:])
+    setup_logging(config_uri)
+    settings = get_appsettings(config_uri, name='wanmap', options=options)
+    routers = ingest_configs(config_dir)
+    session_factory = get_session_factory(settings)
+    with transaction.manager:
+        dbsession = get_tm_session(session_factory, transaction.manager)
+        persist_routers(dbsession, routers)
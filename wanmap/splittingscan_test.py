@@ -1,5 +1,9 @@
+from ipaddress import ip_interface
+
 import pytest
 
+from .network import Router, RouterKnownHost
+from .scanners import Scanner
 from .scans import SplittingScan, PING_SWEEP
 
 
@@ -33,14 +37,36 @@ def test_splitting_scan_finds_subnets_across_multiple_scanners(
     assert subscan_targets == scanner_subnets
 
 
-@pytest.mark.xfail(reason='Need multiple scanners adjacent to one router')
-def test_splitting_scan_picks_one_scanner_when_multiple_matches():
-    assert False
+def test_splitting_scan_picks_one_scanner_when_multiple_matches(
+    dbsession, fake_wan_scanners, fake_wan_routers):
+
+    dbsession.add(Scanner.create('scanner3', '10.1.0.253/24'))
+    scan = SplittingScan.create(
+        session=dbsession, parameters=PING_SWEEP,
+        targets=('10.1.0.0/24',))
+    assert [subscan.scanner.name for subscan in scan.subscans] == [
+        'scanner1']
 
 
-@pytest.mark.xfail(reason='Needs latency mapping of the network.')
-def test_splitting_scan_picks_a_close_scanner_when_none_directly_connected():
-    assert False
+def test_splitting_scan_picks_a_close_scanner_when_none_directly_connected(
+    dbsession, fake_wan_scanners, fake_wan_routers):
+
+    r1 = fake_wan_routers[1]
+    # Linked to the branch router only by LLDP, two hops from scanner1.
+    r2 = Router.create(
+        'r2', (ip_interface('10.3.0.1/24'),), neighbors=(str(r1.hostname),))
+    dbsession.add(r2)
+    scan = SplittingScan.create(
+        session=dbsession, parameters=PING_SWEEP,
+        targets=('10.1.0.0/24', '10.3.0.0/24'))
+    subscan_targets = {
+        subscan.scanner.name: {target.target for target in subscan.targets}
+        for subscan in scan.subscans
+    }
+    assert subscan_targets == {
+        'scanner1': {'10.1.0.0/24'},
+        'scanner2': {'10.3.0.0/24'},
+    }
 
 
 @pytest.mark.xfail(reason='Needs example in Fake WAN')
@@ -56,7 +82,7 @@ def test_create_splitting_scan_errors_on_no_targets(dbsession):
 
 
 def test_create_splitting_scan_errors_on_no_subnet_matches(dbsession):
-    with pytest.raises(Exception):
+    with pytest.raises(ValueError, match='No scanners can reach'):
         SplittingScan.create(
             session=dbsession, parameters=PING_SWEEP,
             targets=('0.0.0.0/0',))
@@ -74,3 +100,32 @@ def test_create_splitting_host_match(
         for target in subscan.targets
     }
     assert subscan_targets == {'10.1.0.1/32'}
+
+
+def test_splitting_scan_known_hosts_only_targets_live_hosts(
+    dbsession, fake_wan_scanners, fake_wan_routers):
+
+    r0 = fake_wan_routers[0]
+    r0._known_hosts += [
+        RouterKnownHost(address=ip_interface('10.1.0.7')),
+        RouterKnownHost(address=ip_interface('10.1.32.9')),
+    ]
+    dbsession.flush()
+    scan = SplittingScan.create(
+        session=dbsession, parameters=PING_SWEEP,
+        targets=('10.1.0.0/19',), known_hosts_only=True)
+    subscan_targets = {
+        target.target
+        for subscan in scan.subscans
+        for target in subscan.targets
+    }
+    assert subscan_targets == {'10.1.0.7/32'}
+
+
+def test_splitting_scan_known_hosts_only_errors_without_known_hosts(
+    dbsession, fake_wan_scanners, fake_wan_routers):
+
+    with pytest.raises(ValueError, match='Rediscover the network'):
+        SplittingScan.create(
+            session=dbsession, parameters=PING_SWEEP,
+            targets=('10.1.0.0/19',), known_hosts_only=True)
@@ -1,7 +1,10 @@
+from contextlib import contextmanager
 import ipaddress
+from itertools import islice
 import os.path
 import re
-from subprocess import check_output
+import resource
+from subprocess import CalledProcessError, check_output, PIPE, Popen
 
 import arrow
 from celery import Celery
@@ -11,10 +14,29 @@ from celery.utils.log import get_task_logger
 from pyramid.paster import get_appsettings, setup_logging
 from pyramid_transactional_celery import TransactionalTask
 
+from .changes import record_host_changes
+from .deltas import diff_delta_scan
+from .executions import (
+    claim_executions, finish_execution, get_waiting_scanner_names,
+    is_outstanding, queue_execution, requeue_executions,
+)
+from .events import (
+    DEFAULT_REDIS_URL, get_redis, publish_scan_event_after_commit,
+)
+from .history import record_host_history
+from .ports import shard_port_options
+from .ratelimit import limit_link_rate
+from .results import parse_host_stream
+from .schedules import run_due_schedules
+from .timing import auto_timing_options, record_segment_timing
+from .topology import get_topology
 from .scanners import Scanner
-from .scans import Scan, Subscan
+from .scans import (
+    DeltaScan, PING_SWEEP, Scan, scan_status_event, Subscan,
+    subscan_hosts_event,
+)
 
-__all__ = ['scan_workflow']
+__all__ = ['scan_workflow', 'scan_workflows']
 
 Background = Celery()
 Background.config_from_object('wanmap.celeryconfig')
@@ -22,6 +44,11 @@ Background.config_from_object('wanmap.celeryconfig')
 SUDO = '/usr/bin/sudo'
 NMAP = '/usr/bin/nmap'
 NMAP_OUTPUT_OPTIONS = '-oX -'.split()
+# Live hosts found by discovery are port scanned in batches of this many.
+DISCOVERY_BATCH_SIZE = 256
+# Resources each nmap process is allowed when sizing scanner slots
+NMAP_MEMORY_BYTES = 256 * 2 ** 20
+NMAP_FILE_DESCRIPTORS = 256
 
 _logger = get_task_logger(__name__)
 
@@ -52,49 +79,311 @@ def _init(signal, sender, **kwargs):
     setup_logging(settings_path)
     settings = get_appsettings(settings_path, name='wanmap')
     app.dbsession_factory = schema.get_session_factory(settings)
+    app.redis_url = settings.get('wanmap.redis_url', DEFAULT_REDIS_URL)
 
 
 # TODO: Make a group/chord out of launching subscans
 @Background.task(base=PersistenceTask, bind=True)
 def scan_workflow(self, scan_id):
+    dispatch_scan(self.dbsession, scan_id)
+
+
+@Background.task(base=PersistenceTask, bind=True)
+def scan_workflows(self, scan_ids):
+    """Dispatches a batch of scans submitted together."""
+    for scan_id in scan_ids:
+        dispatch_scan(self.dbsession, scan_id)
+
+
+@Background.task(base=PersistenceTask, bind=True)
+def run_scheduled_scans(self):
+    """Starts the scheduled scans that are due, every minute by beat."""
+    scan_ids = run_due_schedules(self.dbsession)
+    if scan_ids:
+        scan_workflows.delay(scan_ids)
+
+
+def dispatch_scan(dbsession, scan_id):
     _logger.info('Dispatching Scan: {}'.format(scan_id))
-    scan = self.dbsession.query(Scan).get(scan_id)
-    nmap_options = scan.parameters.split(' ')
+    scan = dbsession.query(Scan).get(scan_id)
+    scan_options = scan.parameters.split(' ')
+    topology = get_topology(dbsession)
     for subscan in scan.subscans:
+        if subscan.is_cached:
+            # Served entirely from recent results when planned.
+            publish_scan_event_after_commit(
+                scan_id, *subscan_hosts_event(subscan))
+            record_subscan_hosts(dbsession, subscan)
+            continue
         # TODO: Serialize ipaddress types?
-        subscan_targets = [str(target.target) for target in subscan.targets]
+        subscan_targets = list(map(str, subscan.scanned_targets))
         scanner_name = subscan.scanner.name
-        subscan_key = (scan_id, scanner_name)
-        exec_nmap_scan.delay(subscan_key, nmap_options, subscan_targets)
+        subscan_key = [str(subscan.scan_id), scanner_name]
+        nmap_options = list(scan_options)
+        if scan.auto_timing:
+            timing_options = auto_timing_options(
+                dbsession, scanner_name, subscan_targets)
+            subscan.timing_options = ' '.join(timing_options) or None
+            nmap_options += timing_options
+        shard_options = shard_port_options(nmap_options, scan.port_shards)
+        links = sorted(
+            get_scan_links(topology, scanner_name, subscan_targets))
+        if scan.discover_first:
+            queue_execution(
+                dbsession, subscan_key, 'exec_discovery_scan',
+                [subscan_key, nmap_options, subscan_targets,
+                 scan.port_shards],
+                {'links': links})
+        elif len(shard_options) > 1:
+            subscan.batch_count = len(shard_options)
+            for index, options in enumerate(shard_options):
+                queue_execution(
+                    dbsession, subscan_key, 'exec_nmap_scan',
+                    [subscan_key, options, subscan_targets],
+                    {'batch': True, 'mark_started': index == 0,
+                     'links': links})
+        else:
+            queue_execution(
+                dbsession, subscan_key, 'exec_nmap_scan',
+                [subscan_key, nmap_options, subscan_targets],
+                {'links': links})
+    send_executions(
+        dbsession, {subscan.scanner_name for subscan in scan.subscans})
+
+
+def send_executions(dbsession, scanner_names):
+    """Sends the queued scanner tasks that fit the scanners' free slots."""
+    tasks = {
+        'exec_nmap_scan': exec_nmap_scan,
+        'exec_discovery_scan': exec_discovery_scan,
+    }
+    for execution in claim_executions(dbsession, scanner_names):
+        tasks[execution.task].delay(
+            *execution.args, execution_id=str(execution.id),
+            **execution.kwargs)
+
+
+@Background.task(base=PersistenceTask, bind=True)
+def send_queued_executions(self):
+    """
+    Sends queued scanner tasks, every minute by beat, in case a transaction
+    that freed their slots failed to send them.
+    """
+    send_executions(self.dbsession, get_waiting_scanner_names(self.dbsession))
+
+
+def free_slot(dbsession, execution_id):
+    """
+    Frees a finished task's slot for the next queued task. Returns whether
+    the task's report should be recorded, which it should not if the task
+    was queued again after it was lost.
+    """
+    if not execution_id:
+        return True
+    scanner_name = finish_execution(dbsession, execution_id)
+    if not scanner_name:
+        _logger.warning('Ignoring report of requeued task %s', execution_id)
+        return False
+    send_executions(dbsession, [scanner_name])
+    return True
+
+
+@contextmanager
+def releasing_slot(execution_id):
+    """Frees the slot of a scanner task that fails."""
+    try:
+        yield
+    except Exception:
+        if execution_id:
+            import transaction
+            with transaction.manager:
+                release_slot.delay(execution_id)
+        raise
+
+
+@Background.task(base=PersistenceTask, bind=True)
+def release_slot(self, execution_id):
+    free_slot(self.dbsession, execution_id)
+
+
+def get_scan_links(topology, scanner_name, targets):
+    """The routers whose WAN links a scanner's scan of targets crosses."""
+    if scanner_name not in topology.scanner_names:
+        return set()
+    return topology.routers_toward(
+        scanner_name, set(map(ipaddress.ip_network, targets)))
 
 
 @Background.task(base=TransactionalTask)
-def exec_nmap_scan(subscan_key, nmap_options, targets):
-    started_at = arrow.now().datetime
+def exec_nmap_scan(
+        subscan_key, nmap_options, targets, batch=False, mark_started=True,
+        links=(), execution_id=None):
     import transaction
-    with transaction.manager:
-        mark_subscan_started.delay(subscan_key, started_at)
-    nmap_options, targets = list(nmap_options), list(targets)
-    nmap_command = [SUDO, NMAP] + NMAP_OUTPUT_OPTIONS + nmap_options + targets
-    _logger.info('Executing {!r}'.format(' '.join(nmap_command)))
-    finished_at = arrow.now().datetime
-    results_xml = check_output(nmap_command, universal_newlines=True)
+    with releasing_slot(execution_id), limit_link_rate(
+            get_link_rate_client(), links, nmap_options,
+            _logger) as nmap_options:
+        started_at = arrow.now().datetime
+        if mark_started:
+            with transaction.manager:
+                mark_subscan_started.delay(subscan_key, started_at)
+        targets = list(targets)
+        nmap_command = (
+            [SUDO, NMAP] + NMAP_OUTPUT_OPTIONS + nmap_options + targets)
+        _logger.info('Executing {!r}'.format(' '.join(nmap_command)))
+        finished_at = arrow.now().datetime
+        results_xml = check_output(nmap_command, universal_newlines=True)
     duration = (started_at, finished_at)
     with transaction.manager:
-        record_subscan_results.delay(subscan_key, results_xml, duration)
+        record_results = (
+            record_subscan_batch if batch else record_subscan_results)
+        record_results.delay(
+            subscan_key, results_xml, duration, execution_id=execution_id)
+
+
+@Background.task(base=TransactionalTask)
+def exec_discovery_scan(
+        subscan_key, nmap_options, targets, port_shards=1, links=(),
+        execution_id=None):
+    """
+    Sweeps the targets for live hosts, and port scans the hosts in batches
+    on this scanner while the sweep continues. Each batch of hosts is port
+    scanned by a batch per port shard.
+    """
+    import transaction
+    # Hosts are known to be up, so batches skip discovering them again.
+    nmap_options = list(nmap_options)
+    if '-Pn' not in nmap_options:
+        nmap_options.append('-Pn')
+    shard_options = shard_port_options(nmap_options, port_shards)
+    batch_count = 0
+    with releasing_slot(execution_id), limit_link_rate(
+            get_link_rate_client(), links, PING_SWEEP.split(),
+            _logger) as sweep_options:
+        with transaction.manager:
+            mark_subscan_started.delay(subscan_key, arrow.now().datetime)
+        sweep_command = (
+            [SUDO, NMAP] + NMAP_OUTPUT_OPTIONS + sweep_options +
+            list(targets))
+        _logger.info('Executing {!r}'.format(' '.join(sweep_command)))
+        with Popen(
+                sweep_command, stdout=PIPE,
+                universal_newlines=True) as sweep:
+            hosts = parse_host_stream(sweep.stdout)
+            for batch in batch_live_addresses(hosts, DISCOVERY_BATCH_SIZE):
+                with transaction.manager:
+                    queue_discovery_batch.delay(
+                        subscan_key, shard_options, batch, links,
+                        execution_id=execution_id)
+                batch_count += len(shard_options)
+        if sweep.returncode:
+            raise CalledProcessError(sweep.returncode, sweep_command)
+    with transaction.manager:
+        record_discovery_finished.delay(
+            subscan_key, batch_count, arrow.now().datetime,
+            execution_id=execution_id)
+
+
+@Background.task(base=PersistenceTask, bind=True)
+def queue_discovery_batch(
+        self, subscan_key, shard_options, targets, links,
+        execution_id=None):
+    """Queues the port scans of hosts found by discovery for slots."""
+    if execution_id and not is_outstanding(self.dbsession, execution_id):
+        _logger.warning('Ignoring batch of requeued task %s', execution_id)
+        return
+    for options in shard_options:
+        queue_execution(
+            self.dbsession, subscan_key, 'exec_nmap_scan',
+            [subscan_key, options, targets],
+            {'batch': True, 'mark_started': False, 'links': links})
+    send_executions(self.dbsession, [subscan_key[1]])
+
+
+def get_link_rate_client():
+    """Connects to the broker's Redis, which scanners share."""
+    app = app_or_default()
+    url = app.conf.broker_url or ''
+    if not url.startswith('redis://'):
+        url = getattr(app, 'redis_url', DEFAULT_REDIS_URL)
+    return get_redis(url)
+
+
+def batch_live_addresses(hosts, batch_size):
+    """Groups the addresses of responsive hosts into lists, as found."""
+    addresses = (
+        host.address for host in hosts
+        if host.address and host.status == 'up')
+    while True:
+        batch = list(islice(addresses, batch_size))
+        if not batch:
+            return
+        yield batch
 
 
 @Background.task(base=PersistenceTask, bind=True)
 def mark_subscan_started(self, subscan_key, started_at):
     subscan = self.dbsession.query(Subscan).get(subscan_key)
-    subscan.started_at = started_at
+    subscan.start(started_at)
+    # Flush to read back the atomically updated scan status.
+    self.dbsession.flush()
+    publish_scan_event_after_commit(
+        subscan.scan_id, *scan_status_event(subscan.scan))
 
 
 # Need a transaction for each subscan. Scans can be written incrementally.
 @Background.task(base=PersistenceTask, bind=True)
-def record_subscan_results(self, subscan_key, subscan_result, duration):
+def record_subscan_results(
+        self, subscan_key, subscan_result, duration, execution_id=None):
+    if not free_slot(self.dbsession, execution_id):
+        return
     subscan = self.dbsession.query(Subscan).get(subscan_key)
     subscan.complete(subscan_result, duration)
+    self.dbsession.flush()
+    publish_scan_event_after_commit(
+        subscan.scan_id, *subscan_hosts_event(subscan))
+    record_subscan_hosts(self.dbsession, subscan)
+
+
+# Batches and the end of discovery lock the subscan to count batches.
+@Background.task(base=PersistenceTask, bind=True)
+def record_subscan_batch(
+        self, subscan_key, batch_result, duration, execution_id=None):
+    if not free_slot(self.dbsession, execution_id):
+        return
+    subscan = (
+        self.dbsession.query(Subscan).with_for_update().get(subscan_key))
+    hosts = subscan.add_batch(batch_result, duration)
+    self.dbsession.flush()
+    publish_scan_event_after_commit(
+        subscan.scan_id, *subscan_hosts_event(subscan, hosts))
+    if subscan.finished_at:
+        record_subscan_hosts(self.dbsession, subscan)
+
+
+@Background.task(base=PersistenceTask, bind=True)
+def record_discovery_finished(
+        self, subscan_key, batch_count, finished_at, execution_id=None):
+    if not free_slot(self.dbsession, execution_id):
+        return
+    subscan = (
+        self.dbsession.query(Subscan).with_for_update().get(subscan_key))
+    subscan.finish_discovery(batch_count, finished_at)
+    self.dbsession.flush()
+    if subscan.finished_at:
+        record_subscan_hosts(self.dbsession, subscan)
+
+
+def record_subscan_hosts(dbsession, subscan):
+    """Indexes the hosts of a completed subscan."""
+    record_host_changes(dbsession, subscan)
+    record_host_history(dbsession, subscan)
+    record_segment_timing(dbsession, subscan)
+    scan = subscan.scan
+    # The last subscan to complete sees the others' committed results.
+    if isinstance(scan, DeltaScan) and scan.status == Scan.States.COMPLETED:
+        diff_delta_scan(dbsession, scan)
+    publish_scan_event_after_commit(
+        subscan.scan_id, *scan_status_event(subscan.scan))
 
 
 def get_scanner_interfaces():
@@ -119,10 +408,47 @@ def register_scanner(sender, instance, **kwargs):
         import transaction
         with transaction.manager:
             interfaces = get_scanner_interfaces()
-            persist_scanner.delay(name, interfaces)
+            persist_scanner.delay(name, interfaces, get_scanner_slots())
+
+
+def get_scanner_slots():
+    """
+    Sizes how many nmap processes this scanner runs at once, by its CPUs,
+    available memory, and the file descriptor limit shared by nmap's raw
+    and connect sockets.
+    """
+    limits = [os.cpu_count() or 1]
+    memory = get_available_memory()
+    if memory:
+        limits.append(memory // NMAP_MEMORY_BYTES)
+    file_descriptors, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if file_descriptors != resource.RLIM_INFINITY:
+        limits.append(file_descriptors // NMAP_FILE_DESCRIPTORS)
+    return max(1, min(limits))
+
+
+def get_available_memory():
+    """Returns the bytes of memory available to new processes, if known."""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
 
 
 @Background.task(base=PersistenceTask, bind=True)
-def persist_scanner(self, name, interfaces):
-    scanner = Scanner.create(name=name, interface_address=interfaces[0])
+def persist_scanner(self, name, interfaces, slots=1):
+    scanner = Scanner.create(
+        name=name, interface_address=interfaces[0], slots=slots)
     self.dbsession.merge(scanner)
+    # Tasks in flight are lost when a scanner restarts, as they are acked
+    # early. Those the broker still holds run too, but are not recorded.
+    # Queued tasks may fit the reported slots.
+    requeued = requeue_executions(self.dbsession, name)
+    if requeued:
+        _logger.warning(
+            'Requeued %d tasks lost by restarted scanner %s', requeued, name)
+    send_executions(self.dbsession, [name])
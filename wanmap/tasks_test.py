@@ -3,8 +3,13 @@ from unittest.mock import Mock, patch
 import pytest
 from sqlalchemy.orm import Session
 
+from .executions import claim_executions, queue_execution, requeue_executions
+from .results import Host
 from .scanners import Scanner
-from .tasks import PersistenceTask
+from .tasks import (
+    batch_live_addresses, free_slot, get_scanner_slots,
+    NMAP_FILE_DESCRIPTORS, NMAP_MEMORY_BYTES, PersistenceTask,
+)
 
 
 def test_persistence_task_passes_initialized_dbsession(
@@ -83,3 +88,43 @@ def test_persistence_task_on_error_closes_session_with_work(
         pytest.raises(Exception):
         db_task()
     assert close.called
+
+
+def test_batch_live_addresses_skips_down_hosts():
+    hosts = [
+        Host(f'10.1.0.{number}', 'up' if number % 2 else 'down', None, ())
+        for number in range(1, 8)
+    ]
+    assert list(batch_live_addresses(hosts, 3)) == [
+        ['10.1.0.1', '10.1.0.3', '10.1.0.5'], ['10.1.0.7']]
+
+
+@pytest.mark.parametrize('cpus, memory, file_descriptors, expected', [
+    (8, 64 * NMAP_MEMORY_BYTES, 64 * NMAP_FILE_DESCRIPTORS, 8),
+    (8, 3 * NMAP_MEMORY_BYTES, 64 * NMAP_FILE_DESCRIPTORS, 3),
+    (8, 64 * NMAP_MEMORY_BYTES, 4 * NMAP_FILE_DESCRIPTORS, 4),
+    (8, NMAP_MEMORY_BYTES // 2, 64 * NMAP_FILE_DESCRIPTORS, 1),
+    (2, None, 64 * NMAP_FILE_DESCRIPTORS, 2),
+])
+def test_get_scanner_slots_fits_scarcest_resource(
+        monkeypatch, cpus, memory, file_descriptors, expected):
+    monkeypatch.setattr('os.cpu_count', lambda: cpus)
+    monkeypatch.setattr(
+        'wanmap.tasks.get_available_memory', lambda: memory)
+    monkeypatch.setattr(
+        'resource.getrlimit', lambda limit: (file_descriptors, -1))
+    assert get_scanner_slots() == expected
+
+
+def test_free_slot_ignores_reports_of_requeued_tasks(dbsession, create_scan):
+    scan = create_scan()
+    subscan_key = [str(scan.id), 'scanner1']
+    execution = queue_execution(
+        dbsession, subscan_key, 'exec_nmap_scan',
+        [subscan_key, ['-sn'], ['10.1.0.0/24']])
+    claim_executions(dbsession, ['scanner1'])
+    lost_id = str(execution.id)
+    requeue_executions(dbsession, 'scanner1')
+    dbsession.flush()
+    assert free_slot(dbsession, None)
+    assert not free_slot(dbsession, lost_id)
@@ -0,0 +1,122 @@
+"""Round trip times of network segments, for choosing nmap timing."""
+
+from sqlalchemy import (
+    Column, DateTime, func, Integer, literal, or_, select, String,
+)
+from sqlalchemy.dialects import postgresql
+
+from .network import RouterInterface
+from .scans import SubscanHost
+from .schema import Persistable
+
+# Weight of the latest subscan in the smoothed times of a segment
+TIMING_SMOOTHING = 0.3
+# Bounds of the chosen --initial-rtt-timeout, in milliseconds
+MIN_INITIAL_RTT_TIMEOUT = 50
+MAX_INITIAL_RTT_TIMEOUT = 3000
+# (Slowest smoothed RTT in milliseconds, --min-rate, --max-retries), from
+# fast LAN segments to slow WAN links. Slow links get no minimum rate.
+TIMING_TIERS = (
+    (5, 1000, 2),
+    (50, 200, 4),
+    (None, None, 6),
+)
+
+
+class SegmentTiming(Persistable):
+    """
+    The smoothed round trip times of the hosts a scanner found on a
+    scannable subnet, in microseconds as reported by nmap.
+    """
+
+    __tablename__ = 'segment_timings'
+    scanner_name = Column(String(64), primary_key=True)
+    subnet = Column(postgresql.CIDR, primary_key=True)
+    host_count = Column(Integer, nullable=False)
+    srtt = Column(Integer, nullable=False)
+    rttvar = Column(Integer, nullable=False)
+    measured_at = Column(DateTime(timezone=True), nullable=False)
+
+
+def record_segment_timing(dbsession, subscan):
+    """
+    Folds the round trip times of a completed subscan's hosts into the
+    times of their subnets, in one statement. Results older than the
+    recorded times are ignored.
+    """
+    timings, hosts = SegmentTiming.__table__, SubscanHost.__table__
+    subnets = select([
+        func.network(RouterInterface.address).label('subnet'),
+    ]).distinct().alias('subnets')
+    samples = select([
+        literal(subscan.scanner_name), subnets.c.subnet, func.count(),
+        func.round(func.avg(hosts.c.srtt)),
+        func.round(func.avg(hosts.c.rttvar)),
+        literal(subscan.finished_at),
+    ]).where(
+        (hosts.c.scan_id == subscan.scan_id) &
+        (hosts.c.scanner_name == subscan.scanner_name) &
+        hosts.c.cached_scan_id.is_(None) &
+        hosts.c.srtt.isnot(None) &
+        hosts.c.address.op('<<=')(subnets.c.subnet)
+    ).group_by(subnets.c.subnet)
+    insert = postgresql.insert(timings).from_select(
+        ('scanner_name', 'subnet', 'host_count', 'srtt', 'rttvar',
+         'measured_at'),
+        samples)
+    insert = insert.on_conflict_do_update(
+        index_elements=('scanner_name', 'subnet'),
+        set_={
+            'host_count': insert.excluded.host_count,
+            'srtt': _smooth(timings.c.srtt, insert.excluded.srtt),
+            'rttvar': _smooth(timings.c.rttvar, insert.excluded.rttvar),
+            'measured_at': insert.excluded.measured_at,
+        },
+        where=timings.c.measured_at <= insert.excluded.measured_at)
+    dbsession.execute(insert)
+
+
+def _smooth(recorded, latest):
+    return func.round(
+        recorded * (1 - TIMING_SMOOTHING) + latest * TIMING_SMOOTHING)
+
+
+def auto_timing_options(dbsession, scanner_name, targets):
+    """
+    Chooses nmap timing options for a scanner's targets from the slowest
+    subnet they overlap, or none if the subnets were never timed.
+    """
+    if not targets:
+        return []
+    srtt, rttvar = (
+        dbsession.query(
+            func.max(SegmentTiming.srtt), func.max(SegmentTiming.rttvar)).
+        filter(
+            SegmentTiming.scanner_name == scanner_name,
+            or_(*(
+                SegmentTiming.subnet.op('&&')(str(target))
+                for target in targets))).
+        one())
+    if srtt is None:
+        return []
+    return timing_options(srtt, rttvar)
+
+
+def timing_options(srtt, rttvar):
+    """Returns nmap timing options for round trip times in microseconds."""
+    srtt_ms = srtt / 1000
+    initial_rtt_timeout = round((srtt + 4 * rttvar) / 1000)
+    initial_rtt_timeout = min(
+        max(initial_rtt_timeout, MIN_INITIAL_RTT_TIMEOUT),
+        MAX_INITIAL_RTT_TIMEOUT)
+    for max_srtt_ms, min_rate, max_retries in TIMING_TIERS:
+        if max_srtt_ms is None or srtt_ms <= max_srtt_ms:
+            break
+    options = []
+    if min_rate:
+        options += ['--min-rate', str(min_rate)]
+    options += [
+        '--max-retries', str(max_retries),
+        '--initial-rtt-timeout', f'{initial_rtt_timeout}ms',
+    ]
+    return options
@@ -0,0 +1,65 @@
+from ipaddress import ip_network
+
+import pytest
+
+from .timing import (
+    auto_timing_options, record_segment_timing, SegmentTiming,
+    timing_options,
+)
+
+
+@pytest.fixture
+def timed_scan(dbsession, scan_results, result_xml):
+    def timed_scan(*times):
+        """Scans a host per (srtt, rttvar) in microseconds."""
+        scan = scan_results(result_xml(*(
+            (f'10.1.0.{index}', 'up', {}, host_times)
+            for index, host_times in enumerate(times, 1))))
+        for subscan in scan.subscans:
+            record_segment_timing(dbsession, subscan)
+        return scan
+    return timed_scan
+
+
+def test_record_segment_timing_averages_hosts(dbsession, timed_scan):
+    timed_scan((1000, 200), (3000, 400))
+    timing, = dbsession.query(SegmentTiming)
+    assert timing.scanner_name == 'scanner1'
+    assert ip_network(timing.subnet).overlaps(ip_network('10.1.0.0/24'))
+    assert (timing.host_count, timing.srtt, timing.rttvar) == (2, 2000, 300)
+
+
+def test_record_segment_timing_smooths_later_scans(dbsession, timed_scan):
+    timed_scan((1000, 100))
+    timed_scan((11000, 100))
+    timing, = dbsession.query(SegmentTiming)
+    assert timing.srtt == 4000
+
+
+def test_auto_timing_without_history_adds_no_options(
+    dbsession, fake_wan_scanners):
+
+    assert auto_timing_options(dbsession, 'scanner1', ['10.1.0.0/24']) == []
+
+
+def test_auto_timing_uses_scanner_history(dbsession, timed_scan):
+    timed_scan((1000, 200))
+    assert auto_timing_options(dbsession, 'scanner1', ['10.1.0.0/25']) == (
+        timing_options(1000, 200))
+    assert auto_timing_options(dbsession, 'scanner2', ['10.1.0.0/25']) == []
+
+
+@pytest.mark.parametrize('srtt, rttvar, expected', [
+    (1000, 200, [
+        '--min-rate', '1000', '--max-retries', '2',
+        '--initial-rtt-timeout', '50ms']),
+    (30000, 5000, [
+        '--min-rate', '200', '--max-retries', '4',
+        '--initial-rtt-timeout', '50ms']),
+    (300000, 100000, [
+        '--max-retries', '6', '--initial-rtt-timeout', '700ms']),
+    (2000000, 1000000, [
+        '--max-retries', '6', '--initial-rtt-timeout', '3000ms']),
+])
+def test_timing_options_by_round_trip_time(srtt, rttvar, expected):
+    assert timing_options(srtt, rttvar) == expected
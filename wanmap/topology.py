@@ -0,0 +1,178 @@
+from collections import defaultdict, deque
+import logging
+import threading
+
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+
+from .network import Router
+from .scanners import Scanner
+from .util import intersect_network_sets
+
+logger = logging.getLogger(__name__)
+
+_cache_lock = threading.Lock()
+_cached_topology = None
+
+
+class Topology:
+    """
+    An in-memory graph of discovered routers and the scanners beside them.
+
+    Routers are adjacent when either reports the other as an LLDP neighbor,
+    or when they share a connected subnet, which also links routers loaded
+    from offline configurations. Hop counts from each scanner are computed
+    on first use and kept for the life of the topology.
+    """
+
+    def __init__(self, router_subnets, router_neighbors, scanner_interfaces):
+        self.router_subnets = {
+            hostname: frozenset(subnets)
+            for hostname, subnets in router_subnets.items()
+        }
+        self._adjacency = _build_adjacency(
+            self.router_subnets, router_neighbors)
+        self._scanner_routers = {
+            name: frozenset(
+                hostname
+                for hostname, subnets in self.router_subnets.items()
+                if any(interface in subnet for subnet in subnets))
+            for name, interface in scanner_interfaces.items()
+        }
+        self._hops = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, dbsession):
+        routers = (
+            dbsession.query(Router).
+            options(
+                selectinload('_interfaces'), selectinload('_neighbors')).
+            all())
+        scanners = dbsession.query(Scanner.name, Scanner.interface)
+        return cls(
+            {router.hostname: router.connected_subnets for router in routers},
+            {router.hostname: router.neighbors for router in routers},
+            {name: interface.ip for name, interface in scanners})
+
+    @property
+    def scanner_names(self):
+        return frozenset(self._scanner_routers)
+
+    def hops_from_scanner(self, scanner_name):
+        """Maps each reachable router to its hop count from the scanner."""
+        with self._lock:
+            hops = self._hops.get(scanner_name)
+            if hops is None:
+                hops = _breadth_first_hops(
+                    self._scanner_routers[scanner_name], self._adjacency)
+                self._hops[scanner_name] = hops
+        return hops
+
+    def nearest_scanner(self, router_hostname):
+        """The scanner fewest hops from a router, or None if unreachable."""
+        distances = (
+            (self.hops_from_scanner(name).get(router_hostname), name)
+            for name in sorted(self.scanner_names)
+        )
+        reachable = [
+            (hops, name) for hops, name in distances if hops is not None]
+        return min(reachable)[1] if reachable else None
+
+    def routers_toward(self, scanner_name, targets):
+        """
+        Finds the routers beyond a scanner's own on shortest paths to the
+        targets, whose WAN links scans of the targets cross.
+        """
+        hops = self.hops_from_scanner(scanner_name)
+        routers = set()
+        for hostname, subnets in self.router_subnets.items():
+            if hostname not in hops:
+                continue
+            if not intersect_network_sets(targets, subnets):
+                continue
+            while hops[hostname] > 0:
+                routers.add(hostname)
+                hostname = min(
+                    neighbor for neighbor in self._adjacency[hostname]
+                    if hops.get(neighbor) == hops[hostname] - 1)
+        return routers
+
+    def assign_targets(self, scan_targets):
+        """
+        Maps scanner names to the target subnets nearest to them.
+
+        Targets are split by the connected subnets of each router, then each
+        router's share is planned on its nearest scanner. Targets on routers
+        that no scanner can reach are omitted.
+        """
+        assignments = defaultdict(set)
+        for hostname, subnets in self.router_subnets.items():
+            matched_targets = intersect_network_sets(scan_targets, subnets)
+            if not matched_targets:
+                continue
+            scanner_name = self.nearest_scanner(hostname)
+            if scanner_name is None:
+                logger.warning('No scanner can reach router %s', hostname)
+                continue
+            assignments[scanner_name] |= matched_targets
+        return dict(assignments)
+
+
+def get_topology(dbsession):
+    """
+    Returns the current topology, rebuilding it only after rediscovery.
+
+    The cache is keyed by the newest router collection time, the router
+    count, and the registered scanners.
+    """
+    global _cached_topology
+    version = _get_topology_version(dbsession)
+    with _cache_lock:
+        if _cached_topology and _cached_topology[0] == version:
+            return _cached_topology[1]
+    topology = Topology.load(dbsession)
+    with _cache_lock:
+        _cached_topology = version, topology
+    logger.info(
+        'Loaded topology of %d routers and %d scanners',
+        len(topology.router_subnets), len(topology.scanner_names))
+    return topology
+
+
+def _get_topology_version(dbsession):
+    last_collected_at, router_count = dbsession.query(
+        func.max(Router.last_collected_at), func.count(Router.hostname)).one()
+    scanners = dbsession.query(Scanner.name, Scanner.interface)
+    scanners = frozenset(
+        (name, str(interface)) for name, interface in scanners)
+    return last_collected_at, router_count, scanners
+
+
+def _build_adjacency(router_subnets, router_neighbors):
+    adjacency = defaultdict(set)
+    for hostname, neighbors in router_neighbors.items():
+        for neighbor in neighbors:
+            if neighbor in router_subnets and neighbor != hostname:
+                adjacency[hostname].add(neighbor)
+                adjacency[neighbor].add(hostname)
+    routers_by_subnet = defaultdict(set)
+    for hostname, subnets in router_subnets.items():
+        for subnet in subnets:
+            routers_by_subnet[subnet].add(hostname)
+    for hostnames in routers_by_subnet.values():
+        for hostname in hostnames:
+            adjacency[hostname] |= hostnames - {hostname}
+    return adjacency
+
+
+def _breadth_first_hops(sources, adjacency):
+    hops = {source: 0 for source in sources}
+    to_visit = deque(sources)
+    while to_visit:
+        visiting = to_visit.popleft()
+        for neighbor in adjacency[visiting]:
+            if neighbor not in hops:
+                hops[neighbor] = hops[visiting] + 1
+                to_visit.append(neighbor)
+    return hops
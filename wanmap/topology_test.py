@@ -0,0 +1,82 @@
+from ipaddress import ip_address, ip_interface, ip_network
+
+import pytest
+
+from .network import Router
+from .topology import get_topology, Topology
+
+
+@pytest.fixture
+def topology():
+    """A chain of routers: edge -- core -- branch -- remote."""
+    router_subnets = {
+        'edge': {ip_network('10.0.0.0/24'), ip_network('192.168.0.0/30')},
+        'core': {ip_network('10.1.0.0/24'), ip_network('192.168.0.0/30')},
+        'branch': {ip_network('10.2.0.0/24')},
+        'remote': {ip_network('10.3.0.0/24')},
+        'island': {ip_network('10.9.0.0/24')},
+    }
+    router_neighbors = {
+        'core': {'branch'},
+        'remote': {'branch', 'unknown'},
+    }
+    scanner_interfaces = {
+        'scanner-edge': ip_address('10.0.0.254'),
+        'scanner-remote': ip_address('10.3.0.254'),
+    }
+    return Topology(router_subnets, router_neighbors, scanner_interfaces)
+
+
+def test_topology_counts_hops_across_shared_subnets_and_lldp(topology):
+    assert topology.hops_from_scanner('scanner-edge') == {
+        'edge': 0, 'core': 1, 'branch': 2, 'remote': 3,
+    }
+
+
+def test_topology_nearest_scanner(topology):
+    assert topology.nearest_scanner('core') == 'scanner-edge'
+    assert topology.nearest_scanner('branch') == 'scanner-remote'
+
+
+def test_topology_nearest_scanner_breaks_ties_by_name():
+    topology = Topology(
+        {'r0': {ip_network('10.0.0.0/24')}}, {},
+        {'b': ip_address('10.0.0.2'), 'a': ip_address('10.0.0.3')})
+    assert topology.nearest_scanner('r0') == 'a'
+
+
+def test_topology_unreachable_router_has_no_scanner(topology):
+    assert topology.nearest_scanner('island') is None
+
+
+def test_topology_assigns_targets_to_nearest_scanners(topology):
+    assignments = topology.assign_targets({
+        ip_network('10.0.0.0/8'),
+    })
+    assert assignments == {
+        'scanner-edge': {
+            ip_network('10.0.0.0/24'), ip_network('10.1.0.0/24')},
+        'scanner-remote': {
+            ip_network('10.2.0.0/24'), ip_network('10.3.0.0/24')},
+    }
+
+
+def test_topology_routers_toward_targets(topology):
+    targets = {ip_network('10.2.0.0/25'), ip_network('10.0.0.0/24')}
+    assert topology.routers_toward('scanner-edge', targets) == {
+        'core', 'branch'}
+
+
+def test_topology_no_routers_toward_local_targets(topology):
+    targets = {ip_network('10.3.0.0/24')}
+    assert topology.routers_toward('scanner-remote', targets) == set()
+
+
+def test_get_topology_is_cached_until_rediscovery(
+    dbsession, fake_wan_scanners, fake_wan_routers):
+
+    topology = get_topology(dbsession)
+    assert get_topology(dbsession) is topology
+    dbsession.add(Router.create('r2', (ip_interface('10.3.0.1/24'),)))
+    dbsession.flush()
+    assert get_topology(dbsession) is not topology